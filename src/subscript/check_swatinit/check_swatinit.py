@@ -1,13 +1,16 @@
 """SWATINIT qc tool"""
 
 import argparse
+import glob
 import sys
-from typing import Any, Dict, List
+from pathlib import Path
+from typing import Dict, List, Optional, Union
 
 import numpy as np
 import pandas as pd
 import res2df
 from matplotlib import pyplot
+from opm.opmcommon_python import Deck
 
 import subscript
 from subscript.check_swatinit import plotter
@@ -21,6 +24,7 @@ from subscript.check_swatinit.constants import (
     __UNKNOWN__,
     __WATER__,
 )
+from subscript.ensemble import map_realizations, realization_files
 
 logger = subscript.getLogger(__name__)
 
@@ -35,10 +39,27 @@ QC_FLAGS = [
     __WATER__,
 ]
 
+QC_FLAG_DTYPE = pd.CategoricalDtype(QC_FLAGS)
+
 DESCRIPTION = "QC tool for SWATINIT vs SWAT in Eclipse runs"
 
 CATEGORY = "utility.eclipse"
 
+# Files with a cell based QC dataframe earlier exported by this tool:
+QC_FILE_SUFFIXES = (".csv", ".parquet")
+
+# Columns stored with compact dtypes in the cell based QC dataframe:
+REGION_VECTORS = ["EQLNUM", "FIPNUM", "SATNUM"]
+SATURATION_VECTORS = [
+    "SWATINIT",
+    "SWATINIT_DECK",
+    "SWAT",
+    "SWL",
+    "SWLPC",
+    "SWU",
+    "SWATINIT_SWAT",
+]
+
 EXAMPLES = """
 .. code-block:: console
 
@@ -56,20 +77,13 @@ def main() -> None:
     parser = get_parser()
     args = parser.parse_args()
 
-    if args.DATAFILE.endswith(".csv"):
-        qc_frame = pd.read_csv(args.DATAFILE)
-    else:
-        eclfiles = res2df.ResdataFiles(args.DATAFILE)
-
-        # Fail hard if the deck is not suitable for this tool or
-        # give warnings/hints to the user:
-        check_applicability(eclfiles)
-
-        qc_frame = make_qc_gridframe(eclfiles)
+    if glob.has_magic(args.DATAFILE):
+        main_ensemble(args)
+        return
 
-        if args.output != "":
-            logger.info("Exporting CSV to %s", args.output)
-            reorder_dframe_for_nonnans(qc_frame).to_csv(args.output, index=False)
+    qc_frame = load_qc_frame(args.DATAFILE)
+    if args.output != "" and not args.DATAFILE.endswith(QC_FILE_SUFFIXES):
+        write_qc_frame(qc_frame, args.output)
 
     if "SWATINIT" not in qc_frame:
         print("Model did not use SWATINIT")
@@ -95,7 +109,9 @@ def main() -> None:
     if (args.plotfile or args.plot) and args.eqlnum not in qc_frame["EQLNUM"].values:
         sys.exit(f"Error: EQLNUM {args.eqlnum} does not exist in grid. No plotting.")
     if args.plot or args.plotfile:
-        plotter.plot_qc_panels(qc_frame[qc_frame["EQLNUM"] == args.eqlnum])
+        plotter.plot_qc_panels(
+            qc_frame[qc_frame["EQLNUM"] == args.eqlnum], max_points=args.plotpoints
+        )
     if args.plot:
         pyplot.show()
     if args.plotfile:
@@ -103,6 +119,111 @@ def main() -> None:
         pyplot.savefig(args.plotfile)
 
 
+def main_ensemble(args: argparse.Namespace) -> None:
+    """Run the QC for all realizations matched by a glob pattern, print volume
+    statistics pr. QC flag and dump the volumes for all realizations to CSV
+    if requested."""
+    if args.plot or args.plotfile or args.volplot or args.volplotfile:
+        logger.warning("Plotting is not supported for multiple realizations")
+
+    volumes_df = check_swatinit_ensemble(
+        sorted(glob.glob(args.DATAFILE)), jobs=args.jobs, cellsoutput=args.cellsoutput
+    )
+    if volumes_df.empty:
+        sys.exit(f"Error: No realizations could be checked for {args.DATAFILE}")
+    pd.set_option("display.max_rows", 1000)
+    pd.set_option("display.width", 1000)
+    print(ensemble_volume_stats(volumes_df))
+    if args.output != "":
+        logger.info("Exporting CSV to %s", args.output)
+        volumes_df.to_csv(args.output, index=False)
+
+
+def load_qc_frame(datafile: str) -> pd.DataFrame:
+    """Load the cell based QC dataframe for an Eclipse run, or from a CSV or
+    Parquet file earlier exported by this tool"""
+    if datafile.endswith(".csv"):
+        return pd.read_csv(datafile)
+    if datafile.endswith(".parquet"):
+        return pd.read_parquet(datafile)
+
+    eclfiles = res2df.ResdataFiles(datafile)
+
+    # Fail hard if the deck is not suitable for this tool or
+    # give warnings/hints to the user:
+    check_applicability(eclfiles)
+
+    return make_qc_gridframe(eclfiles)
+
+
+def _realization_qc_volumes(
+    datafile: str, cellsoutput: Optional[str] = None
+) -> Dict[str, float]:
+    """Compute QC volumes for one realization, optionally writing the cell
+    based QC dataframe next to the DATA file"""
+    qc_frame = load_qc_frame(datafile)
+    if cellsoutput and not datafile.endswith(QC_FILE_SUFFIXES):
+        write_qc_frame(qc_frame, Path(datafile).parent / cellsoutput)
+    return qc_volumes(qc_frame)
+
+
+def check_swatinit_ensemble(
+    datafiles: List[str], jobs: int = 1, cellsoutput: Optional[str] = None
+) -> pd.DataFrame:
+    """Compute QC volumes for multiple realizations
+
+    The realization index is determined from "realization-<N>" in each
+    path. A realization that fails is logged and left out.
+
+    Args:
+        datafiles: Eclipse DATA files, or CSV files earlier exported by this
+            tool, one per realization.
+        jobs: Number of realizations to process in parallel in worker
+            processes.
+        cellsoutput: If given, the cell based QC dataframe for each realization
+            is written to a CSV file with this name, next to its DATA file.
+
+    Returns:
+        pd.DataFrame: Volumes from qc_volumes() in long format, with the columns
+        REAL, KEY and VOLUME.
+    """
+    results = map_realizations(
+        _realization_qc_volumes,
+        [
+            (real, (datafile, cellsoutput))
+            for real, datafile in realization_files(datafiles)
+        ],
+        jobs=jobs,
+    )
+    volumes_df = pd.DataFrame(
+        [
+            {"REAL": real, "KEY": key, "VOLUME": volume}
+            for real, qc_vols in results
+            for key, volume in qc_vols.items()
+        ],
+        columns=["REAL", "KEY", "VOLUME"],
+    )
+    logger.info(
+        "Checked %d of %d realizations", volumes_df["REAL"].nunique(), len(datafiles)
+    )
+    return volumes_df.sort_values(["REAL", "KEY"], ignore_index=True)
+
+
+def ensemble_volume_stats(volumes_df: pd.DataFrame) -> pd.DataFrame:
+    """Statistics over realizations for each volume from qc_volumes()
+
+    Args:
+        volumes_df: Volumes in long format, as from check_swatinit_ensemble()
+
+    Returns:
+        pd.DataFrame: Indexed by KEY, with the realization count, mean, standard
+        deviation, minimum and maximum of each volume.
+    """
+    return volumes_df.groupby("KEY")["VOLUME"].agg(
+        ["count", "mean", "std", "min", "max"]
+    )
+
+
 def check_applicability(eclfiles: res2df.ResdataFiles) -> None:
     """Check that the input is relevant for usage with check_swatinit. This
     function may raise exceptions, SystemExit or only give warnings"""
@@ -136,12 +257,45 @@ def check_applicability(eclfiles: res2df.ResdataFiles) -> None:
         )
 
 
+def write_qc_frame(qc_frame: pd.DataFrame, filename: Union[str, Path]) -> None:
+    """Write the cell based QC dataframe to CSV, or to Parquet if the
+    filename ends with .parquet. Parquet keeps the compact dtypes of the
+    dataframe, and is much faster to write and read for large models."""
+    qc_frame = reorder_dframe_for_nonnans(qc_frame)
+    if str(filename).endswith(".parquet"):
+        logger.info("Exporting Parquet to %s", filename)
+        qc_frame.to_parquet(filename, index=False)
+    else:
+        logger.info("Exporting CSV to %s", filename)
+        qc_frame.to_csv(filename, index=False)
+
+
+def compact_qc_frame(qc_frame: pd.DataFrame) -> pd.DataFrame:
+    """Store region numbers as the smallest integer type that can hold them
+    and saturations as float32, the precision they have in the binary output
+    from the simulator. QC_FLAG is made categorical.
+
+    Args:
+        qc_frame: Cell based QC dataframe, modified in place.
+
+    Returns:
+        The same dataframe.
+    """
+    for region in set(REGION_VECTORS).intersection(qc_frame.columns):
+        qc_frame[region] = pd.to_numeric(qc_frame[region], downcast="integer")
+    for saturation in set(SATURATION_VECTORS).intersection(qc_frame.columns):
+        qc_frame[saturation] = qc_frame[saturation].astype(np.float32)
+    if "QC_FLAG" in qc_frame:
+        qc_frame["QC_FLAG"] = qc_frame["QC_FLAG"].astype(QC_FLAG_DTYPE)
+    return qc_frame
+
+
 def reorder_dframe_for_nonnans(dframe: pd.DataFrame) -> pd.DataFrame:
     """Reorder a dataframe so that rows with less NaN comes first, this
     will aid data analysis application to deduce correct datatypes for
     columns"""
     null_count = "__NULL_COUNT__"
-    dframe[null_count] = dframe.isnull().sum(axis=1)
+    dframe = dframe.assign(**{null_count: dframe.isnull().sum(axis=1)})
     return (
         dframe.sort_values(null_count).drop(null_count, axis=1).reset_index(drop=True)
     )
@@ -219,7 +373,11 @@ def make_qc_gridframe(eclfiles: res2df.ResdataFiles) -> pd.DataFrame:
 
     Makes a dataframe with one row for each active cell. Information from
     satfunc and equil merged in.
+
+    The deck is parsed only once (it is cached in eclfiles), and all data
+    from it is mapped onto the single grid dataframe.
     """
+    deck = eclfiles.get_deck()
 
     grid_df = res2df.grid.df(
         eclfiles,
@@ -247,8 +405,8 @@ def make_qc_gridframe(eclfiles: res2df.ResdataFiles) -> pd.DataFrame:
     grid_df = grid_df.loc[:, ~grid_df.columns.duplicated()]
 
     # Merge in PPCWMAX from the deck, it is not reported in binary output files:
-    if "PPCWMAX" in eclfiles.get_deck():
-        grid_df["PPCWMAX"] = ppcwmax_gridvector(eclfiles)
+    if "PPCWMAX" in deck:
+        grid_df["PPCWMAX"] = map_ppcwmax(grid_df["SATNUM"], deck)
 
     # This will be unneccessary from res2df 0.13.0:
     grid_df = grid_df.where(grid_df > -1e20 + 1e13)
@@ -258,14 +416,13 @@ def make_qc_gridframe(eclfiles: res2df.ResdataFiles) -> pd.DataFrame:
         logger.warning("Consider adding FILLEPS to the PROPS section")
         grid_df["SWL"] = 0.0
 
-    deck = eclfiles.get_deck()
     if "SWATINIT" in deck:
-        swatinit_deckdata = deck["SWATINIT"][0][0].get_raw_data_list()
+        swatinit_deckdata = np.asarray(deck["SWATINIT"][0][0].get_raw_data_list())
         # This list includes non-active cells, we must map via GLOBAL_INDEX:
         # GLOBAL_INDEX is 0-indexed.
-        grid_df["SWATINIT_DECK"] = pd.Series(swatinit_deckdata)[
-            grid_df["GLOBAL_INDEX"].astype(int).tolist()
-        ].values
+        grid_df["SWATINIT_DECK"] = swatinit_deckdata.take(
+            grid_df["GLOBAL_INDEX"].to_numpy(dtype=int)
+        )
 
     if "SWATINIT" not in grid_df:
         # OPM-flow does not include SWATINIT in the INIT file.
@@ -281,12 +438,12 @@ def make_qc_gridframe(eclfiles: res2df.ResdataFiles) -> pd.DataFrame:
             del grid_df["SWATINIT_DECK"]  # This is not needed
 
     # Exposed to issues with endpoint scaling in peculiar decks:
-    satfunc_df = res2df.satfunc.df(eclfiles)
+    satfunc_df = res2df.satfunc.df(deck)
 
     # Merge in the input pcmax pr. satnum for each cell:
     grid_df = merge_pc_max(grid_df, satfunc_df)
 
-    grid_df = merge_equil(grid_df, res2df.equil.df(eclfiles, keywords=["EQUIL"]))
+    grid_df = merge_equil(grid_df, res2df.equil.df(deck, keywords=["EQUIL"]))
 
     grid_df = augment_grid_frame_qc_vectors(grid_df)
 
@@ -306,7 +463,7 @@ def make_qc_gridframe(eclfiles: res2df.ResdataFiles) -> pd.DataFrame:
     if "PC_SCALING" in grid_df:
         grid_df["PC"] = compute_pc(grid_df, satfunc_df)
 
-    return grid_df
+    return compact_qc_frame(grid_df)
 
 
 def qc_flag(qc_frame: pd.DataFrame) -> pd.DataFrame:
@@ -423,7 +580,7 @@ def qc_flag(qc_frame: pd.DataFrame) -> pd.DataFrame:
     # feature request:
     qc_col.fillna(__UNKNOWN__, inplace=True)
 
-    return qc_col
+    return qc_col.astype(QC_FLAG_DTYPE)
 
 
 def qc_volumes(qc_frame: pd.DataFrame) -> Dict[str, float]:
@@ -449,9 +606,14 @@ def qc_volumes(qc_frame: pd.DataFrame) -> Dict[str, float]:
             watergains[qc_cat] = 0.0
 
         # Overwrite dict values with correct figures:
-        for qc_cat, qc_subframe in qc_frame.groupby("QC_FLAG"):
+        # Saturations may be float32, compute volumes in double precision:
+        for qc_cat, qc_subframe in qc_frame.groupby("QC_FLAG", observed=True):
             watergains[qc_cat] = (
-                (qc_subframe["SWAT"] - qc_subframe["SWATINIT"]) * qc_subframe["PORV"]
+                (
+                    qc_subframe["SWAT"].astype(np.float64)
+                    - qc_subframe["SWATINIT"].astype(np.float64)
+                )
+                * qc_subframe["PORV"]
             ).sum()
 
     # Extra figures:
@@ -470,16 +632,20 @@ def qc_volumes(qc_frame: pd.DataFrame) -> Dict[str, float]:
 
 
 def _evaluate_pc(
-    swats: List[float],
-    scale_vert: List[float],
-    swls: List[float],
-    swus: List[float],
+    swats: Union[List[float], np.ndarray],
+    scale_vert: Union[List[float], np.ndarray],
+    swls: Optional[Union[List[float], np.ndarray]],
+    swus: Optional[Union[List[float], np.ndarray]],
     satfunc: pd.DataFrame,
     sat_name: str = "SW",
     pc_name: str = "PCOW",
-) -> List[Any]:
+) -> np.ndarray:
     """Evaluate pc as a function of saturation on a scaled Pc-curve
 
+    Instead of scaling the saturation axis of the curve for every cell, each
+    water saturation is mapped back to the unscaled saturation axis, so that
+    all cells can be interpolated in the curve at once.
+
     Args:
         swats: floats with water saturation values
         scale_vert: floats with vertical scalers for pc
@@ -496,23 +662,32 @@ def _evaluate_pc(
     Returns:
         Computed capillary pressure values.
     """
-    p_cap = []
+    swats = np.asarray(swats, dtype=np.float64)
     sw_min = satfunc[sat_name].min()
     sw_max = satfunc[sat_name].max()
-    if swls is None:
-        swls = [sw_min] * len(swats)
-    if swus is None:
-        swus = [sw_max] * len(swats)
-    for swat, pc_scaling, swl, swu in zip(swats, scale_vert, swls, swus):
-        p_cap.append(
-            np.interp(
-                swat,
-                swl
-                + (satfunc[sat_name].values - sw_min) / (sw_max - sw_min) * (swu - swl),
-                satfunc[pc_name].values * pc_scaling,
-            )
+    if swls is None and swus is None:
+        sw_unscaled = swats
+    else:
+        swls = (
+            np.full(swats.shape, sw_min)
+            if swls is None
+            else np.asarray(swls, dtype=np.float64)
         )
-    return p_cap
+        swus = (
+            np.full(swats.shape, sw_max)
+            if swus is None
+            else np.asarray(swus, dtype=np.float64)
+        )
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sw_unscaled = (swats - swls) / (swus - swls) * (sw_max - sw_min) + sw_min
+        # A curve scaled to zero width is a step from its first to its last value:
+        collapsed = swus == swls
+        sw_unscaled[collapsed] = np.where(
+            swats[collapsed] < swls[collapsed], sw_min, sw_max
+        )
+    return np.interp(
+        sw_unscaled, satfunc[sat_name].values, satfunc[pc_name].values
+    ) * np.asarray(scale_vert, dtype=np.float64)
 
 
 def compute_pc(qc_frame: pd.DataFrame, satfunc_df: pd.DataFrame) -> pd.Series:
@@ -590,18 +765,34 @@ def ppcwmax_gridvector(eclfiles: res2df.ResdataFiles) -> pd.Series:
     Returns:
         pd.Series, indexed according to res2df.grid.df(eclfiles)
     """
-
     satnum_df = res2df.grid.df(eclfiles, vectors="SATNUM")
-    deck = eclfiles.get_deck()
-    for satnum in satnum_df["SATNUM"].unique():
-        ppcwmax = deck["PPCWMAX"][satnum - 1][0].get_raw_data_list()[0]
-        satnum_df.loc[satnum_df["SATNUM"] == satnum, "PPCWMAX"] = ppcwmax
-    return satnum_df["PPCWMAX"]
+    return map_ppcwmax(satnum_df["SATNUM"], eclfiles.get_deck())
+
+
+def map_ppcwmax(satnums: pd.Series, deck: Deck) -> pd.Series:
+    """Map PPCWMAX pr. SATNUM in a parsed deck onto cells
+
+    Args:
+        satnums: SATNUM for each cell
+        deck: Parsed deck with the PPCWMAX keyword
+
+    Returns:
+        pd.Series, with the same index as satnums
+    """
+    ppcwmax = pd.Series(
+        [record[0].get_raw_data_list()[0] for record in deck["PPCWMAX"]],
+        index=range(1, len(deck["PPCWMAX"]) + 1),
+    )
+    return satnums.map(ppcwmax).rename("PPCWMAX")
 
 
 def merge_equil(grid_df: pd.DataFrame, equil_df: pd.DataFrame) -> pd.DataFrame:
     """Merge z, datum_pressure, contact information and oip_init settting from
-    an EQUIL dataframe into the grid dataframe"""
+    an EQUIL dataframe into the grid dataframe
+
+    Returns:
+        pd.DataFrame: A copy of the grid dataframe with the extra columns
+    """
     assert "EQLNUM" in grid_df, "Grid dataframe must have the EQLNUM column"
     assert not equil_df.empty, "EQUIL dataframe is empty"
     assert "Z" in equil_df
@@ -622,7 +813,10 @@ def merge_equil(grid_df: pd.DataFrame, equil_df: pd.DataFrame) -> pd.DataFrame:
     assert (
         not pd.isnull(equil_df).any().any()
     ), f"BUG: NaNs in equil dataframe:\n{equil_df}"
-    return grid_df.merge(equil_df, on="EQLNUM", how="left")
+    equil_df = equil_df.set_index("EQLNUM")
+    return grid_df.assign(
+        **{column: grid_df["EQLNUM"].map(equil_df[column]) for column in equil_df}
+    )
 
 
 def merge_pc_max(
@@ -632,6 +826,9 @@ def merge_pc_max(
     saturation tables (SWOF/SWFN) pr. SATNUM and merges that
     into a grid dataframe (pr cell)
 
+    Cells with a SATNUM not in the saturation function dataframe are
+    left out.
+
     Returns:
         pd.Dataframe: One row pr cell with an extra column PCOW_NAX
     """
@@ -640,8 +837,16 @@ def merge_pc_max(
     if satfunc_df.empty:
         raise ValueError("Saturation function dataframe is empty")
     max_pc = satfunc_df.groupby("SATNUM")[pc_name].max()
-    max_pc.name = pc_name + "_MAX"
-    return grid_df.merge(max_pc.reset_index(), on="SATNUM")
+    matched = grid_df["SATNUM"].isin(max_pc.index)
+    if not matched.all():
+        logger.warning(
+            "Skipping %d cells with SATNUM not in saturation functions: %s",
+            (~matched).sum(),
+            sorted(grid_df.loc[~matched, "SATNUM"].unique()),
+        )
+    return grid_df[matched].assign(
+        **{pc_name + "_MAX": grid_df.loc[matched, "SATNUM"].map(max_pc)}
+    )
 
 
 def augment_grid_frame_qc_vectors(grid_df: pd.DataFrame) -> pd.DataFrame:
@@ -674,14 +879,19 @@ def get_parser() -> argparse.ArgumentParser:
             "Eclipse DATA-file for a finished run with restart data. "
             "It is also possible to provide a CSV file that has earlier "
             "been exported by this tool, which will trigger a rerun of "
-            "the volumetric report and plotting."
+            "the volumetric report and plotting. A glob pattern, quoted, "
+            "will check all matching realizations in an ensemble."
         ),
     )
     parser.add_argument(
         "-o",
         "--output",
         default="",
-        help="Output filename for CSV that can be used for QC in other tools",
+        help=(
+            "Output filename for CSV that can be used for QC in other tools. "
+            "If the filename ends with .parquet, Parquet is written instead, "
+            "which is much smaller and faster for large models."
+        ),
     )
     parser.add_argument(
         "--volplot",
@@ -716,6 +926,30 @@ def get_parser() -> argparse.ArgumentParser:
             "Does not affect CSV output"
         ),
     )
+    parser.add_argument(
+        "--plotpoints",
+        type=int,
+        help=(
+            "Maximal number of cells in scatter QC plots. Cells are sampled "
+            "pr. QC flag and depth band, keeping rare QC flags. "
+            "Volumes are always computed from all cells. Default is all cells."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of realizations to process in parallel, for glob patterns",
+    )
+    parser.add_argument(
+        "--cellsoutput",
+        type=str,
+        help=(
+            "For glob patterns, write the cell based CSV for each realization "
+            "to a file with this name next to its DATA-file. With glob patterns "
+            "--output is used for the volumes of all realizations."
+        ),
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -30,7 +30,10 @@ QC_PALETTE = {
 
 
 def plot_qc_panels(
-    qc_frame: pd.DataFrame, eqlnum: Optional[int] = None, show: bool = False
+    qc_frame: pd.DataFrame,
+    eqlnum: Optional[int] = None,
+    show: bool = False,
+    max_points: Optional[int] = None,
 ) -> None:
     """Make a plotting panel (multiple plots) on cell-based dataframe.
 
@@ -40,12 +43,21 @@ def plot_qc_panels(
         qc_frame (pd.Dataframe): Dataframe constructed by check_swatinit
         eqlnum (int): Restrict plotting to this EQLNUM. If None, the qc_frame must have
             only one unique value for EQLNUM
+        max_points (int): If not None, plot only a sample of about this many
+            cells, see sample_qc_frame().
     Returns:
         pyplot handle
     """
 
     if eqlnum is not None:
         qc_frame = qc_frame[qc_frame["EQLNUM"] == eqlnum]
+    if max_points is not None:
+        qc_frame = sample_qc_frame(qc_frame, max_points)
+    if isinstance(qc_frame["QC_FLAG"].dtype, pd.CategoricalDtype):
+        # Only QC flags present in the cells should be in the legends:
+        qc_frame = qc_frame.assign(
+            QC_FLAG=qc_frame["QC_FLAG"].cat.remove_unused_categories()
+        )
 
     assert (
         len(qc_frame["EQLNUM"].unique()) == 1
@@ -70,6 +82,52 @@ def plot_qc_panels(
         pyplot.show()
 
 
+def sample_qc_frame(
+    qc_frame: pd.DataFrame, max_points: int, depth_bands: int = 50, seed: int = 0
+) -> pd.DataFrame:
+    """Sample cells for plotting, stratified by QC_FLAG and depth.
+
+    The cells are divided into strata, one for each QC flag in each of a
+    number of equally thick depth bands. As many cells as possible are kept
+    from each stratum, with the same upper limit for all strata, such that
+    at most max_points cells are kept in total. Sparsely populated strata,
+    like a QC flag occurring in only a few cells, are thus kept complete,
+    while the densest strata are thinned.
+
+    Args:
+        qc_frame: Cell based dataframe constructed by check_swatinit.
+        max_points: Maximum number of cells to keep, but at least one cell
+            is kept from each stratum.
+        depth_bands: Number of depth bands between the shallowest and the
+            deepest cell.
+        seed: Seed for the random sampling within each stratum.
+
+    Returns:
+        pd.DataFrame: A subset of the rows in qc_frame, in the same order.
+    """
+    if len(qc_frame) <= max_points:
+        return qc_frame
+    positions = np.random.default_rng(seed).permutation(len(qc_frame))
+    shuffled = qc_frame.iloc[positions]
+    strata = [pd.cut(shuffled["Z"], depth_bands, labels=False)]
+    if "QC_FLAG" in shuffled:
+        strata.append(shuffled["QC_FLAG"])
+    grouped = shuffled.groupby(strata, observed=True, dropna=False)
+    sizes = np.sort(grouped.size().to_numpy())
+
+    # The largest number of cells to keep pr. stratum, when strata with fewer
+    # cells are kept complete and at most max_points are kept in total:
+    kept = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    caps = (max_points - kept) // np.arange(len(sizes), 0, -1)
+    capped = caps < sizes
+    cap = max(caps[np.argmax(capped)], 1) if capped.any() else sizes[-1]
+
+    # The cells are shuffled, so the first cells in each stratum are random:
+    keep = np.zeros(len(qc_frame), dtype=bool)
+    keep[positions[grouped.cumcount().to_numpy() < cap]] = True
+    return qc_frame[keep]
+
+
 def visual_depth(qc_frame: pd.DataFrame) -> float:
     """Suggest a deep depth limit for what to plot, in order to avoid
     showing too much of a less interesting water zone"""
@@ -0,0 +1,76 @@
+"""Utilities for tools that process files from each realization in an ensemble"""
+
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from subscript import getLogger
+
+logger = getLogger(__name__)
+
+REAL_REGEXP = r".*realization-(\d+)/.*"
+
+T = TypeVar("T")
+
+
+def realization_files(filenames: List[str]) -> List[Tuple[int, str]]:
+    """Determine the realization index for each file from "realization-<N>"
+    in its path.
+
+    Files where no realization index is found are logged and skipped.
+
+    Returns:
+        List of tuples with realization index and filename.
+    """
+    realizations = []
+    for filename in filenames:
+        real_match = re.match(REAL_REGEXP, filename)
+        if real_match is None:
+            logger.warning("No realization index found for %s, skipping", filename)
+            continue
+        realizations.append((int(real_match.group(1)), filename))
+    return realizations
+
+
+def _call_or_none(func: Callable[..., T], real: int, args: tuple) -> Optional[T]:
+    """Call a function for one realization, logging errors instead of raising
+    them, suitable for running in a worker process"""
+    try:
+        return func(*args)
+    except (Exception, SystemExit) as err:
+        logger.warning("Skipping realization %d, it failed with: %s", real, err)
+        return None
+
+
+def map_realizations(
+    func: Callable[..., T], tasks: List[Tuple[int, tuple]], jobs: int = 1
+) -> List[Tuple[int, T]]:
+    """Call a function with the arguments for each realization.
+
+    A realization for which the function raises an exception (or exits)
+    is logged and left out of the results.
+
+    Args:
+        func: Function to call, it must be defined at module level
+            if jobs > 1.
+        tasks: Tuples with realization index and the arguments to func.
+        jobs: Number of realizations to process in parallel in worker
+            processes.
+
+    Returns:
+        Tuples with realization index and the return value of func, in
+        the order of the tasks.
+    """
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [
+                executor.submit(_call_or_none, func, real, args) for real, args in tasks
+            ]
+            results = [future.result() for future in futures]
+    else:
+        results = [_call_or_none(func, real, args) for real, args in tasks]
+    return [
+        (real, result)
+        for (real, _), result in zip(tasks, results)
+        if result is not None
+    ]
@@ -9,20 +9,23 @@ from typing import Any, Dict, List, Optional, Tuple
 import xtgeo
 import yaml
 from pydantic import BaseModel, Field, FilePath, field_validator
-from resdata.gravimetry import ResdataGrav, ResdataSubsidence
 from resdata.grid import Grid
 from resdata.resfile import ResdataFile
 from typing_extensions import Annotated
 
 import subscript
+from subscript.grav_subs_maps.modelling import (
+    FarFieldCalc,
+    add_geometry_cache,
+    gravity_changes,
+    load_gravity_surveys,
+    map_shared,
+    shared_data,
+    subsidence_task,
+)
 
 logger = subscript.getLogger(__name__)
 
-# Constant for subsidence modelling, not influencing results
-# since subsidence is calculated from porevolume change
-# therefore defaulted
-DUMMY_YOUNGS = 0.5
-
 PREFIX_GRAVSURF = "all--delta_gravity_"
 PREFIX_SUBSSURF = "all--subsidence"
 
@@ -51,6 +54,10 @@ EPILOGUE = """
       poisson_ratio: 0.45  # For subsidence calulcations, used in Geertsma model
       coarsening: 8        # Coarsening factor for maps to speed up calculations
       phases: ['gas', 'oil','water', 'total']  # One map for each phase specified
+      far_field:  # Optional, approximate contributions from distant cells
+        block_size: [8, 8, 4]  # Cells in i, j and k in each aggregated block
+        distance_ratio: 5  # Aggregate blocks at least this many block radii
+                           # away, larger values give more accurate results
 
 """
 
@@ -84,6 +91,7 @@ class GravMapsCalc(BaseModel):
     poisson_ratio: Annotated[float, Field(strict=True, ge=0, le=0.5)]
     coarsening: Optional[Annotated[int, Field(strict=True, ge=1)]] = None
     phases: List[str]
+    far_field: Optional[FarFieldCalc] = None
 
     @field_validator("phases")
     @classmethod
@@ -136,6 +144,39 @@ def get_parser() -> argparse.ArgumentParser:
         help="Path to directory for output maps. Directory must exist.",
         default="./",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["numpy", "resdata"],
+        default="numpy",
+        help=(
+            "How to evaluate gravity and subsidence. numpy evaluates all map "
+            "nodes and phases at once, resdata evaluates one map node and phase "
+            "at a time."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of difference dates and phases to model in parallel",
+    )
+    parser.add_argument(
+        "--survey-cache",
+        type=Path,
+        help=(
+            "Path to .npz file for caching the surveys read from the UNRST file, "
+            "to speed up reruns. Only used with the numpy engine."
+        ),
+    )
+    parser.add_argument(
+        "--geometry-cache",
+        type=Path,
+        help=(
+            "Directory for caching the grid geometry part of the modelling, "
+            "for reuse by other realizations with the same grid. "
+            "Only used with the numpy engine."
+        ),
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -161,7 +202,16 @@ def main() -> None:
     if not Path(args.UNRSTfile).exists():
         sys.exit("UNRST file does not exist:" + args.UNRSTfile)
 
-    main_gravmaps(args.UNRSTfile, config, Path(args.root_path), Path(args.outputdir))
+    main_gravmaps(
+        args.UNRSTfile,
+        config,
+        Path(args.root_path),
+        Path(args.outputdir),
+        engine=args.engine,
+        jobs=args.jobs,
+        survey_cache=args.survey_cache,
+        geometry_cache=args.geometry_cache,
+    )
 
 
 def prepend_root_path_to_relative_files(
@@ -195,6 +245,10 @@ def main_gravmaps(
     config: Dict[str, Any],
     root_path: Optional[Path],
     output_folder: Path,
+    engine: str = "numpy",
+    jobs: int = 1,
+    survey_cache: Optional[Path] = None,
+    geometry_cache: Optional[Path] = None,
 ) -> None:
     """
     Process a configuration, model gravity and subsidence surfaces and write to disk.
@@ -202,6 +256,14 @@ def main_gravmaps(
     Args:
         resdata: Path to flow simulation UNRST file
         config: Configuration for modelling
+        engine: "numpy" for evaluating gravity and subsidence for all map nodes
+            at once, or "resdata" for evaluating node by node with ResdataGrav
+            and ResdataSubsidence.
+        jobs: Number of worker processes for difference dates and phases.
+        survey_cache: Path to .npz file for caching surveys, for the numpy
+            engine.
+        geometry_cache: Directory for caching kernel matrices, shared by
+            realizations with the same grid, for the numpy engine.
     """
 
     if root_path is not None:
@@ -215,10 +277,12 @@ def main_gravmaps(
     coarsening = cfg["calculations"]["coarsening"]
     phases = cfg["calculations"]["phases"]
     poisson_ratio = cfg["calculations"]["poisson_ratio"]
+    far_field = cfg["calculations"]["far_field"]
 
     # Read seabed map and coarsen
     seabed = xtgeo.surface_from_file(map_template)
-    seabed.coarsen(coarsening)
+    if coarsening is not None:
+        seabed.coarsen(coarsening)
 
     if isinstance(unrst_file, str):
         restart_file = unrst_file[:-6] + ".UNRST"
@@ -226,13 +290,6 @@ def main_gravmaps(
         init_file = unrst_file[:-6] + ".INIT"
         grid = Grid(egrid_file)
         init = ResdataFile(init_file)
-        rest = ResdataFile(restart_file)
-
-    restart_index = {}
-
-    # From restart datetime format to YYYYMMDD as key
-    for i, restart_date in enumerate(rest.dates):
-        restart_index[restart_date.strftime("%Y%m%d")] = i
 
     diffdates = []
     # Convert dates from datetime format to strings
@@ -242,47 +299,29 @@ def main_gravmaps(
         diffdates.append(diff)
         logger.info(f"{diffdate[0]}_{diffdate[1]}")
 
-    grav = ResdataGrav(grid, init)
-    subsidence = ResdataSubsidence(grid, init)
-
-    added_dates = []
-
-    for diffdate in diffdates:
-        for singledate in diffdate:  # base and monitor
-            rsb = rest.restartView(0)
-            if singledate not in added_dates:
-                if singledate in restart_index:
-                    rsb = rest.restartView(restart_index[singledate])
-                    grav.add_survey_RFIP(singledate, rsb)
-                    subsidence.add_survey_PRESSURE(singledate, rsb)
-                    added_dates.append(singledate)
-                else:
-                    logger.error(
-                        f"Date {singledate} specified but not found in UNRST file."
-                    )
-                    sys.exit(1)
-    phase_code = {"oil": 1, "gas": 2, "water": 4, "total": 7}
+    gravity_surveys, subsidence_surveys = load_gravity_surveys(
+        engine, restart_file, grid, init, diffdates, survey_cache
+    )
+    nodes = seabed.get_dataframe()[["X_UTME", "Y_UTMN", "VALUES"]].to_numpy()
+    shared = shared_data(
+        engine,
+        grid,
+        init,
+        gravity_surveys,
+        subsidence_surveys,
+        poisson_ratio,
+        far_field,
+    )
+    shared["grav_points"] = {tuple(diffdate): nodes for diffdate in diffdates}
+    shared["subs_points"] = {tuple(diffdate): nodes for diffdate in diffdates}
+    add_geometry_cache(shared, geometry_cache)
 
     # Gravity
+    gravity_maps = gravity_changes(shared, diffdates, phases, jobs)
     for diffdate in diffdates:
         for phase in phases:
-            logger.info(
-                f"Calculating delta gravity map from {phase} "
-                f"for {diffdate[0]}_{diffdate[1]}"
-            )
             dgsim = seabed.copy()
-            df_dgsim = dgsim.get_dataframe()
-            dgsim_series = []
-            for index, row in df_dgsim.iterrows():
-                dgsim_series.append(
-                    grav.eval(
-                        diffdate[1],
-                        diffdate[0],
-                        (row["X_UTME"], row["Y_UTMN"], row["VALUES"]),
-                        phase_mask=phase_code[phase],
-                    )
-                )
-            dgsim.values = dgsim_series
+            dgsim.values = gravity_maps[(tuple(diffdate), phase)]
             filename = (
                 PREFIX_GRAVSURF
                 + phase
@@ -295,24 +334,12 @@ def main_gravmaps(
             dgsim.to_file(os.path.join(output_folder, filename))
 
     # Subsidence
-    for diffdate in diffdates:
-        logger.info(f"Calculating subsidence map for {diffdate[0]}_{diffdate[1]}")
+    subsidence_maps = map_shared(
+        subsidence_task, shared, [(diffdate,) for diffdate in diffdates], jobs
+    )
+    for diffdate, dzsim_series in zip(diffdates, subsidence_maps):
         dzsim = seabed.copy()
-        df_dzsim = dzsim.get_dataframe()
-        dzsim_series = []
-        for index, row in df_dzsim.iterrows():
-            dzsim_series.append(
-                subsidence.eval_geertsma_rporv(
-                    diffdate[1],
-                    diffdate[0],
-                    (row["X_UTME"], row["Y_UTMN"], row["VALUES"]),
-                    DUMMY_YOUNGS,
-                    poisson_ratio,
-                    row["VALUES"],
-                )
-            )
-
-        dzsim.values = [i * 100 for i in dzsim_series]  # From m to cms
+        dzsim.values = dzsim_series * 100  # From m to cms
 
         filename = PREFIX_SUBSSURF + "--" + diffdate[0] + "_" + diffdate[1] + ".gri"
         dzsim.to_file(os.path.join(output_folder, filename))
@@ -0,0 +1,502 @@
+"""Vectorized modelling of gravity change and subsidence from flow simulation
+output
+
+The functions here evaluate the same sums over grid cells as
+``ResdataGrav.eval()`` and ``ResdataSubsidence.eval_geertsma_rporv()`` in
+resdata, but for many target points (map nodes or stations) at a time. The
+contributions are computed as matrix products over blocks of target points and
+cells, with the block size bounding the memory usage, and for several weight
+vectors (phases and difference dates) at once.
+"""
+
+import functools
+import hashlib
+import os
+from pathlib import Path
+from typing import Callable, Dict, Iterator, Mapping, Optional, Sequence
+
+import numpy as np
+from resdata.grid import Grid
+from resdata.resfile import ResdataFile
+
+from subscript import getLogger
+
+logger = getLogger(__name__)
+
+# Gravitational constant, scaled to give microGal for masses in kg
+# and distances in meters:
+GRAV_CONSTANT = 6.67428e-3
+
+# Number of (target point, cell) pairs to evaluate at a time:
+BLOCKSIZE = 2**21
+
+# Default ratio between the distance to a coarse block and its radius for the
+# block to be aggregated in far field approximations:
+DISTANCE_RATIO = 5.0
+
+# Maximal number of target points sharing near field cells:
+TILESIZE = 256
+
+# Maximal number of (target point, cell) pairs in cached kernel matrices, which
+# are stored as float32:
+GEOMETRY_CACHE_LIMIT = 2**28
+
+# Restart keywords for reservoir fluid in place and density for each phase:
+PHASE_KEYWORDS = {
+    "oil": ("RFIPOIL", "OIL_DEN"),
+    "gas": ("RFIPGAS", "GAS_DEN"),
+    "water": ("RFIPWAT", "WAT_DEN"),
+}
+
+# Phases included for each phase name in configuration files:
+PHASE_COMPONENTS = {
+    "oil": ["oil"],
+    "gas": ["gas"],
+    "water": ["water"],
+    "total": ["oil", "gas", "water"],
+}
+
+
+def active_cells(grid: Grid, init: ResdataFile) -> np.ndarray:
+    """Boolean mask over active cells, which is False for numerical
+    aquifer cells (negative AQUIFERN in the INIT file), as these do not
+    contribute to gravity or subsidence"""
+    mask = np.ones(grid.get_num_active(), dtype=bool)
+    if "AQUIFERN" in init:
+        mask &= init["AQUIFERN"][0].numpy_view() >= 0
+    return mask
+
+
+def cell_centres(grid: Grid) -> np.ndarray:
+    """Centre coordinates of all active cells, as an array with columns
+    x, y and depth"""
+    return grid.export_position(grid.export_index(active_only=True))
+
+
+def cell_blocks(grid: Grid, block_size: Sequence[int]) -> np.ndarray:
+    """Coarse block number for all active cells, grouping cells in boxes of
+    block_size (i, j, k) grid cells"""
+    ijk = grid.export_index(active_only=True)[["i", "j", "k"]].to_numpy()
+    _, block_ids = np.unique(ijk // np.asarray(block_size), axis=0, return_inverse=True)
+    return block_ids.ravel()
+
+
+def phase_masses(
+    survey: Mapping[str, np.ndarray], date: Optional[str] = None
+) -> Dict[str, np.ndarray]:
+    """Fluid mass (kg) in each active cell for each phase present in a
+    survey, computed from reservoir fluid in place and density.
+
+    A phase with missing keywords is left out, with a warning.
+
+    Args:
+        survey: Restart arrays for one survey.
+        date: Survey date, for messages.
+    """
+    masses = {}
+    for phase, (rfip_kw, den_kw) in PHASE_KEYWORDS.items():
+        missing = [keyword for keyword in (rfip_kw, den_kw) if keyword not in survey]
+        if missing:
+            logger.warning(
+                "No %s mass in survey at %s, %s not found",
+                phase,
+                date,
+                " and ".join(missing),
+            )
+            continue
+        masses[phase] = survey[rfip_kw].astype(np.float64) * survey[den_kw]
+    return masses
+
+
+def pore_volumes(
+    survey: Mapping[str, np.ndarray], date: Optional[str] = None
+) -> np.ndarray:
+    """Reservoir pore volume (RPORV) in each active cell in a survey
+
+    Args:
+        survey: Restart arrays for one survey.
+        date: Survey date, for messages.
+
+    Raises:
+        ValueError: if RPORV is not in the survey.
+    """
+    if "RPORV" not in survey:
+        raise ValueError(f"RPORV not found in survey at {date}")
+    return survey["RPORV"].astype(np.float64)
+
+
+def mass_change(
+    base_masses: Dict[str, np.ndarray],
+    monitor_masses: Dict[str, np.ndarray],
+    phase: str,
+) -> np.ndarray:
+    """Change in fluid mass for each cell from the base to the monitor survey,
+    for a phase name as used in configuration files (including "total")"""
+    change = np.zeros_like(next(iter(base_masses.values())))
+    for component in PHASE_COMPONENTS[phase]:
+        if component in base_masses and component in monitor_masses:
+            change += monitor_masses[component] - base_masses[component]
+    return change
+
+
+def gravity_kernel(cells: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """Vertical gravity contribution per unit mass for a block of cells
+    at a block of target points, as a (points x cells) matrix, without the
+    gravitational constant.
+
+    Args:
+        cells: Cell centres, with columns x, y and depth.
+        points: Target points, with columns x, y and depth.
+    """
+    dist_x = cells[np.newaxis, :, 0] - points[:, np.newaxis, 0]
+    dist_y = cells[np.newaxis, :, 1] - points[:, np.newaxis, 1]
+    dist_z = cells[np.newaxis, :, 2] - points[:, np.newaxis, 2]
+    dist = np.sqrt(dist_x * dist_x + dist_y * dist_y + dist_z * dist_z)
+    return dist_z / (dist * dist * dist)
+
+
+def blocked_sum(
+    kernel: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    cells: np.ndarray,
+    weights: np.ndarray,
+    points: np.ndarray,
+    blocksize: int = BLOCKSIZE,
+) -> np.ndarray:
+    """Sum kernel contributions from all cells at all target points.
+
+    The (points x cells) kernel matrix is never formed in full, only for
+    blocks with at most ``blocksize`` elements at a time.
+
+    Args:
+        kernel: Function giving the (points x cells) kernel matrix for a block
+            of cells and a block of points.
+        cells: Cell data passed on to the kernel, one row per cell.
+        weights: Weight for each cell, either one vector, or a matrix with one
+            column for each weighting to sum with.
+        points: Target point data passed on to the kernel, one row per point.
+        blocksize: Maximal number of (point, cell) pairs in each block.
+
+    Returns:
+        The weighted sums for each point, with one column for each weight
+        column if weights is a matrix.
+    """
+    weights_2d = weights if weights.ndim == 2 else weights[:, np.newaxis]
+    result = np.zeros((len(points), weights_2d.shape[1]))
+    cell_step = max(1, min(len(cells), blocksize))
+    point_step = max(1, blocksize // cell_step)
+    for cell_start in range(0, len(cells), cell_step):
+        cell_block = slice(cell_start, cell_start + cell_step)
+        for point_start in range(0, len(points), point_step):
+            point_block = slice(point_start, point_start + point_step)
+            kernel_block = kernel(cells[cell_block], points[point_block])
+            result[point_block] += kernel_block @ weights_2d[cell_block]
+    return result.reshape((len(points),) + weights.shape[1:])
+
+
+def _point_tiles(points: np.ndarray, tilesize: int) -> Iterator[np.ndarray]:
+    """Split target points into spatially compact tiles of at most tilesize
+    points, by recursive median splits along the longest horizontal extent,
+    yielding the indices of the points in each tile"""
+    stack = [np.arange(len(points))]
+    while stack:
+        indices = stack.pop()
+        if len(indices) <= tilesize:
+            yield indices
+            continue
+        coords = points[indices, :2]
+        axis = int(np.argmax(coords.max(axis=0) - coords.min(axis=0)))
+        order = np.argsort(coords[:, axis], kind="stable")
+        half = len(indices) // 2
+        stack += [indices[order[:half]], indices[order[half:]]]
+
+
+def far_field_sum(
+    kernel: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    cells: np.ndarray,
+    weights: np.ndarray,
+    points: np.ndarray,
+    block_ids: np.ndarray,
+    distance_ratio: float = DISTANCE_RATIO,
+    blocksize: int = BLOCKSIZE,
+    tilesize: int = TILESIZE,
+) -> np.ndarray:
+    """Approximate the sum of kernel contributions from all cells at all target
+    points, aggregating coarse blocks of cells far from the points.
+
+    The weights of the cells in each coarse block are summed and placed at the
+    centroid of the block. The target points are split into spatially compact
+    tiles, and a block is aggregated for all points in a tile when its centroid
+    is at least distance_ratio times the block radius (largest distance from
+    the centroid to a cell in the block) away from every point in the tile.
+    Contributions from other blocks are summed cell by cell. The error
+    decreases with increasing distance_ratio, and the result is exact when no
+    blocks are aggregated.
+
+    Args:
+        kernel: Function giving the (points x cells) kernel matrix for a block
+            of cells and a block of points.
+        cells: Cell centres, with columns x, y and depth.
+        weights: Weight for each cell, either one vector, or a matrix with one
+            column for each weighting to sum with.
+        points: Target point data passed on to the kernel, one row per point,
+            with x, y and depth in the first three columns.
+        block_ids: Coarse block number for each cell, numbered from zero.
+        distance_ratio: Smallest ratio between the distance to a block and
+            the block radius for the block to be aggregated.
+        blocksize: Maximal number of (point, cell) pairs in each block of
+            kernel evaluations.
+        tilesize: Maximal number of target points in each tile.
+
+    Returns:
+        The approximate weighted sums for each point, with one column for each
+        weight column if weights is a matrix.
+    """
+    weights_2d = weights if weights.ndim == 2 else weights[:, np.newaxis]
+    block_count = np.bincount(block_ids)
+    centroids = np.column_stack(
+        [np.bincount(block_ids, cells[:, dim]) / block_count for dim in range(3)]
+    )
+    radius = np.zeros(len(block_count))
+    np.maximum.at(
+        radius, block_ids, np.linalg.norm(cells - centroids[block_ids], axis=1)
+    )
+    block_weights = np.zeros((len(block_count), weights_2d.shape[1]))
+    np.add.at(block_weights, block_ids, weights_2d)
+
+    result = np.zeros((len(points), weights_2d.shape[1]))
+    aggregated_blocks = 0
+    for tile in _point_tiles(points, tilesize):
+        # Distance from each block centroid to the bounding box of the tile:
+        tile_min = points[tile, :3].min(axis=0)
+        tile_max = points[tile, :3].max(axis=0)
+        outside = np.maximum(tile_min - centroids, 0) + np.maximum(
+            centroids - tile_max, 0
+        )
+        far = np.linalg.norm(outside, axis=1) >= distance_ratio * radius
+        near_cells = ~far[block_ids]
+        aggregated_blocks += int(far.sum()) * len(tile)
+        result[tile] = blocked_sum(
+            kernel, cells[near_cells], weights_2d[near_cells], points[tile], blocksize
+        ) + blocked_sum(
+            kernel, centroids[far], block_weights[far], points[tile], blocksize
+        )
+    logger.debug(
+        "Aggregated on average %.1f of %d coarse blocks for each point",
+        aggregated_blocks / max(len(points), 1),
+        len(block_count),
+    )
+    return result.reshape((len(points),) + weights.shape[1:])
+
+
+def cached_kernel_matrix(
+    cache_dir: Path,
+    name: str,
+    kernel: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    cells: np.ndarray,
+    points: np.ndarray,
+    key: str = "",
+    blocksize: int = BLOCKSIZE,
+) -> Optional[np.ndarray]:
+    """Full (points x cells) kernel matrix, computed once and stored in a
+    cache directory shared by all realizations with the same grid geometry.
+
+    The matrix is stored as float32 in a .npy file, named from a hash of the
+    kernel name and key, and of the cell centres and target points. It is
+    returned memory mapped, so that concurrent runs share it through the page
+    cache.
+
+    Args:
+        cache_dir: Directory for the cached kernel matrices.
+        name: Kernel name, used as prefix for the file name.
+        kernel: Function giving the (points x cells) kernel matrix.
+        cells: Cell centres, with columns x, y and depth.
+        points: Target point data passed on to the kernel.
+        key: Any kernel parameters not included in cells and points.
+        blocksize: Maximal number of (point, cell) pairs computed at a time.
+
+    Returns:
+        The kernel matrix, or None if it has more elements than
+        GEOMETRY_CACHE_LIMIT.
+    """
+    if len(points) * len(cells) > GEOMETRY_CACHE_LIMIT:
+        logger.warning(
+            "Not caching %s kernel for %d points and %d cells, too large",
+            name,
+            len(points),
+            len(cells),
+        )
+        return None
+    digest = hashlib.sha256((name + key).encode())
+    for array in [cells, points]:
+        digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+    path = Path(cache_dir) / f"{name}-{digest.hexdigest()[:24]}.npy"
+    if path.exists():
+        logger.info("Using cached %s kernel %s", name, path)
+    else:
+        # Written under a temporary name, as other realizations may be
+        # computing the same matrix:
+        tmp_path = path.with_name(f"{path.stem}.{os.getpid()}.tmp")
+        matrix = np.lib.format.open_memmap(
+            tmp_path, mode="w+", dtype=np.float32, shape=(len(points), len(cells))
+        )
+        point_step = max(1, blocksize // max(len(cells), 1))
+        for start in range(0, len(points), point_step):
+            matrix[start : start + point_step] = kernel(
+                cells, points[start : start + point_step]
+            )
+        matrix.flush()
+        del matrix
+        os.replace(tmp_path, path)
+        logger.info("Wrote %s kernel to %s", name, path)
+    return np.load(path, mmap_mode="r")
+
+
+def matrix_sum(
+    matrix: np.ndarray, weights: np.ndarray, blocksize: int = BLOCKSIZE
+) -> np.ndarray:
+    """Weighted sums of the rows of a (points x cells) kernel matrix, taking
+    blocks of at most blocksize elements at a time from the matrix"""
+    weights_2d = weights if weights.ndim == 2 else weights[:, np.newaxis]
+    result = np.zeros((len(matrix), weights_2d.shape[1]))
+    point_step = max(1, blocksize // max(matrix.shape[1], 1))
+    for start in range(0, len(matrix), point_step):
+        block = slice(start, start + point_step)
+        result[block] = np.asarray(matrix[block], dtype=np.float64) @ weights_2d
+    return result.reshape((len(matrix),) + weights.shape[1:])
+
+
+def _weighted_sum(
+    kernel: Callable[[np.ndarray, np.ndarray], np.ndarray],
+    cells: np.ndarray,
+    weights: np.ndarray,
+    points: np.ndarray,
+    blocksize: int,
+    block_ids: Optional[np.ndarray],
+    distance_ratio: float,
+    matrix: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Sum from a cached kernel matrix if given, else exact sum if no coarse
+    blocks are given, otherwise far field approximation"""
+    if matrix is not None:
+        return matrix_sum(matrix, weights, blocksize)
+    if block_ids is None:
+        return blocked_sum(kernel, cells, weights, points, blocksize)
+    return far_field_sum(
+        kernel, cells, weights, points, block_ids, distance_ratio, blocksize
+    )
+
+
+def eval_gravity(
+    cells: np.ndarray,
+    mass_changes: np.ndarray,
+    points: np.ndarray,
+    blocksize: int = BLOCKSIZE,
+    block_ids: Optional[np.ndarray] = None,
+    distance_ratio: float = DISTANCE_RATIO,
+    matrix: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Change in vertical gravity (microGal) at target points.
+
+    Args:
+        cells: Cell centres, with columns x, y and depth.
+        mass_changes: Change in mass (kg) for each cell, either one vector or a
+            matrix with one column for each phase or difference date.
+        points: Target points, with columns x, y and depth.
+        blocksize: Maximal number of (point, cell) pairs evaluated at a time.
+        block_ids: Coarse block number for each cell. If given, far away
+            blocks are aggregated, see far_field_sum().
+        distance_ratio: Accuracy control for the far field approximation.
+        matrix: Kernel matrix for the cells and points from
+            cached_kernel_matrix(), used instead of evaluating the kernel.
+
+    Returns:
+        Gravity change for each point, with one column for each
+        mass change column if mass_changes is a matrix.
+    """
+    logger.debug(
+        "Evaluating gravity from %d cells at %d points", len(cells), len(points)
+    )
+    return GRAV_CONSTANT * _weighted_sum(
+        gravity_kernel,
+        cells,
+        mass_changes,
+        points,
+        blocksize,
+        block_ids,
+        distance_ratio,
+        matrix,
+    )
+
+
+def geertsma_kernel(
+    cells: np.ndarray, points: np.ndarray, poisson_ratio: float
+) -> np.ndarray:
+    """Vertical displacement per unit of pore volume compaction for a block of
+    cells at a block of target points, as a (points x cells) matrix, from the
+    Geertsma nucleus of strain solution with a free surface at the seabed.
+
+    Args:
+        cells: Cell centres, with columns x, y and depth.
+        points: Target points, with columns x, y, depth and seabed depth.
+        poisson_ratio: Poisson's ratio for the overburden.
+    """
+    dist_x = cells[np.newaxis, :, 0] - points[:, np.newaxis, 0]
+    dist_y = cells[np.newaxis, :, 1] - points[:, np.newaxis, 1]
+    depth = points[:, np.newaxis, 2]
+    burial = cells[np.newaxis, :, 2] - points[:, np.newaxis, 3]
+    dist_xy2 = dist_x * dist_x + dist_y * dist_y
+    upper = burial - depth
+    lower = burial + depth
+    dist_upper = np.sqrt(dist_xy2 + upper * upper)
+    dist_lower = np.sqrt(dist_xy2 + lower * lower)
+    dist_lower3 = dist_lower * dist_lower * dist_lower
+    return (
+        upper / (dist_upper * dist_upper * dist_upper)
+        + ((3 - 4 * poisson_ratio) * lower - 2 * depth) / dist_lower3
+        + 6 * depth * lower * lower / (dist_lower3 * dist_lower * dist_lower)
+    )
+
+
+def eval_subsidence(
+    cells: np.ndarray,
+    pore_volume_changes: np.ndarray,
+    points: np.ndarray,
+    poisson_ratio: float,
+    blocksize: int = BLOCKSIZE,
+    block_ids: Optional[np.ndarray] = None,
+    distance_ratio: float = DISTANCE_RATIO,
+    matrix: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Subsidence (m) at target points from changes in reservoir pore volume.
+
+    Args:
+        cells: Cell centres, with columns x, y and depth.
+        pore_volume_changes: Change in pore volume (rm3) for each cell from the
+            base to the monitor survey, either one vector or a matrix with one
+            column for each difference date.
+        points: Target points, with columns x, y, depth and seabed depth.
+        poisson_ratio: Poisson's ratio for the overburden.
+        blocksize: Maximal number of (point, cell) pairs evaluated at a time.
+        block_ids: Coarse block number for each cell. If given, far away
+            blocks are aggregated, see far_field_sum().
+        distance_ratio: Accuracy control for the far field approximation.
+        matrix: Kernel matrix for the cells and points from
+            cached_kernel_matrix(), used instead of evaluating the kernel.
+
+    Returns:
+        Subsidence for each point, positive downwards, with one column for each
+        pore volume change column if pore_volume_changes is a matrix.
+    """
+    logger.debug(
+        "Evaluating subsidence from %d cells at %d points", len(cells), len(points)
+    )
+    return _weighted_sum(
+        functools.partial(geertsma_kernel, poisson_ratio=poisson_ratio),
+        cells,
+        -pore_volume_changes / (4 * np.pi),
+        points,
+        blocksize,
+        block_ids,
+        distance_ratio,
+        matrix,
+    )
@@ -0,0 +1,373 @@
+"""Modelling of gravity change and subsidence at target points, shared by
+grav_subs_maps and grav_subs_points
+
+Surveys are loaded once for all difference dates, and together with the grid
+geometry collected into a dictionary of shared data. Each difference date (and
+phase) is then a task evaluated with this data, optionally in forked worker
+processes, using either the vectorized kernels or resdata.
+"""
+
+import functools
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from pydantic import BaseModel, Field
+from resdata.gravimetry import ResdataGrav, ResdataSubsidence
+from resdata.grid import Grid
+from resdata.resfile import ResdataFile
+from typing_extensions import Annotated
+
+from subscript import getLogger
+from subscript.grav_subs_maps import kernels
+from subscript.grav_subs_maps.surveys import load_surveys
+
+logger = getLogger(__name__)
+
+# Constant for subsidence modelling, not influencing results
+# since subsidence is calculated from porevolume change
+# therefore defaulted
+DUMMY_YOUNGS = 0.5
+
+PHASE_CODE = {"oil": 1, "gas": 2, "water": 4, "total": 7}
+
+# Data shared with forked worker processes, see map_shared():
+_SHARED: Dict[str, Any] = {}
+
+
+class FarFieldCalc(BaseModel):
+    block_size: Tuple[
+        Annotated[int, Field(strict=True, ge=1)],
+        Annotated[int, Field(strict=True, ge=1)],
+        Annotated[int, Field(strict=True, ge=1)],
+    ]
+    distance_ratio: Annotated[float, Field(gt=0)] = kernels.DISTANCE_RATIO
+
+
+def far_field_blocks(
+    grid: Grid, far_field: Optional[Dict[str, Any]], contributing: np.ndarray
+) -> Tuple[Optional[np.ndarray], float]:
+    """Coarse blocks for the contributing cells and the distance ratio for a
+    far field approximation, or None for no blocks if far_field is not
+    configured
+
+    Args:
+        grid: Simulation grid
+        far_field: The far_field section of a validated configuration
+        contributing: Mask over active cells for cells to include
+    """
+    if far_field is None:
+        return None, kernels.DISTANCE_RATIO
+    logger.info(
+        f"Approximating far field with blocks of {far_field['block_size']} cells "
+        f"beyond {far_field['distance_ratio']} block radii"
+    )
+    block_ids = kernels.cell_blocks(grid, far_field["block_size"])[contributing]
+    return block_ids, far_field["distance_ratio"]
+
+
+def load_gravity_surveys(
+    engine: str,
+    unrst_file: str,
+    grid: Grid,
+    init: ResdataFile,
+    diffdates: List[List[str]],
+    survey_cache: Optional[Path] = None,
+    with_subsidence: bool = True,
+) -> Tuple[
+    Tuple[Optional[ResdataGrav], Dict[str, Dict[str, np.ndarray]]],
+    Tuple[Optional[ResdataSubsidence], Dict[str, np.ndarray]],
+]:
+    """Load the surveys at all dates in the difference dates, each date once.
+
+    For the numpy engine, only the needed arrays are read from the report steps
+    at the survey dates, or from the survey cache. For the resdata engine, the
+    surveys are added to ResdataGrav and ResdataSubsidence.
+
+    Args:
+        engine: "numpy" or "resdata"
+        unrst_file: Path to flow simulation UNRST file
+        grid: Simulation grid
+        init: INIT file for the grid
+        diffdates: Difference dates, as pairs of YYYYMMDD strings
+        survey_cache: Path to .npz file for caching surveys, for the numpy engine
+        with_subsidence: Whether subsidence will be modelled. If not, pore volumes
+            are not needed in the surveys, for the numpy engine.
+
+    Returns:
+        Survey data for gravity and for subsidence, as used by shared_data()
+    """
+    survey_dates = list(
+        dict.fromkeys(date for diffdate in diffdates for date in diffdate)
+    )
+    if engine == "numpy":
+        try:
+            surveys = load_surveys(unrst_file, survey_dates, survey_cache)
+        except ValueError as err:
+            logger.error(f"{err}. Dates specified must be in UNRST file.")
+            sys.exit(1)
+        try:
+            survey_masses = {
+                date: kernels.phase_masses(survey, date)
+                for date, survey in surveys.items()
+            }
+            survey_pore_volumes = (
+                {
+                    date: kernels.pore_volumes(survey, date)
+                    for date, survey in surveys.items()
+                }
+                if with_subsidence
+                else {}
+            )
+        except ValueError as err:
+            logger.error(f"{err}. Check the restart output in the UNRST file.")
+            sys.exit(1)
+        return (None, survey_masses), (None, survey_pore_volumes)
+
+    rest = ResdataFile(unrst_file)
+    # From restart datetime format to YYYYMMDD as key
+    restart_index = {
+        restart_date.strftime("%Y%m%d"): i for i, restart_date in enumerate(rest.dates)
+    }
+    grav = ResdataGrav(grid, init)
+    subsidence = ResdataSubsidence(grid, init)
+    for singledate in survey_dates:
+        if singledate not in restart_index:
+            logger.error(f"Date {singledate} specified but not found in UNRST file.")
+            sys.exit(1)
+        rsb = rest.restart_view(seqnum_index=restart_index[singledate])
+        grav.add_survey_RFIP(singledate, rsb)
+        subsidence.add_survey_PRESSURE(singledate, rsb)
+    return (grav, {}), (subsidence, {})
+
+
+def shared_data(
+    engine: str,
+    grid: Grid,
+    init: ResdataFile,
+    gravity_surveys: Tuple[Optional[ResdataGrav], Dict[str, Dict[str, np.ndarray]]],
+    subsidence_surveys: Tuple[Optional[ResdataSubsidence], Dict[str, np.ndarray]],
+    poisson_ratio: float,
+    far_field: Optional[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """Data needed by gravity_task() and subsidence_task(), except the
+    target points.
+
+    Args:
+        engine: "numpy" or "resdata"
+        grid: Simulation grid
+        init: INIT file for the grid
+        gravity_surveys: ResdataGrav with surveys added for the resdata engine,
+            and fluid masses for each survey date for the numpy engine
+        subsidence_surveys: ResdataSubsidence with surveys added for the
+            resdata engine, and pore volumes for each survey date for the
+            numpy engine
+        poisson_ratio: Poisson's ratio for subsidence
+        far_field: The far_field section of a validated configuration
+    """
+    shared: Dict[str, Any] = {"engine": engine, "poisson_ratio": poisson_ratio}
+    if engine == "numpy":
+        # Numerical aquifer cells do not contribute:
+        contributing = kernels.active_cells(grid, init)
+        block_ids, distance_ratio = far_field_blocks(grid, far_field, contributing)
+        shared.update(
+            {
+                "contributing": contributing,
+                "cells": kernels.cell_centres(grid)[contributing],
+                "survey_masses": gravity_surveys[1],
+                "survey_pore_volumes": subsidence_surveys[1],
+                "block_ids": block_ids,
+                "distance_ratio": distance_ratio,
+            }
+        )
+    else:
+        if far_field is not None:
+            logger.warning("Far field approximation is only used with the numpy engine")
+        shared.update({"grav": gravity_surveys[0], "subsidence": subsidence_surveys[0]})
+    return shared
+
+
+def _call_shared(function: Callable, task: Tuple) -> Any:
+    return function(_SHARED, *task)
+
+
+def map_shared(
+    function: Callable, shared: Dict[str, Any], tasks: List[Tuple], jobs: int = 1
+) -> List[Any]:
+    """Evaluate function(shared, *task) for each task, in a pool of jobs worker
+    processes if jobs is larger than one.
+
+    The shared data (grid geometry, surveys and resdata objects) are not
+    pickled, but inherited copy-on-write by the worker processes, which are
+    forked after the data are loaded. Where forking is not available, the
+    tasks are evaluated serially.
+
+    Returns:
+        The results of each task, in the order of the tasks
+    """
+    if jobs > 1 and len(tasks) > 1:
+        if "fork" in multiprocessing.get_all_start_methods():
+            _SHARED.update(shared)
+            try:
+                with ProcessPoolExecutor(
+                    max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+                ) as executor:
+                    return list(
+                        executor.map(_call_shared, [function] * len(tasks), tasks)
+                    )
+            finally:
+                _SHARED.clear()
+        logger.warning("Forking processes not supported, ignoring --jobs")
+    return [function(shared, *task) for task in tasks]
+
+
+def gravity_task(
+    shared: Dict[str, Any], diffdate: List[str], phases: List[str]
+) -> np.ndarray:
+    """Gravity change for a difference date at the points in
+    shared["grav_points"], with one column for each phase"""
+    logger.info(
+        f"Calculating delta gravity from {', '.join(phases)} "
+        f"for {diffdate[0]}_{diffdate[1]}"
+    )
+    points = shared["grav_points"][tuple(diffdate)]
+    if shared["engine"] == "numpy":
+        survey_masses = shared["survey_masses"]
+        mass_changes = np.column_stack(
+            [
+                kernels.mass_change(
+                    survey_masses[diffdate[1]], survey_masses[diffdate[0]], phase
+                )[shared["contributing"]]
+                for phase in phases
+            ]
+        )
+        return kernels.eval_gravity(
+            shared["cells"],
+            mass_changes,
+            points,
+            block_ids=shared["block_ids"],
+            distance_ratio=shared["distance_ratio"],
+            matrix=shared.get("grav_matrices", {}).get(tuple(diffdate)),
+        )
+    return np.array(
+        [
+            [
+                shared["grav"].eval(
+                    diffdate[1],
+                    diffdate[0],
+                    (x, y, z),
+                    phase_mask=PHASE_CODE[phase],
+                )
+                for phase in phases
+            ]
+            for x, y, z in points
+        ]
+    ).reshape(len(points), len(phases))
+
+
+def gravity_changes(
+    shared: Dict[str, Any], diffdates: List[List[str]], phases: List[str], jobs: int
+) -> Dict[Tuple[Tuple[str, ...], str], np.ndarray]:
+    """Gravity change for all difference dates and phases, keyed by
+    (difference date, phase).
+
+    With the numpy engine, the phases for a difference date are evaluated in
+    one task, sharing the kernel evaluations, otherwise each combination of
+    difference date and phase is a separate task."""
+    if shared["engine"] == "numpy":
+        tasks = [(diffdate, phases) for diffdate in diffdates]
+    else:
+        tasks = [(diffdate, [phase]) for diffdate in diffdates for phase in phases]
+    results = map_shared(gravity_task, shared, tasks, jobs)
+    return {
+        (tuple(diffdate), phase): result[:, phase_idx]
+        for (diffdate, task_phases), result in zip(tasks, results)
+        for phase_idx, phase in enumerate(task_phases)
+    }
+
+
+def _seabed_points(points: np.ndarray) -> np.ndarray:
+    """Points for subsidence at the seabed, which is both the depth of the
+    points and the free surface"""
+    return np.column_stack([points, points[:, 2]])
+
+
+def add_geometry_cache(shared: Dict[str, Any], geometry_cache: Optional[Path]) -> None:
+    """Add kernel matrices for the gravity and subsidence points to the shared
+    data, from the geometry cache directory, where they are computed and stored
+    by the first realization with the same grid geometry and points.
+
+    Each task then only multiplies the matrix with its mass or pore volume
+    changes. The matrices are loaded before forking worker processes, so that
+    these share them.
+
+    Args:
+        shared: Shared data from shared_data(), with grav_points and
+            subs_points added
+        geometry_cache: Directory for cached kernel matrices, or None for no
+            caching
+    """
+    if geometry_cache is None:
+        return
+    if shared["engine"] != "numpy":
+        logger.warning("Geometry cache is only used with the numpy engine")
+        return
+    if shared["block_ids"] is not None:
+        logger.warning("Far field approximation is not used with geometry cache")
+    Path(geometry_cache).mkdir(parents=True, exist_ok=True)
+    shared["grav_matrices"] = {
+        key: kernels.cached_kernel_matrix(
+            geometry_cache, "gravity", kernels.gravity_kernel, shared["cells"], points
+        )
+        for key, points in shared["grav_points"].items()
+    }
+    shared["subs_matrices"] = {
+        key: kernels.cached_kernel_matrix(
+            geometry_cache,
+            "subsidence",
+            functools.partial(
+                kernels.geertsma_kernel, poisson_ratio=shared["poisson_ratio"]
+            ),
+            shared["cells"],
+            _seabed_points(points),
+            key=repr(shared["poisson_ratio"]),
+        )
+        for key, points in shared["subs_points"].items()
+    }
+
+
+def subsidence_task(shared: Dict[str, Any], diffdate: List[str]) -> np.ndarray:
+    """Subsidence (m) for a difference date at the points in
+    shared["subs_points"], which are at the seabed"""
+    logger.info(f"Calculating subsidence for {diffdate[0]}_{diffdate[1]}")
+    points = shared["subs_points"][tuple(diffdate)]
+    if shared["engine"] == "numpy":
+        survey_pore_volumes = shared["survey_pore_volumes"]
+        pore_volume_change = (
+            survey_pore_volumes[diffdate[0]] - survey_pore_volumes[diffdate[1]]
+        )[shared["contributing"]]
+        return kernels.eval_subsidence(
+            shared["cells"],
+            pore_volume_change,
+            _seabed_points(points),
+            shared["poisson_ratio"],
+            block_ids=shared["block_ids"],
+            distance_ratio=shared["distance_ratio"],
+            matrix=shared.get("subs_matrices", {}).get(tuple(diffdate)),
+        )
+    return np.array(
+        [
+            shared["subsidence"].eval_geertsma_rporv(
+                diffdate[1],
+                diffdate[0],
+                (x, y, z),
+                DUMMY_YOUNGS,
+                shared["poisson_ratio"],
+                z,
+            )
+            for x, y, z in points
+        ]
+    )
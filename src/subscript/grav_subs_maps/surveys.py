@@ -0,0 +1,144 @@
+"""Reading of gravity and subsidence surveys from flow simulation restart files
+
+Only the report steps for the survey dates are read, and from these only the
+arrays needed for modelling, which are kept as float32 arrays like in the
+restart file. The surveys can be cached in an ``.npz`` sidecar file, so that
+reruns with other stations, phases or calculation settings do not need to
+read the restart file again.
+"""
+
+import os
+from pathlib import Path
+from typing import Dict, Iterable, Optional, Union
+
+import numpy as np
+import resfo
+
+from subscript import getLogger
+
+logger = getLogger(__name__)
+
+# Restart keywords needed for gravity and subsidence modelling:
+SURVEY_KEYWORDS = (
+    "RFIPOIL",
+    "RFIPGAS",
+    "RFIPWAT",
+    "OIL_DEN",
+    "GAS_DEN",
+    "WAT_DEN",
+    "RPORV",
+)
+
+# Key in sidecar files for the size and modification time of the restart file
+# the surveys were read from:
+SOURCE_KEY = "SOURCE"
+
+
+def read_surveys(
+    unrst_file: Union[str, Path], dates: Iterable[str]
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Read survey arrays for the report steps at some dates in one pass over
+    a unified restart file, skipping all other arrays.
+
+    If there are several report steps at a date, the last one is used.
+
+    Args:
+        unrst_file: Path to UNRST file.
+        dates: Survey dates, as YYYYMMDD strings.
+
+    Returns:
+        Arrays for each keyword in SURVEY_KEYWORDS present in the restart file,
+        for each date.
+
+    Raises:
+        ValueError: if any of the dates is not in the restart file.
+    """
+    wanted = set(dates)
+    surveys: Dict[str, Dict[str, np.ndarray]] = {}
+    current: Optional[Dict[str, np.ndarray]] = None
+    new_report_step = False
+    with Path(unrst_file).open("rb") as f_handle:
+        for entry in resfo.lazy_read(f_handle, resfo.Format.UNFORMATTED):
+            keyword = entry.read_keyword().strip()
+            if keyword == "SEQNUM":
+                current = None
+                new_report_step = True
+            elif keyword == "INTEHEAD" and new_report_step:
+                new_report_step = False
+                day, month, year = entry.read_array()[64:67]  # type: ignore
+                date = f"{year:04d}{month:02d}{day:02d}"
+                if date in wanted:
+                    current = surveys[date] = {}
+            elif current is not None and keyword in SURVEY_KEYWORDS:
+                current[keyword] = np.asarray(entry.read_array(), dtype=np.float32)
+    missing = sorted(wanted - surveys.keys())
+    if missing:
+        raise ValueError(f"Dates {', '.join(missing)} not found in {unrst_file}")
+    logger.info("Read surveys for %s from %s", ", ".join(sorted(surveys)), unrst_file)
+    return surveys
+
+
+def _source_stamp(unrst_file: Union[str, Path]) -> np.ndarray:
+    stat = os.stat(unrst_file)
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+
+def load_surveys(
+    unrst_file: Union[str, Path],
+    dates: Iterable[str],
+    sidecar: Optional[Union[str, Path]] = None,
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """Survey arrays for some dates, read from a unified restart file or from a
+    sidecar file.
+
+    The sidecar file is used if it was written for the same restart file,
+    judged from the size and modification time of the restart file, and
+    contains all the dates. Otherwise the missing dates are read from the
+    restart file, and the sidecar file is rewritten with all surveys.
+
+    Args:
+        unrst_file: Path to UNRST file.
+        dates: Survey dates, as YYYYMMDD strings.
+        sidecar: Path to .npz file for caching the surveys, or None for no
+            caching.
+
+    Returns:
+        Arrays for each keyword in SURVEY_KEYWORDS present in the restart file,
+        for each date.
+
+    Raises:
+        ValueError: if any of the dates is not in the restart file.
+    """
+    dates = set(dates)
+    if sidecar is None:
+        return read_surveys(unrst_file, dates)
+
+    source = _source_stamp(unrst_file)
+    surveys: Dict[str, Dict[str, np.ndarray]] = {}
+    if Path(sidecar).exists():
+        with np.load(sidecar) as cached:
+            if SOURCE_KEY in cached and np.array_equal(cached[SOURCE_KEY], source):
+                for key in cached.files:
+                    if key != SOURCE_KEY:
+                        keyword, date = key.rsplit("_", 1)
+                        surveys.setdefault(date, {})[keyword] = cached[key]
+            else:
+                logger.info("Ignoring outdated survey cache %s", sidecar)
+
+    missing = dates - surveys.keys()
+    if missing:
+        surveys.update(read_surveys(unrst_file, missing))
+        with Path(sidecar).open("wb") as f_handle:
+            np.savez(
+                f_handle,
+                **{SOURCE_KEY: source},
+                **{
+                    f"{keyword}_{date}": array
+                    for date, survey in surveys.items()
+                    for keyword, array in survey.items()
+                },
+            )
+        logger.info("Wrote survey cache %s", sidecar)
+    else:
+        logger.info("Using surveys from cache %s", sidecar)
+    return {date: surveys[date] for date in dates}
@@ -6,23 +6,27 @@ from datetime import date
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
+import numpy as np
 import pandas as pd
 import yaml
 from pydantic import BaseModel, Field, FilePath, field_validator
-from resdata.gravimetry import ResdataGrav, ResdataSubsidence
 from resdata.grid import Grid
 from resdata.resfile import ResdataFile
 from typing_extensions import Annotated
 
 import subscript
+from subscript.grav_subs_maps.modelling import (
+    FarFieldCalc,
+    add_geometry_cache,
+    gravity_changes,
+    load_gravity_surveys,
+    map_shared,
+    shared_data,
+    subsidence_task,
+)
 
 logger = subscript.getLogger(__name__)
 
-# Constant for subsidence modelling, not influencing results
-# since subsidence is calculated from porevolume change RPORV
-# therefore defaulted
-DUMMY_YOUNGS = 10
-
 PREFIX_POINTS = "all"  # calculation is cumulative over all zones
 EXTENSION_POINTS = ".txt"  # extension for points in roxar points format
 PREFIX_GENDATA = ""
@@ -57,6 +61,10 @@ EPILOGUE = """
   calculations:
     poisson_ratio: 0.45 # For subsidence calulcations, used in Geertsma model
     phases: ["gas", "oil","water", "total"] # One pointset for each phase specified
+    far_field: # Optional, approximate contributions from distant cells
+      block_size: [8, 8, 4] # Cells in i, j and k in each aggregated block
+      distance_ratio: 5 # Aggregate blocks at least this many block radii away,
+                        # larger values give more accurate results
 
 .. code-block:: plaintext
 
@@ -117,6 +125,7 @@ class GravPointsStations(BaseModel):
 class GravPointsCalc(BaseModel):
     poisson_ratio: Annotated[float, Field(strict=True, ge=0, le=0.5)]
     phases: List[str]
+    far_field: Optional[FarFieldCalc] = None
 
     @field_validator("phases")
     @classmethod
@@ -170,6 +179,48 @@ def get_parser() -> argparse.ArgumentParser:
         help="Path to directory for output maps. Directory must exist.",
         default="./",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["numpy", "resdata"],
+        default="numpy",
+        help=(
+            "How to evaluate gravity and subsidence. numpy evaluates all "
+            "stations and phases at once, resdata evaluates one station and "
+            "phase at a time."
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of difference dates and phases to model in parallel",
+    )
+    parser.add_argument(
+        "--survey-cache",
+        type=Path,
+        help=(
+            "Path to .npz file for caching the surveys read from the UNRST file, "
+            "to speed up reruns. Only used with the numpy engine."
+        ),
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help=(
+            "Write gravity changes and subsidence for all phases and difference "
+            "dates to one CSV file instead of one xyz points file for each. "
+            "Files for ERT are written as before."
+        ),
+    )
+    parser.add_argument(
+        "--geometry-cache",
+        type=Path,
+        help=(
+            "Directory for caching the grid geometry part of the modelling, "
+            "for reuse by other realizations with the same grid. "
+            "Only used with the numpy engine."
+        ),
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -195,7 +246,17 @@ def main() -> None:
     if not Path(args.UNRSTfile).exists():
         sys.exit("UNRST file does not exist:" + args.UNRSTfile)
 
-    main_gravpoints(args.UNRSTfile, config, Path(args.root_path), Path(args.outputdir))
+    main_gravpoints(
+        args.UNRSTfile,
+        config,
+        Path(args.root_path),
+        Path(args.outputdir),
+        engine=args.engine,
+        jobs=args.jobs,
+        survey_cache=args.survey_cache,
+        columnar=args.columnar,
+        geometry_cache=args.geometry_cache,
+    )
 
 
 def prepend_root_path_to_relative_files(
@@ -247,12 +308,12 @@ def export_grav_points_xyz(act_stations, phase, diff_date, out_folder) -> None:
         + EXTENSION_POINTS
     )
 
-    with open(os.path.join(out_folder, outfile), "w") as file:
-        for index, row in act_stations.iterrows():
-            file.write(
-                f"{row['utmx']:.3f} {row['utmy']:.3f} "
-                f"{row['dgsim_'+phase+'_'+diff_date[0]+'_'+diff_date[1]]:.3f} \n"
-            )
+    column = "dgsim_" + phase + "_" + diff_date[0] + "_" + diff_date[1]
+    np.savetxt(
+        os.path.join(out_folder, outfile),
+        act_stations[["utmx", "utmy", column]].to_numpy(dtype=float),
+        fmt="%.3f %.3f %.3f ",
+    )
 
 
 def export_grav_points_ert(act_stations, diff_date, out_folder) -> None:
@@ -286,12 +347,12 @@ def export_subs_points_xyz(act_stations, diff_date, out_folder) -> None:
         + EXTENSION_POINTS
     )
 
-    with open(os.path.join(out_folder, outfile), "w") as file:
-        for index, row in act_stations.iterrows():
-            file.write(
-                f"{row['utmx']:.3f} {row['utmy']:.3f} "
-                f"{row['subsidence_'+diff_date[0]+'_'+diff_date[1]]:.3f}\n"
-            )
+    column = "subsidence_" + diff_date[0] + "_" + diff_date[1]
+    np.savetxt(
+        os.path.join(out_folder, outfile),
+        act_stations[["utmx", "utmy", column]].to_numpy(dtype=float),
+        fmt="%.3f",
+    )
 
 
 def export_subs_points_ert(act_stations, diff_date, out_folder) -> None:
@@ -311,11 +372,51 @@ def export_subs_points_ert(act_stations, diff_date, out_folder) -> None:
     part.to_csv(output_path, header=None, index=None)
 
 
+def export_points_columnar(
+    grav_stations: Dict[Tuple[str, ...], pd.DataFrame],
+    subs_stations: Dict[Tuple[str, ...], pd.DataFrame],
+    diffdates: List[List[str]],
+    phases: List[str],
+    out_folder: Path,
+) -> None:
+    """Write gravity changes for all phases and subsidence for all difference
+    dates to one CSV file, with one row for each station and difference date,
+    and one column for each phase and for subsidence"""
+    logger.info(f"Exporting simulated values to {out_folder} as one CSV file")
+    frames = []
+    for diffdate in diffdates:
+        suffix = "_" + diffdate[0] + "_" + diffdate[1]
+        grav_frame = grav_stations[tuple(diffdate)].rename(
+            columns={
+                "dgsim_" + phase + suffix: "delta_gravity_" + phase for phase in phases
+            }
+        )
+        subs_frame = subs_stations[tuple(diffdate)].rename(
+            columns={"subsidence" + suffix: "subsidence"}
+        )
+        station_columns = [
+            column for column in grav_frame.columns if column in subs_frame.columns
+        ]
+        frame = grav_frame.merge(subs_frame, how="outer", on=station_columns)
+        frame.insert(0, "DIFFDATE", diffdate[0] + "_" + diffdate[1])
+        frames.append(frame)
+    pd.concat(frames, ignore_index=True).to_csv(
+        Path(out_folder) / (PREFIX_POINTS + "--" + "delta_gravity_subsidence.csv"),
+        index=False,
+        float_format="%.3f",
+    )
+
+
 def main_gravpoints(
     unrst_file: str,
     config: Dict[str, Any],
     root_path: Optional[Path],
     output_folder: Path,
+    engine: str = "numpy",
+    jobs: int = 1,
+    survey_cache: Optional[Path] = None,
+    columnar: bool = False,
+    geometry_cache: Optional[Path] = None,
 ) -> None:
     """
     Process a configuration, model gravity and subsidence points and write to disk.
@@ -323,6 +424,16 @@ def main_gravpoints(
     Args:
         resdata: Path to flow simulation UNRST file
         config: Configuration for modelling
+        engine: "numpy" for evaluating gravity and subsidence for all stations
+            at once, or "resdata" for evaluating station by station with
+            ResdataGrav and ResdataSubsidence.
+        jobs: Number of worker processes for difference dates and phases.
+        survey_cache: Path to .npz file for caching surveys, for the numpy
+            engine.
+        columnar: Write all phases and difference dates to one CSV file instead
+            of one xyz file for each.
+        geometry_cache: Directory for caching kernel matrices, shared by
+            realizations with the same grid, for the numpy engine.
     """
 
     if root_path is not None:
@@ -335,6 +446,7 @@ def main_gravpoints(
     station_files = cfg["stations"]
     phases = cfg["calculations"]["phases"]
     poisson_ratio = cfg["calculations"]["poisson_ratio"]
+    far_field = cfg["calculations"]["far_field"]
 
     if isinstance(unrst_file, str):
         restart_file = unrst_file[:-6] + ".UNRST"
@@ -342,13 +454,6 @@ def main_gravpoints(
         init_file = unrst_file[:-6] + ".INIT"
         grid = Grid(egrid_file)
         init = ResdataFile(init_file)
-        rest = ResdataFile(restart_file)
-
-    restart_index = {}
-
-    # From restart datetime format to YYYYMMDD as key
-    for i, restart_date in enumerate(rest.dates):
-        restart_index[restart_date.strftime("%Y%m%d")] = i
 
     diffdates = []
     # Convert dates from datetime format to strings
@@ -358,84 +463,77 @@ def main_gravpoints(
         diffdates.append(diff)
         logger.info(f"{diffdate[0]}_{diffdate[1]}")
 
-    grav = ResdataGrav(grid, init)
-    subsidence = ResdataSubsidence(grid, init)
-
-    added_dates = []
+    gravity_surveys, subsidence_surveys = load_gravity_surveys(
+        engine, restart_file, grid, init, diffdates, survey_cache
+    )
 
+    shared = shared_data(
+        engine,
+        grid,
+        init,
+        gravity_surveys,
+        subsidence_surveys,
+        poisson_ratio,
+        far_field,
+    )
+    grav_stations = {}
+    subs_stations = {}
     for diffdate in diffdates:
-        for singledate in diffdate:  # base and monitor
-            rsb = rest.restartView(0)
-            if singledate not in added_dates:
-                if singledate in restart_index:
-                    rsb = rest.restartView(restart_index[singledate])
-                    grav.add_survey_RFIP(singledate, rsb)
-                    subsidence.add_survey_PRESSURE(singledate, rsb)
-                    added_dates.append(singledate)
-                else:
-                    logger.error(
-                        f"Date {singledate} specified but not found in UNRST file."
-                    )
-                    sys.exit(1)
-
-    phase_code = {"oil": 1, "gas": 2, "water": 4, "total": 7}
+        diff_year = str(diffdate[0][0:4]) + "_" + str(diffdate[1][0:4])
+        grav_stations[tuple(diffdate)] = pd.read_csv(
+            station_files["grav"][diff_year], sep=";"
+        )
+        subs_stations[tuple(diffdate)] = pd.read_csv(
+            station_files["subs"][diff_year], sep=";"
+        )
+    shared["grav_points"] = {
+        key: stations[["utmx", "utmy", "depth"]].to_numpy(dtype=float)
+        for key, stations in grav_stations.items()
+    }
+    shared["subs_points"] = {
+        key: stations[["utmx", "utmy", "depth"]].to_numpy(dtype=float)
+        for key, stations in subs_stations.items()
+    }
+    add_geometry_cache(shared, geometry_cache)
 
     # Gravity
+    gravity_values = gravity_changes(shared, diffdates, phases, jobs)
     for diffdate in diffdates:
-        diff_year = str(diffdate[0][0:4]) + "_" + str(diffdate[1][0:4])
-        active_stations = pd.read_csv(station_files["grav"][diff_year], sep=";")
+        active_stations = grav_stations[tuple(diffdate)]
 
         for phase in phases:
-            logger.info(
-                f"Calculating delta gravity at bencmark stations "
-                f"from {phase} for {diffdate[0]}_{diffdate[1]}"
-            )
-
-            gravity_values = [
-                grav.eval(
-                    diffdate[1], diffdate[0], (x, y, z), phase_mask=phase_code[phase]
-                )
-                for x, y, z in zip(
-                    active_stations["utmx"],
-                    active_stations["utmy"],
-                    active_stations["depth"],
-                )
-            ]
             active_stations[
                 "dgsim_" + phase + "_" + diffdate[0] + "_" + diffdate[1]
-            ] = gravity_values
+            ] = gravity_values[(tuple(diffdate), phase)]
 
             # Export for each diffdate, all phases specified in config
-            export_grav_points_xyz(active_stations, phase, diffdate, output_folder)
+            if not columnar:
+                export_grav_points_xyz(active_stations, phase, diffdate, output_folder)
 
         # Export to ert for each diffdate, only total, not per phase
         export_grav_points_ert(active_stations, diffdate, output_folder)
 
     # Subsidence
+    subs_values = map_shared(
+        subsidence_task, shared, [(diffdate,) for diffdate in diffdates], jobs
+    )
+    for diffdate, diff_subs_values in zip(diffdates, subs_values):
+        active_stations = subs_stations[tuple(diffdate)]
 
-    for diffdate in diffdates:
-        diff_year = str(diffdate[0][0:4]) + "_" + str(diffdate[1][0:4])
-        active_stations = pd.read_csv(station_files["subs"][diff_year], sep=";")
-
-        subs_values = [
-            subsidence.eval_geertsma_rporv(
-                diffdate[1], diffdate[0], (x, y, z), DUMMY_YOUNGS, poisson_ratio, z
-            )
-            for x, y, z in zip(
-                active_stations["utmx"],
-                active_stations["utmy"],
-                active_stations["depth"],
-            )
-        ]
-
-        active_stations["subsidence" + "_" + diffdate[0] + "_" + diffdate[1]] = [
-            i * 100 for i in subs_values
-        ]  # from m to cm
+        active_stations["subsidence" + "_" + diffdate[0] + "_" + diffdate[1]] = (
+            diff_subs_values * 100
+        )  # from m to cm
 
-        export_subs_points_xyz(active_stations, diffdate, output_folder)
+        if not columnar:
+            export_subs_points_xyz(active_stations, diffdate, output_folder)
 
         export_subs_points_ert(active_stations, diffdate, output_folder)
 
+    if columnar:
+        export_points_columnar(
+            grav_stations, subs_stations, diffdates, phases, output_folder
+        )
+
     logger.info(
         f"Done; All gravity and subsidence points written to folder: "
         f"{str(output_folder)}",
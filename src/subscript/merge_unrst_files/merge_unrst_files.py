@@ -1,15 +1,22 @@
 import argparse
 import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import IO, List, Optional, Tuple
 
+import numpy as np
 import resfo
 
 from subscript import __version__, getLogger
 
-DESCRIPTION = """Read two ``UNRST`` files and export a merged version. This is useful in
-cases where history and prediction are run separately and one wants to calculate
-differences across dates in the two files. One should give hist file as first positional
-argument and pred file as the second positional argument (i.e. in the order of smallest
-to largest report step numbers).
+DESCRIPTION = """Read two or more ``UNRST`` files and export a merged version. This is
+useful in cases where history and prediction are run separately and one wants to
+calculate differences across dates in the files. One should give hist file as first
+positional argument and pred file as the second positional argument (i.e. in the order
+of smallest to largest report step numbers). Further prediction segments, restarted from
+the previous one, can be given as more positional arguments.
 """
 
 CATEGORY = "utility.eclipse"
@@ -25,6 +32,12 @@ EXAMPLES = """
 logger = getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Chunk size when copying unmodified keywords between files:
+COPY_BUFSIZE = 16 * 1024 * 1024
+
+# Keywords that are renumbered when merging:
+PATCHED_KEYWORDS = {"SEQNUM  ", "INTEHEAD"}
+
 
 def get_parser() -> argparse.ArgumentParser:
     """Function to create the argument parser that is going to be served to the user.
@@ -38,6 +51,12 @@ def get_parser() -> argparse.ArgumentParser:
     )
     parser.add_argument("UNRST1", type=str, help="UNRST file 1, history part")
     parser.add_argument("UNRST2", type=str, help="UNRST file 2, prediction part")
+    parser.add_argument(
+        "UNRSTN",
+        type=str,
+        nargs="*",
+        help="More UNRST files, prediction parts restarted from the previous file",
+    )
     parser.add_argument(
         "-o",
         "--output",
@@ -55,22 +74,25 @@ def get_parser() -> argparse.ArgumentParser:
 
 
 def _check_report_number(
-    args: argparse.Namespace,
+    filename: str,
+    previous_filename: str,
     max_report_number_hist: int,
     current_report_number: int,
 ) -> None:
     """Check that pred file report numbers are larger than in hist file.
 
     Args:
-        args (argparse.Namespace): The Namespace object with the argument list.
+        filename (str): The pred file.
+        previous_filename (str): The hist file, or the previous pred file.
         max_report_number_hist (int): The largest report number in hist file.
-        current_report_number (int): The current restart report number in pred file.
+        current_report_number (int): The smallest restart report number in pred
+            file.
     """
 
     if current_report_number <= max_report_number_hist:
         logger.warning(
-            f"{args.UNRST2} file has a restart report number ({current_report_number})"
-            + f" which is smaller than largest report number in {args.UNRST1}"
+            f"{filename} file has a restart report number ({current_report_number})"
+            + f" which is smaller than largest report number in {previous_filename}"
             + f" ({max_report_number_hist})"
         )
         logger.warning(
@@ -79,35 +101,137 @@ def _check_report_number(
         )
 
 
+def _copy_bytes(source: IO[bytes], target: IO[bytes], start: int, end: int) -> None:
+    """Copy a byte range from one open file to the current position of another.
+    The end can be -1 for copying to the end of the file"""
+    if end < 0:
+        end = os.fstat(source.fileno()).st_size
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(COPY_BUFSIZE, remaining))
+        if not chunk:
+            raise OSError(f"Unexpected end of file in {source.name}")
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def _copy_renumbered(
+    unrst: str,
+    out_handle: IO[bytes],
+    offsets: Tuple[int, int, int],
+    previous: Optional[Tuple[str, int]] = None,
+) -> Tuple[int, int, int]:
+    """Append an UNRST file to an open output file, while adding offsets to
+    the restart report numbers, solver step numbers and report step numbers.
+
+    Keywords other than SEQNUM and INTEHEAD are copied byte by byte, so
+    only one keyword array is held in memory at a time.
+
+    Args:
+        unrst: The UNRST file to append.
+        out_handle: The output file, opened for binary writing.
+        offsets: Offsets for SEQNUM, and INTEHEAD items 67 and 68.
+        previous: The UNRST file merged before this one, if any, and its
+            largest restart report number. Report numbers in this file are
+            checked to be larger.
+
+    Returns:
+        Tuple with the largest restart report number (SEQNUM), solver step
+        number and report step number in the file, before adding offsets.
+    """
+    seqnum_offset, solver_step_offset, report_step_offset = offsets
+    max_seqnum = max_solver_step = max_report_step = 0
+    min_seqnum: Optional[int] = None
+    copied_to = 0
+    with Path(unrst).open("rb") as f_handle, Path(unrst).open("rb") as copy_handle:
+        for entry in resfo.lazy_read(f_handle, resfo.Format.UNFORMATTED):
+            keyword = entry.read_keyword()
+            if keyword not in PATCHED_KEYWORDS:
+                continue
+            array = np.array(entry.read_array())
+            # After reading the array, the file is positioned at the end of it:
+            entry_end = f_handle.tell()
+            if keyword == "SEQNUM  ":  # restart report number
+                max_seqnum = max(max_seqnum, int(array[0]))
+                if min_seqnum is None or array[0] < min_seqnum:
+                    min_seqnum = int(array[0])
+                array[0] += seqnum_offset
+            else:
+                max_solver_step = max(max_solver_step, int(array[67]))
+                max_report_step = max(max_report_step, int(array[68]))
+                array[67] += solver_step_offset
+                array[68] += report_step_offset
+            _copy_bytes(copy_handle, out_handle, copied_to, entry.start)
+            resfo.write(out_handle, [(keyword, array)], resfo.Format.UNFORMATTED)
+            copied_to = entry_end
+        _copy_bytes(copy_handle, out_handle, copied_to, -1)
+    if previous is not None and min_seqnum is not None:
+        _check_report_number(unrst, previous[0], previous[1], min_seqnum)
+    return max_seqnum, max_solver_step, max_report_step
+
+
+def merge_unrst_files(unrst_files: List[str], output: str) -> None:
+    """Merge an ordered list of UNRST files into one, in a single streaming pass.
+
+    The first (history) file is copied as is. Each following file is appended
+    with its restart report numbers and step numbers shifted by the largest
+    ones merged so far, giving the same result as merging the files pairwise
+    in order. Peak memory usage is bounded by the size of the largest keyword
+    array. The merged file is written to a temporary file next to the output,
+    which replaces the output when done, so the output may be one of the
+    inputs.
+
+    Args:
+        unrst_files (List[str]): UNRST files, in the order of smallest to
+            largest report numbers.
+        output (str): Filename for the merged UNRST file.
+    """
+    offsets = (0, 0, 0)
+    previous: Optional[Tuple[str, int]] = None
+    outpath = Path(output)
+    with tempfile.NamedTemporaryFile(
+        dir=outpath.parent, prefix=outpath.name, suffix=".tmp", delete=False
+    ) as out_handle:
+        tmpfilename = out_handle.name
+        try:
+            for unrst in unrst_files:
+                maxima = _copy_renumbered(unrst, out_handle, offsets, previous)
+                if previous is None:
+                    offsets = (
+                        max(maxima[0], 1),
+                        max(maxima[1], 1),
+                        max(maxima[2], 1),
+                    )
+                else:
+                    offsets = (
+                        offsets[0] + maxima[0],
+                        offsets[1] + maxima[1],
+                        offsets[2] + maxima[2],
+                    )
+                previous = (unrst, maxima[0])
+        except BaseException:
+            out_handle.close()
+            os.remove(tmpfilename)
+            raise
+    if outpath.exists():
+        shutil.copymode(outpath, tmpfilename)
+    else:
+        # Temporary files are only readable by the owner:
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpfilename, 0o666 & ~umask)
+    os.replace(tmpfilename, output)
+
+
 def main() -> None:
     """Parse command line arguments and run"""
 
     args: argparse.Namespace = get_parser().parse_args()
 
-    logger.info(f"Merge unrst files {args.UNRST1} and {args.UNRST2}.")
-    unrst_hist = resfo.read(args.UNRST1)
-    unrst_pred = resfo.read(args.UNRST2)
-
-    max_first_seqnum: int = 1
-    max_first_solver_step: int = 1
-    max_first_report_step: int = 1
-
-    for kw, val in unrst_hist:
-        if kw == "SEQNUM  ":  # restart report number
-            max_first_seqnum = max(max_first_seqnum, val[0])
-        if kw == "INTEHEAD":
-            max_first_solver_step = max(max_first_solver_step, val[67])
-            max_first_report_step = max(max_first_report_step, val[68])
-
-    for kw, val in unrst_pred:
-        if kw == "SEQNUM  ":
-            _check_report_number(args, max_first_seqnum, val[0])
-            val[0] += max_first_seqnum
-        if kw == "INTEHEAD":
-            val[67] += max_first_solver_step
-            val[68] += max_first_report_step
-
-    resfo.write(args.output, unrst_hist + unrst_pred)
+    unrst_files = [args.UNRST1, args.UNRST2, *args.UNRSTN]
+    logger.info(f"Merge unrst files {', '.join(unrst_files)}.")
+    merge_unrst_files(unrst_files, args.output)
     logger.info(f"Done. Merged file is written to {args.output}")
 
 
@@ -0,0 +1,175 @@
+"""Byte offset index of report steps and volume tables in PRT files
+
+Building the index requires one pass over the (memory mapped) PRT file, later
+queries for a specific date can seek directly to the region report tables
+they need. The index is stored in a small JSON sidecar file next to the PRT
+file, and is rebuilt whenever the PRT file has changed.
+"""
+
+import datetime
+import json
+import mmap
+import re
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from res2df.common import parse_month
+
+from subscript import getLogger
+
+logger = getLogger(__name__)
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".index.json"
+
+# Equivalent to the line-by-line matchers in prtvol2csv, but anchored at line
+# starts in the complete file. Whitespace must not span lines:
+PRT_INDEX_MATCHER = re.compile(
+    rb"^(?:"
+    rb"[^\S\n]{2}REPORT[^\S\n]+\d+[^\S\n]+"
+    rb"(?P<ecl_day>\d+)[^\S\n]+(?P<ecl_month>\w+)[^\S\n]+(?P<ecl_year>\d+)"
+    rb"|Starting time step.*? date = "
+    rb"(?P<opm_day>\d+)-(?P<opm_month>\w+)-(?P<opm_year>\d+)"
+    rb"|.+?(?P<fipname>FIP\w{0,5})[^\S\n]+REPORT[^\S\n]+REGION[^\S\n]+(?P<region>\d+)"
+    rb"|[^\S\n]*:[^\S\n]*(?P<resvol>RESERVOIR VOLUMES)"
+    rb")",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+
+def index_filename(prt_file: Union[str, Path]) -> Path:
+    """Name of the sidecar file holding the index for a PRT file"""
+    return Path(str(prt_file) + INDEX_SUFFIX)
+
+
+def _file_signature(prt_file: Union[str, Path]) -> Dict[str, int]:
+    """File properties used to determine if an index is outdated"""
+    stat = Path(prt_file).stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _match_date(match: re.Match) -> datetime.date:
+    """Construct a date from a date stamp match, Eclipse or OPM style"""
+    prefix = "ecl_" if match.group("ecl_day") is not None else "opm_"
+    return datetime.date(
+        year=int(match.group(prefix + "year")),
+        month=parse_month(match.group(prefix + "month").decode().upper()),
+        day=int(match.group(prefix + "day")),
+    )
+
+
+def build_prt_index(prt_file: Union[str, Path]) -> Dict[str, Any]:
+    """Scan a PRT file once and record byte offsets of interesting lines.
+
+    Args:
+        prt_file: Path to PRT file
+
+    Returns:
+        Dictionary with lists for the keys "dates" (ISO date and offset of
+        the first date stamp for each report step date), "region_reports"
+        (date, fipname, region number and offset of each region report header)
+        and "reservoir_volumes" (date and offset of each RESERVOIR VOLUMES table
+        header). Dates are None when a table appears before any date stamp.
+    """
+    prt_index: Dict[str, Any] = {
+        "version": INDEX_VERSION,
+        **_file_signature(prt_file),
+        "dates": [],
+        "region_reports": [],
+        "reservoir_volumes": [],
+    }
+    if prt_index["size"] == 0:
+        return prt_index
+
+    date: Optional[str] = None
+    with Path(prt_file).open("rb") as f_handle, mmap.mmap(
+        f_handle.fileno(), 0, access=mmap.ACCESS_READ
+    ) as prt_map:
+        for match in PRT_INDEX_MATCHER.finditer(prt_map):  # type: ignore
+            if match.group("fipname") is not None:
+                prt_index["region_reports"].append(
+                    [
+                        date,
+                        match.group("fipname").decode().upper(),
+                        int(match.group("region")),
+                        match.start(),
+                    ]
+                )
+            elif match.group("resvol") is not None:
+                prt_index["reservoir_volumes"].append([date, match.start()])
+            else:
+                newdate = _match_date(match).isoformat()
+                if newdate != date:
+                    date = newdate
+                    prt_index["dates"].append([date, match.start()])
+    logger.info(
+        "Indexed %d report dates and %d region reports in %s",
+        len(prt_index["dates"]),
+        len(prt_index["region_reports"]),
+        prt_file,
+    )
+    return prt_index
+
+
+def get_prt_index(
+    prt_file: Union[str, Path], write_sidecar: bool = True
+) -> Dict[str, Any]:
+    """Load the index for a PRT file from its sidecar file, or build it.
+
+    The sidecar file is ignored if it does not match the size and modification
+    time of the PRT file.
+
+    Args:
+        prt_file: Path to PRT file
+        write_sidecar: Whether a new index should be written to disk.
+
+    Returns:
+        The index, see :func:`build_prt_index`.
+    """
+    sidecar = index_filename(prt_file)
+    if sidecar.is_file():
+        try:
+            prt_index = json.loads(sidecar.read_text(encoding="utf8"))
+        except ValueError:
+            logger.warning("Ignoring invalid PRT index file %s", sidecar)
+        else:
+            if prt_index.get("version") == INDEX_VERSION and all(
+                prt_index.get(key) == value
+                for key, value in _file_signature(prt_file).items()
+            ):
+                logger.info("Using PRT index in %s", sidecar)
+                return prt_index
+            logger.info("PRT index in %s is outdated", sidecar)
+
+    prt_index = build_prt_index(prt_file)
+    if write_sidecar:
+        try:
+            sidecar.write_text(json.dumps(prt_index), encoding="utf8")
+            logger.info("Written PRT index to %s", sidecar)
+        except OSError:
+            logger.warning("Could not write PRT index to %s", sidecar)
+    return prt_index
+
+
+def region_report_dates(prt_index: Dict[str, Any], fipname: str) -> List[str]:
+    """Sorted list of ISO dates for which there are region reports for a
+    specific region set"""
+    return sorted(
+        {
+            date
+            for date, report_fipname, _, _ in prt_index["region_reports"]
+            if report_fipname == fipname.upper() and date is not None
+        }
+    )
+
+
+def region_report_locations(
+    prt_index: Dict[str, Any], fipname: str, date: str
+) -> List[Tuple[int, int]]:
+    """Region numbers and byte offsets of all region report headers for a
+    region set at a date"""
+    return [
+        (region, offset)
+        for report_date, report_fipname, region, offset in prt_index["region_reports"]
+        if report_fipname == fipname.upper() and report_date == date
+    ]
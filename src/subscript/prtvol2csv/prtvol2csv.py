@@ -2,17 +2,20 @@
 metadata"""
 
 import argparse
+import datetime
 import logging
 import re
 import warnings
 from pathlib import Path
-from typing import Optional
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
 
 import pandas as pd
-import res2df
 from fmu.tools.fipmapper.fipmapper import FipMapper
+from res2df.common import parse_month
+from res2df.fipreports import REGION_REPORT_COLUMNS, report_block_lineparser
 
 from subscript import __version__, getLogger
+from subscript.prtvol2csv import prtindex
 
 DESCRIPTION = """
 Extract reservoir volumes pr FIPNUM from Eclipse PRT files and dump to CSV.
@@ -40,6 +43,12 @@ The directory to export to must exist.
 
 logger = getLogger(__name__)
 
+# Date stamps for report steps in PRT files, as written by Eclipse100 and OPM flow:
+ECL_DATEMATCHER = re.compile(r"\s\sREPORT\s+\d+\s+(\d+)\s+(\w+)\s+(\d+)")
+OPM_DATEMATCHER = re.compile(r"Starting time step.*? date = (\d+)-(\w+)-(\d+)\s*")
+
+RESVOL_MATCHER = re.compile(r"^\s*:\s*RESERVOIR VOLUMES.*$")
+
 
 class CustomFormatter(
     argparse.ArgumentDefaultsHelpFormatter, argparse.RawDescriptionHelpFormatter
@@ -73,6 +82,35 @@ def get_parser() -> argparse.ArgumentParser:
             "(or the reverse maps region2fipnum/zone2fipnum)."
         ),
     )
+    parser.add_argument(
+        "--fipnames",
+        type=str.upper,
+        nargs="+",
+        default=["FIPNUM"],
+        help=(
+            "Region sets to extract volumes for, all read in one pass over the "
+            "PRT file. Volumes for other region sets than FIPNUM are written "
+            "to separate CSV files, named by replacing 'fipnum' in the output "
+            "filename by the lower-cased region set name (or by appending it)."
+        ),
+    )
+    parser.add_argument(
+        "--longformat",
+        action="store_true",
+        help=(
+            "Write volumes for all region sets to the output file, in long "
+            "format with the columns FIPNAME and REGION_INDEX"
+        ),
+    )
+    parser.add_argument(
+        "--prtindex",
+        action="store_true",
+        help=(
+            "Use a byte offset index of the PRT file, stored next to it. "
+            "The index is created on first use, and makes repeated extractions "
+            "from large PRT files faster."
+        ),
+    )
     parser.add_argument(
         "-v", "--verbose", action="store_true", help="Be verbose, print the tables"
     )
@@ -157,47 +195,324 @@ def find_prtfile(basefile: str) -> str:
 
 
 def currently_in_place_from_prt(
-    prt_file: str, fipname: str = "FIPNUM", date: Optional[str] = None
+    prt_file: str,
+    fipname: str = "FIPNUM",
+    date: Optional[str] = None,
+    use_index: bool = False,
 ) -> pd.DataFrame:
     """Extracts currently-in-place volumes from a PRT file
 
-    This function uses res2df.fipreports, and slices its
-    output for the purpose here.
+    This is a convenience wrapper around :func:`scan_prt` for one
+    region set, ignoring the RESERVOIR VOLUMES table.
 
     Args:
         prt_file (str): Path to a PRT to parse
         fipname (str): FIPNUM, FIPZON or similar.
         date (str): If None, first date will be used. If not None,
-            it should be an ISO-formatted date string to extract
+            it should be an ISO-formatted date string to extract, or
+            "first" or "last".
+        use_index (bool): Use the byte offset index of the PRT file.
 
     Returns:
         pd.DataFrame
     """
-    inplace_df = res2df.fipreports.df(prt_file, fipname=fipname)
+    inplace_dfs, _ = scan_prt(
+        prt_file, fipnames=fipname, date=date, use_index=use_index
+    )
+    return inplace_dfs[fipname]
+
+
+def _parse_prt_date(line: str) -> Optional[datetime.date]:
+    """Return the date if the line is a report step date stamp, else None"""
+    matcheddate = ECL_DATEMATCHER.match(line)
+    if matcheddate is None:
+        matcheddate = OPM_DATEMATCHER.match(line)
+    if matcheddate is None:
+        return None
+    return datetime.date(
+        year=int(matcheddate.group(3)),
+        month=parse_month(matcheddate.group(2).upper()),
+        day=int(matcheddate.group(1)),
+    )
+
+
+def _parse_reservoir_volumes_line(line: str) -> Optional[dict]:
+    """Parse one FIPNUM row in the RESERVOIR VOLUMES table.
+
+    Returns None for lines that are not a row with numbers pr. FIPNUM."""
+    line_split = [part.strip() for part in line.split(":") if part.strip()]
+    if len(line_split) != 6:
+        return None
+    try:
+        int(line_split[0])
+    except ValueError:
+        # Not the line we are looking for.
+        return None
+    return {
+        "FIPNUM": int(line_split[0]),
+        "PORV_TOTAL": float(line_split[1]),
+        "HCPV_OIL": float(line_split[2]),
+        "WATPV_TOTAL": float(line_split[3]),
+        "HCPV_GAS": float(line_split[4]),
+        "HCPV_TOTAL": float(line_split[5]),
+    }
+
+
+def _parse_currently_in_place_line(line: str) -> Optional[tuple]:
+    """Parse a line inside a region report block, returning the tuple
+    from res2df.fipreports for the CURRENTLY IN PLACE row only."""
+    if "IN PLACE" not in line.upper():
+        return None
+
+    # The colons in the report block are not reliably included (differs by
+    # Eclipse version), insert them in fixed positions like res2df does:
+    line = line.strip()
+    if line[0] != ":":
+        line = ":" + line
+    if ":" not in line[25:27] and len(line) > 26:
+        linechars = list(line)
+        linechars[26] = ":"
+        line = "".join(linechars)
+
+    parsed = report_block_lineparser(line)
+    if not parsed or parsed[0] != "CURRENTLY IN PLACE":
+        return None
+    return parsed
+
+
+def scan_prt(
+    prt_file: str,
+    fipnames: Union[str, List[str]] = "FIPNUM",
+    date: Optional[Union[str, datetime.date]] = None,
+    use_index: bool = False,
+) -> Tuple[Dict[str, pd.DataFrame], pd.DataFrame]:
+    """Extract CURRENTLY IN PLACE and RESERVOIR VOLUMES from a PRT file
+    in one streaming pass.
+
+    The file is read line by line and only the rows of interest are kept in
+    memory. Unless the last date is requested, reading stops as soon as
+    a report step beyond the requested date is encountered and the
+    RESERVOIR VOLUMES table has been read.
+
+    Alternatively, a byte offset index of the PRT file can be used (and
+    created on first use, see :mod:`subscript.prtvol2csv.prtindex`), so that only
+    the tables for the requested date are read.
+
+    Args:
+        prt_file: Path to a PRT file to parse
+        fipnames: One or more region set names, FIPNUM, FIPZON or similar.
+        date: If None or "first", the first date with region reports will
+            be used, "last" gives the last date. Otherwise an ISO-formatted
+            date string (or a date object) to extract.
+        use_index: Seek to the tables using a PRT index sidecar file.
 
-    available_dates = inplace_df.sort_values("DATE")["DATE"].unique()
-    if date is None or date == "first":
-        date_str = available_dates[0]
-    elif date == "last":
-        date_str = available_dates[-1]
+    Returns:
+        Tuple with a dictionary of currently-in-place dataframes indexed
+        by FIPNUM, one for each fipname, and a dataframe with reservoir volumes
+        (empty if the table is not in the PRT file).
+    """
+    if isinstance(fipnames, str):
+        fipnames = [fipnames]
+    for fipname in fipnames:
+        if not fipname.startswith("FIP"):
+            raise ValueError("fipname must start with FIP")
+        if len(fipname) > 8:
+            raise ValueError("fipname can be at most 8 characters")
+
+    if date is None:
+        date = "first"
+    target_date: Optional[datetime.date] = None
+    if date not in ["first", "last"]:
+        target_date = (
+            date
+            if isinstance(date, datetime.date)
+            else datetime.date.fromisoformat(str(date))
+        )
+
+    if use_index:
+        records, kept_date, resvol_records = _read_indexed_prt(
+            prt_file, fipnames, date, target_date
+        )
     else:
-        date_str = str(date)
+        records, kept_date, resvol_records = _stream_prt(
+            prt_file, fipnames, date, target_date
+        )
+
+    inplace_df = pd.DataFrame(data=records, columns=REGION_REPORT_COLUMNS)
+    if kept_date is not None:
+        inplace_df = inplace_df[inplace_df["DATE"] == kept_date]
+    logger.info("Extracted CURRENTLY IN PLACE from %s at date %s", prt_file, kept_date)
+
+    inplace_dfs = {}
+    for fipname in fipnames:
+        fip_df = inplace_df[inplace_df["FIPNAME"] == fipname].drop(
+            ["DATATYPE", "TO_REGION", "FIPNAME", "DATE"], axis="columns"
+        )
+        fip_df = fip_df.set_index("REGION")
+        fip_df.index.name = "FIPNUM"
+        if fip_df.empty:
+            logger.warning("No %s region reports found in %s", fipname, prt_file)
+        inplace_dfs[fipname] = fip_df
+
+    if not resvol_records:
+        logger.warning("No RESERVOIR VOLUMES table found in PRT file %s", prt_file)
+        logger.warning("Include RPTSOL <newline> FIP=2 'FIPRESV' in Eclipse DATA file")
+        return inplace_dfs, pd.DataFrame()
+
+    return inplace_dfs, pd.DataFrame(resvol_records).set_index("FIPNUM")
+
+
+def _stream_prt(
+    prt_file: str,
+    fipnames: List[str],
+    date: Union[str, datetime.date],
+    target_date: Optional[datetime.date],
+) -> Tuple[List[list], Optional[datetime.date], List[dict]]:
+    """Read a PRT file line by line, collecting region report rows
+    and the first RESERVOIR VOLUMES table.
+
+    Returns:
+        Region report rows in res2df.fipreports format, the date they belong to,
+        and the reservoir volume rows.
+    """
+    fipname_lookup = {name.upper(): name for name in fipnames}
+    reportblockmatcher = re.compile(
+        r".+(" + "|".join(map(re.escape, fipnames)) + r")\s+REPORT\s+REGION\s+(\d+)",
+        re.IGNORECASE,
+    )
 
-    # Filter to requested date:
-    inplace_df = inplace_df[inplace_df["DATE"] == date_str]
+    # Region report rows, only for the date we are going to keep:
+    records: List[list] = []
+    kept_date: Optional[datetime.date] = None
+    resvol_records: List[dict] = []
+
+    # State variables while parsing line by line:
+    prt_date: Optional[datetime.date] = None
+    block_fipname: Optional[str] = None
+    region_index: Optional[int] = None
+    in_report_block = False
+    in_resvol_table = False
+    resvol_done = False
+    # Set when the region reports for the requested date are all read:
+    regions_done = False
 
-    # Filter dataframe to only volumes pr. region, not inter-region flows:
-    inplace_df = inplace_df[inplace_df["DATATYPE"] == "CURRENTLY IN PLACE"]
+    with Path(prt_file).open(encoding="utf8") as f_handle:
+        for line in f_handle:
+            newdate = _parse_prt_date(line)
+            if newdate is not None:
+                if newdate != prt_date:
+                    prt_date = newdate
+                    logger.debug("Found date: %s", prt_date)
+                stop_date = target_date if date != "first" else kept_date
+                if stop_date is not None and newdate > stop_date:
+                    regions_done = True
+                    if resvol_done:
+                        logger.debug("Passed requested date, stopping at %s", newdate)
+                        break
+                continue
+
+            if in_resvol_table:
+                if line.strip().startswith("======================="):
+                    in_resvol_table = False
+                    resvol_done = True
+                    continue
+                resvol_record = _parse_reservoir_volumes_line(line)
+                if resvol_record is not None:
+                    resvol_records.append(resvol_record)
+                continue
+            if not resvol_done and RESVOL_MATCHER.search(line) is not None:
+                in_resvol_table = True
+                continue
+            if regions_done:
+                continue
+
+            matchedreportblock = reportblockmatcher.match(line)
+            if matchedreportblock:
+                in_report_block = True
+                block_fipname = fipname_lookup[matchedreportblock.group(1).upper()]
+                region_index = int(matchedreportblock.group(2))
+                continue
+            if line.startswith(" ============================"):
+                in_report_block = False
+                continue
 
-    # Cleanup dataframe:
-    inplace_df.drop(
-        ["DATATYPE", "TO_REGION", "FIPNAME", "DATE"], axis="columns", inplace=True
+            if in_report_block:
+                parsed = _parse_currently_in_place_line(line)
+                if parsed is None:
+                    continue
+                if target_date is not None and prt_date != target_date:
+                    continue
+                if prt_date is not None and kept_date != prt_date:
+                    # Only the region reports for the latest date are kept:
+                    records = []
+                    kept_date = prt_date
+                records.append([prt_date, block_fipname, region_index, *list(parsed)])
+    return records, kept_date, resvol_records
+
+
+def _read_block(
+    f_handle: BinaryIO, offset: int, end_marker: str, strip: bool = False
+) -> List[str]:
+    """Read lines from a byte offset in a PRT file until (excluding) a line
+    starting with end_marker, optionally ignoring leading whitespace"""
+    f_handle.seek(offset)
+    lines = []
+    for rawline in f_handle:
+        line = rawline.decode("utf8")
+        if (line.strip() if strip else line).startswith(end_marker):
+            break
+        lines.append(line)
+    return lines
+
+
+def _read_indexed_prt(
+    prt_file: str,
+    fipnames: List[str],
+    date: Union[str, datetime.date],
+    target_date: Optional[datetime.date],
+) -> Tuple[List[list], Optional[datetime.date], List[dict]]:
+    """Collect the same data as _stream_prt(), but by seeking directly
+    to the tables of interest using the byte offset index of the PRT file."""
+    prt_index = prtindex.get_prt_index(prt_file)
+
+    available_dates = sorted(
+        set().union(
+            *[prtindex.region_report_dates(prt_index, fipname) for fipname in fipnames]
+        )
     )
-    inplace_df.set_index("REGION", inplace=True)
-    inplace_df.index.name = "FIPNUM"
+    kept_date: Optional[datetime.date] = None
+    if target_date is not None:
+        kept_date = target_date
+    elif available_dates:
+        kept_date = datetime.date.fromisoformat(
+            available_dates[0] if date == "first" else available_dates[-1]
+        )
 
-    logger.info("Extracted CURRENTLY IN PLACE from %s at date %s", prt_file, date_str)
-    return inplace_df
+    records: List[list] = []
+    resvol_records: List[dict] = []
+    with Path(prt_file).open("rb") as f_handle:
+        if kept_date is not None:
+            for fipname in fipnames:
+                for region_index, offset in prtindex.region_report_locations(
+                    prt_index, fipname, kept_date.isoformat()
+                ):
+                    block = _read_block(
+                        f_handle, offset, " ============================"
+                    )
+                    for line in block[1:]:
+                        parsed = _parse_currently_in_place_line(line)
+                        if parsed is not None:
+                            records.append(
+                                [kept_date, fipname, region_index, *list(parsed)]
+                            )
+        if prt_index["reservoir_volumes"]:
+            _, offset = prt_index["reservoir_volumes"][0]
+            block = _read_block(f_handle, offset, "=======================", strip=True)
+            for line in block[1:]:
+                resvol_record = _parse_reservoir_volumes_line(line)
+                if resvol_record is not None:
+                    resvol_records.append(resvol_record)
+    return records, kept_date, resvol_records
 
 
 def reservoir_volumes_from_prt(prt_file: str) -> pd.DataFrame:
@@ -228,39 +543,22 @@ def reservoir_volumes_from_prt(prt_file: str) -> pd.DataFrame:
         pd.DataFrame
     """  # noqa
     records = []
-    start_matcher = re.compile(r"^\s*:\s*RESERVOIR VOLUMES.*$")
 
     table_found = (
         False  # State determining if current line is in our interesting table or not.
     )
     with Path(prt_file).open(encoding="utf8") as f_handle:
         for line in f_handle:
-            if start_matcher.search(line) is not None:
+            if RESVOL_MATCHER.search(line) is not None:
                 table_found = True
                 continue
             if table_found and line.strip().startswith("======================="):
                 # PRT table is finished.
                 break
             if table_found:
-                # Extract lines with only numbers in between colons
-                line_split = [part.strip() for part in line.split(":") if part.strip()]
-                if len(line_split) != 6:
-                    continue
-                try:
-                    int(line_split[0])
-                except ValueError:
-                    # Not the line we are looking for.
-                    continue
-                records.append(
-                    {
-                        "FIPNUM": int(line_split[0]),
-                        "PORV_TOTAL": float(line_split[1]),
-                        "HCPV_OIL": float(line_split[2]),
-                        "WATPV_TOTAL": float(line_split[3]),
-                        "HCPV_GAS": float(line_split[4]),
-                        "HCPV_TOTAL": float(line_split[5]),
-                    }
-                )
+                record = _parse_reservoir_volumes_line(line)
+                if record is not None:
+                    records.append(record)
 
     if not records:
         logger.warning("No RESERVOIR VOLUMES table found in PRT file %s", prt_file)
@@ -292,25 +590,85 @@ def main() -> None:
         logger.error("PRT-file %s does not exist", prt_file)
         return
 
-    simvolumes_df = currently_in_place_from_prt(prt_file, "FIPNUM")
-    simvolumes_df.to_csv(Path(tablesdir) / args.outputfilename)
-    logger.info(
-        "Written CURRENTLY_IN_PLACE data to %s",
-        str(Path(tablesdir) / args.outputfilename),
+    inplace_dfs, resvolumes_df = scan_prt(
+        prt_file, args.fipnames, use_index=args.prtindex
     )
 
-    resvolumes_df = reservoir_volumes_from_prt(prt_file)
-
     fipmapper: Optional[FipMapper]
     if args.yaml:
         fipmapper = FipMapper(yamlfile=args.yaml, skipstring="Totals")
     else:
         fipmapper = None
 
-    volumes = prtvol2df(simvolumes_df, resvolumes_df, fipmapper=fipmapper)
+    volumes_dfs = {
+        fipname: (
+            prtvol2df(inplace_df, resvolumes_df, fipmapper=fipmapper)
+            if fipname == "FIPNUM"
+            else prtvol2df(inplace_df, pd.DataFrame())
+        )
+        for fipname, inplace_df in inplace_dfs.items()
+    }
 
-    volumes.to_csv(Path(tablesdir) / args.outputfilename)
-    logger.info("Written CSV file %s", str(Path(tablesdir) / args.outputfilename))
+    if args.longformat:
+        volumes_longformat(volumes_dfs).to_csv(
+            Path(tablesdir) / args.outputfilename, index=False
+        )
+        logger.info("Written CSV file %s", str(Path(tablesdir) / args.outputfilename))
+        return
+
+    for fipname, volumes in volumes_dfs.items():
+        outputfile = Path(tablesdir) / fipname_outputfilename(
+            args.outputfilename, fipname
+        )
+        volumes.index.name = fipname
+        volumes.to_csv(outputfile)
+        logger.info("Written CSV file %s", str(outputfile))
+
+
+def fipname_outputfilename(outputfilename: str, fipname: str) -> str:
+    """Determine the output filename for a specific region set
+
+    The filename for FIPNUM is used as is, for other region sets "fipnum" in
+    the filename is replaced by the lower-cased region set name, or if not
+    present, the region set name is appended to the filename stem.
+
+    Args:
+        outputfilename: Output filename as given for FIPNUM
+        fipname: Region set name, like FIPZON
+
+    Returns:
+        str: Filename, including any path given in outputfilename.
+    """
+    if fipname.upper() == "FIPNUM":
+        return outputfilename
+    filepath = Path(outputfilename)
+    if "fipnum" in filepath.name:
+        return str(filepath.with_name(filepath.name.replace("fipnum", fipname.lower())))
+    return str(
+        filepath.with_name(f"{filepath.stem}_{fipname.lower()}{filepath.suffix}")
+    )
+
+
+def volumes_longformat(volumes_dfs: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Stack volume tables for multiple region sets into one table
+
+    Args:
+        volumes_dfs: Volume tables indexed by the region index, one
+            for each region set name.
+
+    Returns:
+        pd.DataFrame: Volumes with the region set name in the column FIPNAME
+        and the region index in REGION_INDEX.
+    """
+    if not volumes_dfs:
+        return pd.DataFrame(columns=["FIPNAME", "REGION_INDEX"])
+    return pd.concat(
+        {
+            fipname: volumes.rename_axis("REGION_INDEX")
+            for fipname, volumes in volumes_dfs.items()
+        },
+        names=["FIPNAME"],
+    ).reset_index()
 
 
 def prtvol2df(
@@ -7,13 +7,19 @@ import os
 import shutil
 import sys
 import tempfile
+from functools import partial
 from pathlib import Path
+from typing import IO, Dict, List, Optional, Tuple
 
 import numpy
 import pandas
+import resfo
 from resdata.resfile import ResdataFile
 
-from subscript import __version__
+from subscript import __version__, getLogger
+from subscript.ensemble import map_realizations, realization_files
+
+logger = getLogger(__name__)
 
 DESCRIPTION = """
 Slice a subset of restart-dates from an E100 Restart file (UNRST)
@@ -24,8 +30,21 @@ Example::
 
 where four restarts evenly spread out in relevant dates will be picked and
 written to the same filename (keeping the original is optional)
+
+Instead of a number of evenly spread dates, the restarts to keep can be
+chosen from a list of dates, a yearly or monthly grid of dates, or by keeping
+every Nth report step. Several UNRST files, typically one for each
+realization in an ensemble, can be thinned in parallel::
+
+    $ restartthinner --frequency yearly --jobs 8 "realization-*/iter-3/*/*.UNRST"
 """
 
+# Frequency choices mapped to pandas offset aliases for period starts:
+FREQUENCIES = {"yearly": "YS", "monthly": "MS"}
+
+# Chunk size when copying report steps between files:
+COPY_BUFSIZE = 16 * 1024 * 1024
+
 
 def find_resdata_app(toolname: str) -> str:
     """Locate path of apps in resdata.
@@ -52,14 +71,25 @@ def find_resdata_app(toolname: str) -> str:
 
 
 def date_slicer(slicedates: list, restartdates: list, restartindices: list) -> dict:
-    """Make a dict that maps a chosen restart date to a report index"""
-    slicedatemap = {}
-    for slicedate in slicedates:
-        daydistances = [
-            abs((pandas.Timestamp(slicedate) - x).days) for x in restartdates
-        ]
-        slicedatemap[slicedate] = restartindices[daydistances.index(min(daydistances))]
-    return slicedatemap
+    """Make a dict that maps a chosen restart date to a report index
+
+    The restart dates must be sorted. For each slice date the closest restart
+    date is found by binary search, with distances counted in whole days
+    (rounded down). On ties the earliest restart date is chosen.
+    """
+    restart_dt64 = numpy.asarray(restartdates, dtype="datetime64[ns]")
+    slice_dt64 = numpy.asarray(slicedates, dtype="datetime64[ns]")
+    right = numpy.searchsorted(restart_dt64, slice_dt64).clip(0, len(restart_dt64) - 1)
+    left = (right - 1).clip(0)
+    one_day = numpy.timedelta64(1, "D")
+    choose_right = numpy.abs((slice_dt64 - restart_dt64[right]) // one_day) < numpy.abs(
+        (slice_dt64 - restart_dt64[left]) // one_day
+    )
+    chosen = numpy.where(choose_right, right, left)
+    return {
+        slicedate: restartindices[int(idx)]
+        for slicedate, idx in zip(slicedates, chosen)
+    }
 
 
 def rd_repacker(rstfilename: str, slicerstindices: list, quiet: bool) -> None:
@@ -114,6 +144,104 @@ def rd_repacker(rstfilename: str, slicerstindices: list, quiet: bool) -> None:
         shutil.rmtree(rstfilepath / tempdir)
 
 
+def unrst_report_blocks(rstfilename: str) -> List[Tuple[int, int, int]]:
+    """Locate each report step in an unformatted restart file.
+
+    Only the keyword headers are read from the file, except for the
+    SEQNUM arrays which hold the report step numbers.
+
+    Returns:
+        List of tuples with report step number, start and end byte offsets
+        for each report step in the file.
+    """
+    blocks: List[List[int]] = []
+    with Path(rstfilename).open("rb") as f_handle:
+        for entry in resfo.lazy_read(f_handle, resfo.Format.UNFORMATTED):
+            if entry.read_keyword() == "SEQNUM  ":
+                if blocks:
+                    blocks[-1][2] = entry.start
+                seqnum = entry.read_array()
+                blocks.append([int(seqnum[0]), entry.start, -1])  # type: ignore
+        if blocks:
+            blocks[-1][2] = f_handle.seek(0, os.SEEK_END)
+    return [(report_step, start, end) for report_step, start, end in blocks]
+
+
+def unrst_report_dates(rstfilename: str) -> Tuple[List[int], numpy.ndarray]:
+    """Read report step numbers and dates from an unformatted restart file.
+
+    This is done in one pass over the file, reading only the SEQNUM and
+    INTEHEAD arrays.
+
+    Returns:
+        List of report step numbers, and an array of datetime64 report dates
+        with day resolution.
+
+    Raises:
+        ValueError: if the file contains no report steps, or is not an
+            unformatted file.
+    """
+    report_steps: List[int] = []
+    dates: List[str] = []
+    with Path(rstfilename).open("rb") as f_handle:
+        try:
+            for entry in resfo.lazy_read(f_handle, resfo.Format.UNFORMATTED):
+                keyword = entry.read_keyword()
+                if keyword == "SEQNUM  ":
+                    report_steps.append(int(entry.read_array()[0]))  # type: ignore
+                elif keyword == "INTEHEAD" and len(dates) < len(report_steps):
+                    day, month, year = entry.read_array()[64:67]  # type: ignore
+                    dates.append(f"{year:04d}-{month:02d}-{day:02d}")
+        except resfo.ResfoParsingError as err:
+            raise ValueError(
+                f"{rstfilename} is not an unformatted unified restart file"
+            ) from err
+    if not report_steps or len(dates) != len(report_steps):
+        raise ValueError(f"{rstfilename} is not a unified restart file")
+    return report_steps, numpy.array(dates, dtype="datetime64[D]")
+
+
+def _copy_bytes(source: IO[bytes], target: IO[bytes], start: int, end: int) -> None:
+    """Copy a byte range from one open file to the current position of another"""
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(COPY_BUFSIZE, remaining))
+        if not chunk:
+            raise OSError(f"Unexpected end of file in {source.name}")
+        target.write(chunk)
+        remaining -= len(chunk)
+
+
+def resfo_repacker(rstfilename: str, slicerstindices: list) -> None:
+    """
+    Thin an unformatted restart file in place, keeping only the chosen
+    report steps.
+
+    This is an alternative to rd_repacker() that does not need the external
+    resdata tools. The file is scanned once for report step locations, and the
+    report steps to keep are copied unmodified into a temporary file next
+    to the original, which then replaces the original file.
+    """
+    rstpath = Path(rstfilename)
+    blocks = unrst_report_blocks(rstfilename)
+    with tempfile.NamedTemporaryFile(
+        dir=rstpath.parent, prefix=rstpath.name, suffix=".tmp", delete=False
+    ) as out_handle:
+        tmpfilename = out_handle.name
+        try:
+            with rstpath.open("rb") as in_handle:
+                for report_step, start, end in blocks:
+                    if report_step in slicerstindices:
+                        _copy_bytes(in_handle, out_handle, start, end)
+        except BaseException:
+            out_handle.close()
+            os.remove(tmpfilename)
+            raise
+    shutil.copymode(rstfilename, tmpfilename)
+    os.replace(tmpfilename, rstfilename)
+
+
 def get_restart_indices(rstfilename: str) -> list:
     """Extract a list of RST indices for a filename"""
     if Path(rstfilename).exists():
@@ -122,24 +250,45 @@ def get_restart_indices(rstfilename: str) -> list:
     raise FileNotFoundError(f"{rstfilename} not found")
 
 
-def restartthinner(
-    filename: str,
-    numberofslices: int,
-    quiet: bool = False,
-    dryrun: bool = True,
-    keep: bool = False,
-) -> None:
-    """
-    Thin an existing UNRST file to selected number of restarts.
+def select_report_steps(
+    restart_indices: List[int],
+    restart_dates: List[datetime.date],
+    numberofslices: int = 0,
+    slicedates: Optional[List[datetime.date]] = None,
+    frequency: Optional[str] = None,
+    every: int = 0,
+) -> List[int]:
+    """Choose which report steps to keep from a restart file.
+
+    The policy is determined by the first given of the arguments ``every``,
+    ``slicedates``, ``frequency`` and ``numberofslices``. For all policies
+    except ``every``, the report steps closest to a set of dates are chosen.
+
+    Args:
+        restart_indices: Report step numbers in the restart file.
+        restart_dates: Sorted dates for each report step.
+        numberofslices: Number of evenly spaced dates between the first and
+            the last restart date. If one, only the last is chosen.
+        slicedates: Explicit dates.
+        frequency: "yearly" or "monthly", for the first day of every
+            year or month between the first and the last restart date.
+        every: Keep every Nth report step, starting with the first.
+
+    Returns:
+        Sorted list of unique report step numbers to keep.
     """
-    rst = ResdataFile(filename)
-    restart_indices = get_restart_indices(filename)
-    restart_dates = [
-        rst.iget_restart_sim_time(index) for index in range(len(restart_indices))
-    ]
-
-    if numberofslices > 1:
-        slicedates = pandas.DatetimeIndex(
+    if every > 0:
+        return list(restart_indices[::every])
+    if slicedates:
+        chosen_dates = pandas.DatetimeIndex(slicedates).values
+    elif frequency is not None:
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unsupported frequency {frequency}")
+        chosen_dates = pandas.date_range(
+            restart_dates[0], restart_dates[-1], freq=FREQUENCIES[frequency]
+        ).values
+    elif numberofslices > 1:
+        chosen_dates = pandas.DatetimeIndex(
             numpy.linspace(
                 pandas.Timestamp(restart_dates[0]).value,
                 pandas.Timestamp(restart_dates[-1]).value,
@@ -147,13 +296,55 @@ def restartthinner(
             )
         ).values
     else:
-        slicedates = [restart_dates[-1]]  # Only return last date if only one is wanted
+        # Only return last date if only one is wanted
+        chosen_dates = pandas.DatetimeIndex([restart_dates[-1]]).values
+    return sorted(
+        set(date_slicer(list(chosen_dates), restart_dates, restart_indices).values())
+    )
+
 
-    slicerstindices = list(
-        date_slicer(slicedates, restart_dates, restart_indices).values()
+def restartthinner(
+    filename: str,
+    numberofslices: int,
+    quiet: bool = False,
+    dryrun: bool = True,
+    keep: bool = False,
+    engine: str = "resfo",
+    slicedates: Optional[List[datetime.date]] = None,
+    frequency: Optional[str] = None,
+    every: int = 0,
+) -> List[int]:
+    """
+    Thin an existing UNRST file to selected number of restarts. Formatted
+    restart files (FUNRST) are not supported.
+
+    The engine is either "resfo", which copies the selected report steps
+    natively in Python, or "resdata" which requires the rd_unpack and rd_pack
+    tools from resdata. See :func:`select_report_steps` for how the other
+    arguments determine which report steps are kept.
+
+    Returns:
+        The report step numbers that are kept.
+    """
+    if not Path(filename).exists():
+        raise FileNotFoundError(f"{filename} not found")
+    if Path(filename).suffix.upper() == ".FUNRST":
+        raise ValueError(
+            f"{filename} is a formatted restart file, only UNRST files are supported"
+        )
+    restart_indices, restart_dt64 = unrst_report_dates(filename)
+    restart_dates = restart_dt64.astype(datetime.date).tolist()
+
+    slicerstindices = select_report_steps(
+        restart_indices,
+        restart_dates,
+        numberofslices=numberofslices,
+        slicedates=slicedates,
+        frequency=frequency,
+        every=every,
     )
-    slicerstindices.sort()
-    slicerstindices = list(set(slicerstindices))  # uniquify
+    if not slicerstindices:
+        raise ValueError(f"No report steps in {filename} selected")
 
     if not quiet:
         print("Selected restarts:")
@@ -172,8 +363,52 @@ def restartthinner(
             if not quiet:
                 print(f"Info: Backing up {filename} to {backupname}")
             shutil.copyfile(filename, backupname)
-        rd_repacker(filename, slicerstindices, quiet)
+        if engine == "resdata":
+            rd_repacker(filename, slicerstindices, quiet)
+        else:
+            resfo_repacker(filename, slicerstindices)
     print(f"Written to {filename}")
+    return slicerstindices
+
+
+def restartthinner_ensemble(
+    filenames: List[str], jobs: int = 1, **kwargs
+) -> Dict[str, Optional[List[int]]]:
+    """Thin UNRST files for multiple realizations in an ensemble, with the
+    realization index given by "realization-<N>" in each path.
+
+    A failure for one realization is logged, and does not stop the thinning
+    of the other realizations. Files without a realization index are skipped.
+
+    Args:
+        filenames: UNRST files to thin.
+        jobs: Number of files to thin in parallel in worker processes.
+        kwargs: Passed on to :func:`restartthinner` for each file.
+
+    Returns:
+        Dictionary from each filename to the report steps kept, or None
+        if thinning failed or the file was skipped.
+    """
+    if jobs > 1:
+        # Selection tables from parallel workers would be interleaved:
+        kwargs["quiet"] = True
+    realizations = realization_files(filenames)
+    results = dict(
+        map_realizations(
+            partial(restartthinner, **kwargs),
+            [(real, (filename,)) for real, filename in realizations],
+            jobs=jobs,
+        )
+    )
+    thinned: Dict[str, Optional[List[int]]] = dict.fromkeys(filenames)
+    for real, filename in realizations:
+        thinned[filename] = results.get(real)
+    logger.info(
+        "Thinned %d of %d UNRST files",
+        sum(steps is not None for steps in thinned.values()),
+        len(filenames),
+    )
+    return thinned
 
 
 def get_parser() -> argparse.ArgumentParser:
@@ -181,10 +416,35 @@ def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(
         formatter_class=argparse.ArgumentDefaultsHelpFormatter, description=DESCRIPTION
     )
-    parser.add_argument("UNRST", help="Name of UNRST file")
     parser.add_argument(
+        "UNRST",
+        nargs="+",
+        help=(
+            "Name of UNRST file. Multiple files or glob patterns can be "
+            "given to thin the files for many realizations"
+        ),
+    )
+    policy = parser.add_mutually_exclusive_group()
+    policy.add_argument(
         "-n", "--restarts", type=int, help="Number of restart dates wanted", default=0
     )
+    policy.add_argument(
+        "--dates",
+        nargs="+",
+        type=datetime.date.fromisoformat,
+        help="Keep the restarts closest to these dates, in ISO format (YYYY-MM-DD)",
+    )
+    policy.add_argument(
+        "--frequency",
+        choices=list(FREQUENCIES),
+        help="Keep the restarts closest to the start of every year or month",
+    )
+    policy.add_argument(
+        "--every",
+        type=int,
+        default=0,
+        help="Keep every Nth restart, starting with the first",
+    )
     parser.add_argument(
         "-d",
         "--dryrun",
@@ -206,6 +466,22 @@ def get_parser() -> argparse.ArgumentParser:
         default=False,
         help="Keep original UNRST file",
     )
+    parser.add_argument(
+        "--engine",
+        choices=["resfo", "resdata"],
+        default="resfo",
+        help=(
+            "How to write the thinned UNRST file. resfo copies the selected "
+            "report steps in one pass, resdata uses the external rd_unpack "
+            "and rd_pack tools"
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of UNRST files to thin in parallel, for multiple files",
+    )
     parser.add_argument(
         "--version",
         action="version",
@@ -218,10 +494,35 @@ def main():
     """Endpoint for command line script"""
     parser = get_parser()
     args = parser.parse_args()
-    if args.restarts <= 0:
+    if not (args.dates or args.frequency or args.every > 0) and args.restarts <= 0:
         print("ERROR: Number of restarts must be a positive number")
         sys.exit(1)
-    if args.UNRST.endswith("DATA"):
-        print("ERROR: Provide the UNRST file, not the DATA file")
-        sys.exit(1)
-    restartthinner(args.UNRST, args.restarts, args.quiet, args.dryrun, args.keep)
+    filenames = []
+    for unrst in args.UNRST:
+        if unrst.endswith("DATA"):
+            print("ERROR: Provide the UNRST file, not the DATA file")
+            sys.exit(1)
+        if glob.has_magic(unrst):
+            matches = sorted(glob.glob(unrst))
+            if not matches:
+                print(f"ERROR: No UNRST files matching {unrst}")
+                sys.exit(1)
+            filenames.extend(matches)
+        else:
+            filenames.append(unrst)
+    kwargs = {
+        "numberofslices": args.restarts,
+        "quiet": args.quiet,
+        "dryrun": args.dryrun,
+        "keep": args.keep,
+        "engine": args.engine,
+        "slicedates": args.dates,
+        "frequency": args.frequency,
+        "every": args.every,
+    }
+    if len(filenames) == 1:
+        restartthinner(filenames[0], **kwargs)
+    else:
+        thinned = restartthinner_ensemble(filenames, jobs=args.jobs, **kwargs)
+        if None in thinned.values():
+            sys.exit(1)
@@ -2,9 +2,11 @@
 a mapping between Region and Zones in RMS, to FIPNUMs in Eclipse"""
 
 import argparse
+import glob
 import logging
+import sys
 from pathlib import Path
-from typing import Any, Dict
+from typing import Dict, List, Tuple
 
 import pandas as pd
 import yaml
@@ -12,6 +14,7 @@ from fmu.tools.fipmapper import fipmapper
 from fmu.tools.rms import volumetrics
 
 from subscript import getLogger
+from subscript.ensemble import map_realizations, realization_files
 from subscript.prtvol2csv.prtvol2csv import currently_in_place_from_prt
 
 logger = getLogger(__name__)
@@ -21,6 +24,11 @@ DESCRIPTION = """Tool for comparing volumetrics from Eclipse PRT files
 with volumetrics from RMS, when the mapping between FIPNUMs and
 region/zones is provided in a yaml file.
 
+If the PRT file argument is a glob pattern matching files in multiple
+realization directories, all realizations are compared in one run, and
+the output gets a REAL column. The realization directory in the
+volumetrics filebase can then be given as "realization-*".
+
 This script is currently in BETA. The name and calling syntax might change.
 """
 
@@ -57,14 +65,20 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--output", type=str, help="Output CSV file with comparable volumetrics"
     )
+    parser.add_argument(
+        "--prtindex",
+        action="store_true",
+        help="Use (and create if needed) a byte offset index of the PRT file",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of realizations to process in parallel, for glob patterns",
+    )
     return parser
 
 
-def _prefix_keys(prefix: str, somedict: Dict[str, Any]) -> Dict[str, Any]:
-    """Add a string prefix to every key of a dictionary"""
-    return {prefix + key: value for key, value in somedict.items()}
-
-
 def _compare_volumetrics(
     disjoint_sets_df: pd.DataFrame,
     simvolumes_df: pd.DataFrame,
@@ -76,44 +90,48 @@ def _compare_volumetrics(
     columns from RMS with "RMS". Returned columns starting with DIFF are
     absolute differences of eclipse volumes minus RMS volumes.
     """
-    set_data_list = []
-    for set_idx, regzonfip_set in disjoint_sets_df.groupby("SET"):
-        set_results = {"SET": set_idx}
-        # Slice and sum simvolumes_df for the FIPNUMS in this set:
-        set_fipnums = set(regzonfip_set["FIPNUM"]).intersection(simvolumes_df.index)
-        if not set_fipnums:
-            # Skip sets for which there are no PRT volume data
-            logger.warning(
-                "Skipping FIPNUMs %s, no PRT volumes found",
-                regzonfip_set["FIPNUM"].to_numpy(),
-            )
-            continue
-        set_results.update(
-            _prefix_keys("ECL_", dict(simvolumes_df.loc[list(set_fipnums)].sum()))
+    # Map each FIPNUM and each (REGION, ZONE) to its set, and sum each
+    # side over the sets:
+    ecl_set_df = (
+        disjoint_sets_df[["SET", "FIPNUM"]]
+        .drop_duplicates()
+        .merge(simvolumes_df, left_on="FIPNUM", right_index=True)
+        .drop("FIPNUM", axis="columns")
+        .groupby("SET")
+        .sum()
+        .add_prefix("ECL_")
+    )
+    rms_set_df = (
+        disjoint_sets_df[["SET", "REGION", "ZONE"]]
+        .drop_duplicates()
+        .merge(
+            volumetrics_df.drop("FACIES", axis="columns", errors="ignore"),
+            left_on=["REGION", "ZONE"],
+            right_index=True,
         )
+        .drop(["REGION", "ZONE"], axis="columns")
+        .groupby("SET")
+        .sum()
+        .add_prefix("RMS_")
+    )
 
-        # Slicing in multiindex requires a list of unique tuples:
-        regzones = {
-            tuple(regzone) for regzone in regzonfip_set[["REGION", "ZONE"]].to_numpy()
-        }.intersection({tuple(regzone) for regzone in volumetrics_df.index})
-        if not regzones:
-            # Skip sets for which there are not volumetrics:
-            logger.warning(
-                "Skipping regzones %s, no volumetrics found",
-                regzonfip_set[["REGION", "ZONE"]].to_numpy(),
-            )
-            continue
-        # Slice and sum RMS volumetrics:
-        set_results.update(
-            _prefix_keys("RMS_", dict(volumetrics_df.loc[list(regzones)].sum()))
+    # Skip sets for which there are no PRT volume data or no volumetrics:
+    all_sets = disjoint_sets_df.groupby("SET")
+    for set_idx in set(all_sets.groups).difference(ecl_set_df.index):
+        logger.warning(
+            "Skipping FIPNUMs %s, no PRT volumes found",
+            all_sets.get_group(set_idx)["FIPNUM"].to_numpy(),
+        )
+    for set_idx in set(ecl_set_df.index).difference(rms_set_df.index):
+        logger.warning(
+            "Skipping regzones %s, no volumetrics found",
+            all_sets.get_group(set_idx)[["REGION", "ZONE"]].to_numpy(),
         )
 
-        if "RMS_FACIES" in set_results:
-            del set_results["RMS_FACIES"]
-
-        set_data_list.append(set_results)
-
-    comparison_df = pd.DataFrame(set_data_list)
+    comparison_df = ecl_set_df.join(rms_set_df, how="inner")
+    if comparison_df.empty:
+        return pd.DataFrame()
+    comparison_df = comparison_df.reset_index()
 
     common_columns = set(volumetrics_df.columns).intersection(simvolumes_df.columns)
     for common in common_columns:
@@ -139,24 +157,121 @@ def _disjoint_sets_to_dict(
     return pd.concat([regions, zones, fipnums], axis=1).to_dict(orient="index")
 
 
-def main() -> None:
-    """Parse command line arguments and run"""
-    args = get_parser().parse_args()
+def _load_volumes(
+    prtfile: str, volumetricsbase: str, use_index: bool = False
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Load simulator volumes from a PRT (or CSV) file and RMS volumetrics
 
-    if args.PRTFILE.endswith("csv"):
-        simvolumes_df = pd.read_csv(args.PRTFILE, index_col="FIPNUM")
+    Returns:
+        Tuple with simulator volumes indexed by FIPNUM and RMS volumetrics
+        indexed by REGION and ZONE.
+    """
+    if prtfile.endswith("csv"):
+        simvolumes_df = pd.read_csv(prtfile, index_col="FIPNUM")
     else:
-        simvolumes_df = currently_in_place_from_prt(args.PRTFILE, "FIPNUM")
+        simvolumes_df = currently_in_place_from_prt(
+            prtfile, "FIPNUM", use_index=use_index
+        )
 
-    volumetrics_df = volumetrics.merge_rms_volumetrics(args.volumetricsbase).set_index(
+    volumetrics_df = volumetrics.merge_rms_volumetrics(volumetricsbase).set_index(
         ["REGION", "ZONE"]
     )
+    return simvolumes_df, volumetrics_df
+
+
+def _compare_realization(
+    disjoint_sets_df: pd.DataFrame,
+    prtfile: str,
+    volumetricsbase: str,
+    use_index: bool = False,
+) -> pd.DataFrame:
+    """Load and compare volumes for one realization, suitable for
+    running in a worker process"""
+    simvolumes_df, volumetrics_df = _load_volumes(prtfile, volumetricsbase, use_index)
+    return _compare_volumetrics(disjoint_sets_df, simvolumes_df, volumetrics_df)
+
+
+def compare_ensemble_volumetrics(
+    prtfiles: List[str],
+    volumetricsbase: str,
+    disjoint_sets_df: pd.DataFrame,
+    jobs: int = 1,
+    use_index: bool = False,
+) -> pd.DataFrame:
+    """Compare Eclipse and RMS volumetrics for multiple realizations
+
+    The realization index is determined from "realization-<N>" in each
+    PRT file path. If the volumetrics filebase contains "realization-*",
+    this is replaced by the realization directory, if not, the same RMS
+    volumetrics are used for all realizations. A realization that fails is
+    logged and left out.
+
+    Args:
+        prtfiles: PRT files (or CSV files from prtvol2csv), one per realization.
+        volumetricsbase: Filebase for RMS volumetrics.
+        disjoint_sets_df: Disjoint sets of FIPNUM, REGION and ZONE, computed
+            once and shared by all realizations.
+        jobs: Number of worker processes.
+        use_index: Whether to use byte offset indices of the PRT files.
+
+    Returns:
+        pd.DataFrame: Comparisons as from _compare_volumetrics(), stacked
+        with a REAL column.
+    """
+    tasks = [
+        (
+            real,
+            (
+                disjoint_sets_df,
+                prtfile,
+                volumetricsbase.replace("realization-*", f"realization-{real}"),
+                use_index,
+            ),
+        )
+        for real, prtfile in realization_files(prtfiles)
+    ]
+    real_comparisons = [
+        comparison_df.assign(REAL=real)
+        for real, comparison_df in map_realizations(
+            _compare_realization, tasks, jobs=jobs
+        )
+        if not comparison_df.empty
+    ]
+    if not real_comparisons:
+        return pd.DataFrame()
+    ensemble_df = pd.concat(real_comparisons, ignore_index=True)
+    logger.info("Compared volumetrics for %d realizations", len(real_comparisons))
+    return ensemble_df[
+        ["REAL"] + [col for col in ensemble_df.columns if col != "REAL"]
+    ].sort_values(["REAL", "SET"], ignore_index=True)
+
+
+def main() -> None:
+    """Parse command line arguments and run"""
+    args = get_parser().parse_args()
 
     disjoint_sets_df = fipmapper.FipMapper(yamlfile=args.fipmapconfig).disjoint_sets()
 
-    comparison_df = _compare_volumetrics(
-        disjoint_sets_df, simvolumes_df, volumetrics_df
-    )
+    if glob.has_magic(args.PRTFILE):
+        comparison_df = compare_ensemble_volumetrics(
+            sorted(glob.glob(args.PRTFILE)),
+            args.volumetricsbase,
+            disjoint_sets_df,
+            jobs=args.jobs,
+            use_index=args.prtindex,
+        )
+        index_columns = ["REAL", "SET"]
+    else:
+        simvolumes_df, volumetrics_df = _load_volumes(
+            args.PRTFILE, args.volumetricsbase, args.prtindex
+        )
+        comparison_df = _compare_volumetrics(
+            disjoint_sets_df, simvolumes_df, volumetrics_df
+        )
+        index_columns = ["SET"]
+    if comparison_df.empty:
+        logger.error("No volumetrics to compare for %s", args.PRTFILE)
+        sys.exit(1)
     if args.sets:
         Path(args.sets).write_text(
             yaml.dump(_disjoint_sets_to_dict(disjoint_sets_df)), encoding="utf8"
@@ -169,7 +284,7 @@ def main() -> None:
         pd.set_option("display.max_columns", 50)
         pd.set_option("display.width", 1000)
         print(disjoint_sets_df)
-        print(comparison_df.set_index("SET"))
+        print(comparison_df.set_index(index_columns))
 
 
 if __name__ == "__main__":
@@ -8,18 +8,28 @@ hence the name. Later, this library has been merged into opm-common
 
 import argparse
 import datetime
+import hashlib
+import json
 import logging
+import os
+import re
 import tempfile
 import textwrap
+from importlib.metadata import version
 from pathlib import Path
-from typing import Dict, List, Literal, Optional, Union
+from typing import Any, Dict, List, Literal, NamedTuple, Optional, Tuple, Union
 
 import dateutil.parser
 import yaml
+from opm.io.parser import ParseContext, Parser
 from pydantic import BaseModel, FilePath
 
 from subscript import __version__, getLogger
-from subscript.sunsch.time_vector import TimeVector  # type: ignore
+from subscript.sunsch.time_vector import (  # type: ignore
+    TimeVector,
+    error_actions,
+    split_deck,
+)
 
 logger = getLogger(__name__)
 
@@ -44,6 +54,21 @@ EXAMPLES = """
 """
 
 
+# Increase when the format of cached parsed files changes:
+CACHE_FORMAT = 1
+
+KeywordBlocks = List[Tuple[Optional[datetime.datetime], List[Any]]]
+
+
+class ParsedSchFile(NamedTuple):
+    """A file to be included, parsed once by OPM and split into blocks of
+    keywords for each date, see time_vector.split_deck()"""
+
+    blocks: KeywordBlocks
+    nonempty: bool
+    starts_with_dates: bool
+
+
 class InsertStatement(BaseModel):
     date: Optional[datetime.date] = None
     filename: Optional[FilePath] = None
@@ -64,6 +89,7 @@ class SunschConfig(BaseModel):
         Literal["daily", "monthly", "yearly", "weekly", "biweekly", "bimonthly"]
     ] = None
     insert: Optional[List[InsertStatement]] = None
+    cachedir: Optional[str] = None
 
     def __init__(self, **config):
         """Transform the input to provide defaults to required fields"""
@@ -120,22 +146,30 @@ def process_sch_config(conf: Union[dict, SunschConfig]) -> TimeVector:
     # a date to anchor to:
     schedule = TimeVector(conf.starttime)
 
+    # Each file is parsed only once, also when inserted multiple times:
+    parsed_files: Dict[str, ParsedSchFile] = {}
+
+    def parsed(filename: Path) -> ParsedSchFile:
+        if str(filename) not in parsed_files:
+            parsed_files[str(filename)] = parse_sch_file(filename, conf.cachedir)
+        return parsed_files[str(filename)]
+
     if conf.files is not None:
         for filename in conf.files:
-            if sch_file_nonempty(filename):
+            if parsed(filename).nonempty:
                 logger.info("Loading %s", filename)
             else:
                 logger.warning("No Eclipse statements in %s, skipping", filename)
                 continue
 
-            file_starts_with_dates = sch_file_starts_with_dates_keyword(filename)
-            timevector = load_timevector_from_file(
-                filename, conf.startdate, file_starts_with_dates
+            file_starts_with_dates = parsed(filename).starts_with_dates
+            timevector = load_timevector_from_blocks(
+                parsed(filename).blocks, conf.startdate, file_starts_with_dates
             )
             if file_starts_with_dates:
-                schedule.load_string(str(timevector))
+                schedule.load_blocks(timevector.to_blocks())
             else:
-                schedule.load_string(str(timevector), conf.starttime)
+                schedule.load_blocks(timevector.to_blocks(), conf.starttime)
 
     if conf.insert is not None:
         logger.info("Processing %s insert statements", str(len(conf.insert)))
@@ -170,8 +204,8 @@ def process_sch_config(conf: Union[dict, SunschConfig]) -> TimeVector:
             # Do the insertion:
             if date >= conf.starttime:
                 if insert_statement.string is None:
-                    if sch_file_nonempty(filename):
-                        schedule.load(str(filename), date=date)
+                    if parsed(filename).nonempty:
+                        schedule.load_blocks(parsed(filename).blocks, date=date)
                     else:
                         logger.warning(
                             "No Eclipse statements in %s, skipping", filename
@@ -223,19 +257,34 @@ def load_timevector_from_file(
     delete whatever comes before the first DATES. But if the first DATES
     predates startdate, then we delete it.
 
+    Returns:
+        opm.tools.TimeVector
+    """
+    return load_timevector_from_blocks(
+        parse_sch_file(filename).blocks, startdate, file_starts_with_dates
+    )
+
+
+def load_timevector_from_blocks(
+    blocks: KeywordBlocks, startdate: datetime.date, file_starts_with_dates: bool
+) -> TimeVector:
+    """
+    Load a timevector from a parsed file, and clip dates that are earlier
+    than startdate, as in load_timevector_from_file().
+
     Returns:
         opm.tools.TimeVector
     """
     tmpschedule = TimeVector(datetime.date(1900, 1, 1))
     if file_starts_with_dates:
-        tmpschedule.load(str(filename))
+        tmpschedule.load_blocks(blocks)
         early_dates = [date for date in tmpschedule.dates if date.date() < startdate]
         if len(early_dates) > 1:
             logger.info("Clipping away dates: %s", str(early_dates[1:]))
             for date in early_dates:
                 tmpschedule.delete(date)
     else:
-        tmpschedule.load(str(filename), datetime_from_date(datetime.date(1900, 1, 1)))
+        tmpschedule.load_blocks(blocks, datetime_from_date(datetime.date(1900, 1, 1)))
 
         early_dates = [date for date in tmpschedule.dates if date.date() < startdate]
         if len(early_dates) > 1:
@@ -245,32 +294,33 @@ def load_timevector_from_file(
     return tmpschedule
 
 
-def sch_file_nonempty(filename: Path) -> bool:
-    """Determine if a file (to be included) has any Eclipse
-    keywords at all (excluding comments)
+def parse_sch_file(
+    filename: Path, cachedir: Optional[Union[str, Path]] = None
+) -> ParsedSchFile:
+    """Parse a file to be included, and determine if it has any Eclipse
+    keywords at all (excluding comments) and if DATES is its first keyword.
+
+    If a cache directory is given, the keyword blocks are also stored there,
+    with the hash of the file content as key, and later parses of a file with
+    the same content, like from other realizations, are read from the cache.
+    Files with INCLUDE statements are not cached, as their parsed content also
+    depends on the included files.
 
     Args:
-        filename
+        filename: Filename which will be opened and read.
+        cachedir: Directory for cached parsed files, or None for no caching.
 
     Returns:
-        bool: False if the file is empty or has only comments.
+        The keyword blocks together with these properties.
     """
-    # Implementation is by trial and error:
+    cachefile = None if cachedir is None else _cachefile(filename, cachedir)
+    if cachefile is not None and cachefile.exists():
+        logger.info("Using cached parse of %s", filename)
+        return _parsed_sch_file(_read_cached_blocks(cachefile))
+
     try:
-        tmpschedule = TimeVector(datetime.date(1900, 1, 1))
-        tmpschedule.load(str(filename))
+        deck = Parser().parse(str(filename), ParseContext(error_actions))
     except IndexError as err:
-        if (
-            "vector::_M_range_check: __n (which is 0) >= this->size() (which is 0)"
-            in str(err)
-        ):
-            # This is what we get from opm>=2022.04 for empty files.
-            return False
-
-        if "Keyword index 0 is out of range" in str(err):
-            # This is what we get from opm<2022.04 for empty files.
-            return False
-
         # Try to workaround a non-explanatory error from opm-common:
         if "map::at" in str(err):
             logger.error("Error happened while parsing %s", filename)
@@ -285,11 +335,72 @@ def sch_file_nonempty(filename: Path) -> bool:
         logger.error(err)
         raise SystemExit from err
 
-    except ValueError:
-        # This is where we get for files not starting with DATES,
-        # but that means it is nonempty
-        return True
-    return True
+    blocks = split_deck(deck)
+    if cachefile is not None:
+        try:
+            _write_cached_blocks(cachefile, blocks)
+            logger.info("Cached parse of %s in %s", filename, cachefile)
+        except OSError as err:
+            logger.warning("Could not cache parse of %s: %s", filename, err)
+    return _parsed_sch_file(blocks)
+
+
+def _parsed_sch_file(blocks: KeywordBlocks) -> ParsedSchFile:
+    return ParsedSchFile(
+        blocks=blocks,
+        nonempty=bool(blocks[0][1]) or len(blocks) > 1,
+        starts_with_dates=not blocks[0][1] and len(blocks) > 1,
+    )
+
+
+def _cachefile(filename: Path, cachedir: Union[str, Path]) -> Optional[Path]:
+    """The file in the cache directory for the parsed content of a file,
+    or None if the file can not be cached"""
+    content = Path(filename).read_bytes()
+    if re.search(rb"^\s*INCLUDE", content, flags=re.MULTILINE):
+        return None
+    key = hashlib.sha256(
+        f"{CACHE_FORMAT} {version('opm')}\n".encode() + content
+    ).hexdigest()
+    return Path(cachedir) / f"{key}.json"
+
+
+def _read_cached_blocks(cachefile: Path) -> KeywordBlocks:
+    """Read keyword blocks from the cache, with the keywords as strings"""
+    return [
+        (None if date is None else datetime.datetime.fromisoformat(date), keywords)
+        for date, keywords in json.loads(cachefile.read_text(encoding="utf8"))
+    ]
+
+
+def _write_cached_blocks(cachefile: Path, blocks: KeywordBlocks) -> None:
+    """Write keyword blocks to the cache, via a temporary file as other
+    realizations may read the cache concurrently"""
+    cachefile.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=cachefile.parent, suffix=".tmp", delete=False, encoding="utf8"
+    ) as tmpfile:
+        json.dump(
+            [
+                (None if date is None else date.isoformat(), list(map(str, keywords)))
+                for date, keywords in blocks
+            ],
+            tmpfile,
+        )
+    os.replace(tmpfile.name, cachefile)
+
+
+def sch_file_nonempty(filename: Path) -> bool:
+    """Determine if a file (to be included) has any Eclipse
+    keywords at all (excluding comments)
+
+    Args:
+        filename
+
+    Returns:
+        bool: False if the file is empty or has only comments.
+    """
+    return parse_sch_file(filename).nonempty
 
 
 def sch_file_starts_with_dates_keyword(filename: Path) -> bool:
@@ -307,14 +418,7 @@ def sch_file_starts_with_dates_keyword(filename: Path) -> bool:
     Returns:
         bool: true if first keyword is DATES
     """
-    # Implementation is by trial and error:
-    try:
-        # Test if it has DATES
-        tmpschedule = TimeVector(datetime.date(1900, 1, 1))
-        tmpschedule.load(str(filename))
-    except ValueError:
-        return False
-    return True
+    return parse_sch_file(filename).starts_with_dates
 
 
 def substitute(insert_statement: InsertStatement) -> Path:
@@ -458,14 +562,7 @@ def file_startswith_dates(filename):
     Returns:
         True if the first statement/keyword is DATES
     """
-    tmpschedule = TimeVector(datetime.date(1900, 1, 1))
-    try:
-        # Since the date is provided in the second arg here, this will fail if the
-        # file starts with DATES
-        tmpschedule.load(filename, datetime_from_date(datetime.date(1900, 1, 1)))
-        return False
-    except ValueError:
-        return True
+    return parse_sch_file(filename).starts_with_dates
 
 
 def get_parser():
@@ -485,6 +582,8 @@ def get_parser():
             'bimonthly' stating how often a DATES keyword is wanted
             (independent of inserts/merges).  '(bi)monthly' and
             'yearly' will be rounded to first in every month.
+ cachedir - directory for caching parsed files, typically shared by all
+            realizations in an ensemble. Optional
  insert - list of components to be inserted into the final Schedule
           file. Each list element can contain the elements:
         date - Fixed date for the insertion
@@ -525,6 +624,9 @@ def get_parser():
     parser.add_argument(
         "--dategrid", type=str, help="Interval for extra DATES to be inserted."
     )
+    parser.add_argument(
+        "--cachedir", type=str, help="Directory for caching parsed files."
+    )
 
     parser.add_argument(
         "--version",
@@ -561,6 +663,8 @@ def main():
         cli_config["refdate"] = dateutil.parser.isoparse(args.refdate).date()
     if args.dategrid:
         cli_config["dategrid"] = args.dategrid
+    if args.cachedir:
+        cli_config["cachedir"] = args.cachedir
 
     merged_config = defaults_config.copy()
     merged_config.update(yaml_config)
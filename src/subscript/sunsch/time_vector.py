@@ -1,7 +1,7 @@
 # To be removed once the OPM version of this file is updated
 
+import bisect
 import datetime
-from operator import attrgetter
 
 try:
     from StringIO import StringIO
@@ -77,6 +77,35 @@ def _make_datetime(dates_record):
     )
 
 
+def split_deck(deck):
+    """Split a parsed deck into blocks of keywords at the DATES keywords.
+
+    Returns:
+        list of (date, keywords) tuples. The first block has the keywords
+        before the first DATES keyword, and None as date. The following
+        blocks have the keywords after each date in the DATES keywords.
+    """
+    blocks = [(None, [])]
+    for kw in deck:
+        if kw.name == "DATES":
+            blocks.extend((_make_datetime(kw[index]), []) for index in range(len(kw)))
+        else:
+            blocks[-1][1].append(kw)
+    return blocks
+
+
+def _keyword_name(kw):
+    """The name of a deck keyword, or of a keyword given as a string
+    like str() of a deck keyword, where the name starts the first line
+    that is not blank or a comment"""
+    if not isinstance(kw, str):
+        return kw.name
+    for line in kw.splitlines():
+        if line.strip() and not line.lstrip().startswith("--"):
+            return line.split()[0]
+    return ""
+
+
 class TimeStep(object):
     def __init__(self, dt, keywords):
         """The TimeStep class consist of a list of keywords and a corresponding date.
@@ -107,7 +136,7 @@ class TimeStep(object):
         return len(self.keywords)
 
     def __contains__(self, arg):
-        return any(arg == kw.name for kw in self.keywords)
+        return any(arg == _keyword_name(kw) for kw in self.keywords)
 
     def __str__(self):
         string = StringIO()
@@ -266,6 +295,8 @@ class TimeVector(object):
         )
         self.time_steps_dict = {}
         self.time_steps_list = []
+        # Sorted dates of time_steps_list, for bisection:
+        self._dates = []
 
         ts = TimeStep.create_first(self.start_date)
 
@@ -312,14 +343,15 @@ class TimeVector(object):
 
     def _add_dates_block(self, ts):
         self.time_steps_dict[ts.dt] = ts
-        self.time_steps_list.append(ts)
+        index = bisect.bisect_right(self._dates, ts.dt)
+        self._dates.insert(index, ts.dt)
+        self.time_steps_list.insert(index, ts)
 
     def delete(self, dt):
         del self.time_steps_dict[dt]
-        for index, ts in enumerate(self.time_steps_list):
-            if ts.dt == dt:
-                del self.time_steps_list[index]
-                break
+        index = bisect.bisect_left(self._dates, dt)
+        del self._dates[index]
+        del self.time_steps_list[index]
 
     def add_keywords(self, dt, keywords):
         if dt < self.start_date:
@@ -332,7 +364,6 @@ class TimeVector(object):
         else:
             ts = TimeStep(dt, keywords)
             self._add_dates_block(ts)
-            self.time_steps_list.sort(key=attrgetter("dt"))
 
     def _add_deck(self, deck, start_date):
         first_kw = deck[0]
@@ -403,6 +434,34 @@ class TimeVector(object):
         deck = Parser().parse_string(deck_string, parse_context)
         self._add_deck(deck, date)
 
+    def load_blocks(self, blocks, date=None):
+        """
+        Like load() - but load from blocks of keywords as from split_deck(),
+        without any parsing. The keywords can also be strings.
+        """
+        starts_with_dates = not blocks[0][1] and len(blocks) > 1
+        if (date is None) != starts_with_dates:
+            raise ValueError(
+                "When loading you must *either* specify date - or file must start"
+                " with DATES keyword"
+            )
+        if date is not None:
+            self.add_keywords(date, list(blocks[0][1]))
+        for dt, keywords in blocks[1:]:
+            self.add_keywords(dt, list(keywords))
+
+    def to_blocks(self):
+        """
+        Will return the vector as blocks of keywords like split_deck() does
+        for its string representation.
+        """
+        first = self.time_steps_list[0]
+        blocks = [(None, list(first.keywords) if first.is_start else [])]
+        blocks.extend(
+            (ts.dt, list(ts.keywords)) for ts in self.time_steps_list if not ts.is_start
+        )
+        return blocks
+
     def __str__(self):
         """Will return a string representation of the vector.
 
@@ -422,4 +481,4 @@ class TimeVector(object):
         """
         Will return a list of all the dates in the vector.
         """
-        return [x.dt for x in self.time_steps_list]
+        return list(self._dates)
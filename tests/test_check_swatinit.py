@@ -6,6 +6,7 @@ import numpy as np
 import pandas as pd
 import pytest
 from matplotlib import pyplot
+from res2df import ResdataFiles
 
 from subscript.check_swatinit.check_swatinit import (
     __FINE_EQUIL__,
@@ -16,15 +17,22 @@ from subscript.check_swatinit.check_swatinit import (
     __SWL_TRUNC__,
     __UNKNOWN__,
     __WATER__,
+    QC_FLAG_DTYPE,
     _evaluate_pc,
+    compact_qc_frame,
     compute_pc,
+    ensemble_volume_stats,
     main,
+    map_ppcwmax,
     merge_equil,
+    merge_pc_max,
+    ppcwmax_gridvector,
     qc_flag,
     qc_volumes,
     reorder_dframe_for_nonnans,
+    write_qc_frame,
 )
-from subscript.check_swatinit.plotter import wvol_waterfall
+from subscript.check_swatinit.plotter import sample_qc_frame, wvol_waterfall
 
 REEK_DATAFILE = (
     Path(__file__).absolute().parent
@@ -300,7 +308,9 @@ def test_qc_flag(propslist, expected_flag):
         qc_frame["PPCW"] = np.nan
     if "PCW" not in qc_frame:
         qc_frame["PCW"] = np.nan
-    assert qc_flag(qc_frame)[0] == expected_flag
+    qc_col = qc_flag(qc_frame)
+    assert qc_col[0] == expected_flag
+    assert qc_col.dtype == QC_FLAG_DTYPE
 
 
 @pytest.mark.parametrize(
@@ -380,6 +390,30 @@ def test_evaluate_pc(swats, scale_vert, swls, swus, expected_pc):
     ).all()
 
 
+def test_evaluate_pc_vectorized():
+    """The vectorized evaluation must match interpolation in a horizontally
+    scaled curve for each cell individually"""
+    rng = np.random.default_rng(seed=1)
+    satfunc_df = pd.DataFrame(
+        {"SW": [0.1, 0.2, 0.4, 0.7, 1], "PCOW": [5, 2, 1, 0.2, -0.5]}
+    )
+    swls = rng.uniform(0, 0.4, 1000)
+    swus = rng.uniform(0.6, 1, 1000)
+    swats = rng.uniform(0, 1, 1000)
+    scale_vert = rng.uniform(0.5, 3, 1000)
+    expected = [
+        np.interp(
+            swat,
+            swl + (satfunc_df["SW"] - 0.1) / 0.9 * (swu - swl),
+            satfunc_df["PCOW"] * scaling,
+        )
+        for swat, scaling, swl, swu in zip(swats, scale_vert, swls, swus)
+    ]
+    assert np.allclose(
+        _evaluate_pc(swats, scale_vert, swls, swus, satfunc_df), expected
+    )
+
+
 @pytest.mark.parametrize(
     "gridlist, equillist, expected",
     [
@@ -445,11 +479,57 @@ def test_evaluate_pc(swats, scale_vert, swls, swus, expected_pc):
 )
 def test_merge_equil(gridlist, equillist, expected):
     """Test that we can merge EQUIL information onto a cell-based dataframe"""
+    grid_df = pd.DataFrame(gridlist)
     pd.testing.assert_frame_equal(
-        merge_equil(pd.DataFrame(gridlist), pd.DataFrame(equillist)),
+        merge_equil(grid_df, pd.DataFrame(equillist)),
         pd.DataFrame(expected),
         check_like=True,
     )
+    # The input frame is not modified:
+    pd.testing.assert_frame_equal(grid_df, pd.DataFrame(gridlist))
+
+
+PPCWMAX_DECK = """RUNSPEC
+TABDIMS
+  2 /
+PROPS
+PPCWMAX
+  0.01 /
+  0.02 /
+"""
+
+
+def test_map_ppcwmax():
+    """PPCWMAX pr. SATNUM in the deck is mapped onto the cells"""
+    deck = ResdataFiles.str2deck(PPCWMAX_DECK)
+    satnums = pd.Series([2, 1, 2], index=[10, 11, 12])
+    ppcwmax = map_ppcwmax(satnums, deck)
+    pd.testing.assert_series_equal(
+        ppcwmax, pd.Series([0.02, 0.01, 0.02], index=[10, 11, 12], name="PPCWMAX")
+    )
+
+
+def test_ppcwmax_gridvector(mocker):
+    """PPCWMAX can still be computed directly from an Eclipse run"""
+    eclfiles = mocker.Mock()
+    eclfiles.get_deck.return_value = ResdataFiles.str2deck(PPCWMAX_DECK)
+    mocker.patch("res2df.grid.df", return_value=pd.DataFrame({"SATNUM": [2, 1, 2]}))
+    assert ppcwmax_gridvector(eclfiles).tolist() == [0.02, 0.01, 0.02]
+
+
+def test_merge_pc_max(caplog):
+    """The maximum capillary pressure pr. SATNUM is added to each cell"""
+    grid_df = pd.DataFrame({"SATNUM": [2, 1, 2]})
+    satfunc_df = pd.DataFrame(
+        {"SATNUM": [1, 1, 2, 2], "SW": [0.1, 1, 0.1, 1], "PCOW": [3, 0, 5, 0]}
+    )
+    assert merge_pc_max(grid_df, satfunc_df)["PCOW_MAX"].tolist() == [5, 3, 5]
+    assert "PCOW_MAX" not in grid_df
+
+    # Cells with unknown SATNUM are left out:
+    grid_df = pd.DataFrame({"SATNUM": [3, 1, 2]})
+    assert merge_pc_max(grid_df, satfunc_df)["PCOW_MAX"].tolist() == [3, 5]
+    assert "Skipping 1 cells with SATNUM" in caplog.text
 
 
 SATFUNC_DF = pd.DataFrame([{"SW": 0.1, "PCOW": 3}, {"SW": 1, "PCOW": 0}]).assign(
@@ -543,6 +623,96 @@ def test_eqlnum2(tmp_path, mocker):
         main()
 
 
+def test_compact_qc_frame(tmp_path):
+    """Region numbers and saturations are stored compactly, and the dtypes
+    survive a roundtrip through Parquet"""
+    qc_frame = pd.DataFrame(
+        {
+            "EQLNUM": [1, 2],
+            "SATNUM": [1, 300],
+            "SWATINIT": [0.3, 1.0],
+            "SWAT": [0.4, 1.0],
+            "PORV": [100.0, 200.0],
+            "QC_FLAG": [__SWL_TRUNC__, __WATER__],
+        }
+    )
+    compact_qc_frame(qc_frame)
+    assert qc_frame["EQLNUM"].dtype == np.int8
+    assert qc_frame["SATNUM"].dtype == np.int16
+    assert qc_frame["SWAT"].dtype == np.float32
+    assert qc_frame["PORV"].dtype == np.float64
+    assert qc_frame["QC_FLAG"].dtype == QC_FLAG_DTYPE
+
+    write_qc_frame(qc_frame, tmp_path / "qc.parquet")
+    pd.testing.assert_frame_equal(
+        pd.read_parquet(tmp_path / "qc.parquet"), qc_frame, check_like=True
+    )
+    assert np.isclose(qc_volumes(qc_frame)[__SWL_TRUNC__], 10)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ensemble(jobs, tmp_path, mocker):
+    """Test checking multiple realizations from a glob pattern"""
+    os.chdir(tmp_path)
+    for real in [0, 1, 10]:
+        realdir = Path(f"realization-{real}/iter-0")
+        realdir.mkdir(parents=True)
+        pd.DataFrame(
+            [
+                {
+                    "EQLNUM": 1,
+                    "SWATINIT": 0.5,
+                    "SWAT": 0.5 + real / 100,
+                    "PORV": 100,
+                    "VOLUME": 200,
+                    "QC_FLAG": __SWL_TRUNC__,
+                }
+            ]
+        ).to_csv(realdir / "check_swatinit.csv", index=False)
+    # A realization that can not be checked is skipped:
+    Path("realization-2/iter-0").mkdir(parents=True)
+    Path("realization-2/iter-0/check_swatinit.csv").write_text("FOO\n1", "utf8")
+
+    mocker.patch(
+        "sys.argv",
+        [
+            "check_swatinit",
+            "realization-*/iter-0/check_swatinit.csv",
+            "--jobs",
+            str(jobs),
+            "--output",
+            "volumes.csv",
+        ],
+    )
+    main()
+    volumes_df = pd.read_csv("volumes.csv")
+    assert set(volumes_df["REAL"]) == {0, 1, 10}
+    swl_trunc = volumes_df[volumes_df["KEY"] == __SWL_TRUNC__].set_index("REAL")
+    assert np.allclose(swl_trunc.loc[[0, 1, 10], "VOLUME"], [0, 1, 10])
+
+    stats = ensemble_volume_stats(volumes_df)
+    assert stats.loc[__SWL_TRUNC__, "count"] == 3
+    assert np.isclose(stats.loc[__SWL_TRUNC__, "mean"], 11 / 3)
+    assert np.isclose(stats.loc["PORV", "max"], 100)
+
+
+def test_sample_qc_frame():
+    """Sampling for plots keeps cells from every QC flag and depth band"""
+    rng = np.random.default_rng(seed=1)
+    qc_frame = pd.DataFrame(
+        {
+            "Z": rng.uniform(1000, 1100, 10000),
+            "QC_FLAG": [__PC_SCALED__] * 9990 + [__SWL_TRUNC__] * 10,
+        }
+    )
+    sampled = sample_qc_frame(qc_frame, 1000, depth_bands=10)
+    assert 900 < len(sampled) <= 1000
+    assert (sampled["QC_FLAG"] == __SWL_TRUNC__).sum() == 10
+    assert sampled.index.is_monotonic_increasing
+    assert np.histogram(sampled["Z"], bins=10)[0].min() > 80
+    pd.testing.assert_frame_equal(sample_qc_frame(qc_frame, 10000), qc_frame)
+
+
 @pytest.mark.parametrize(
     "inputrows, expected",
     [
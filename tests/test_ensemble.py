@@ -0,0 +1,30 @@
+import pytest
+
+from subscript.ensemble import map_realizations, realization_files
+
+
+def _inverse(number):
+    return 1 / number
+
+
+def test_realization_files():
+    """Realization indices are found from the realization directories"""
+    assert realization_files(
+        [
+            "realization-0/iter-0/FOO.DATA",
+            "/scratch/realization-12/pred/FOO.DATA",
+            "FOO.DATA",
+        ]
+    ) == [
+        (0, "realization-0/iter-0/FOO.DATA"),
+        (12, "/scratch/realization-12/pred/FOO.DATA"),
+    ]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_map_realizations(jobs):
+    """Failing realizations are left out of the results"""
+    assert map_realizations(_inverse, [(0, (2,)), (1, (0,)), (3, (4,))], jobs=jobs) == [
+        (0, 0.5),
+        (3, 0.25),
+    ]
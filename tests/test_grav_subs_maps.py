@@ -1,15 +1,24 @@
+import datetime
 import os
 import shutil
 import subprocess
 from pathlib import Path
 
+import numpy as np
 import pytest
+import resfo
+import xtgeo
 import yaml
 from pydantic import ValidationError
+from resdata.gravimetry import ResdataSubsidence
+from resdata.grid import Grid
+from resdata.resfile import ResdataFile
 
-from subscript.grav_subs_maps import grav_subs_maps
+from subscript.grav_subs_maps import grav_subs_maps, kernels, modelling, surveys
 from subscript.grav_subs_maps.grav_subs_maps import GravMapsConfig
 
+from .utils import write_gravity_case
+
 TESTDATA = Path(__file__).absolute().parent / "testdata_gravity"
 
 
@@ -157,6 +166,382 @@ def test_config_errors(dictupdates, expected_error):
         GravMapsConfig(**cfg)
 
 
+@pytest.fixture(name="synthetic_case")
+def fixture_synthetic_case(tmp_path):
+    """Prepare a small synthetic case with a seabed map covering the grid"""
+    write_gravity_case(
+        str(tmp_path / "SYNTH"),
+        [datetime.date(2018, 1, 1), datetime.date(2020, 7, 1)],
+        aquifer_cells=[0, 7],
+    )
+    xtgeo.RegularSurface(
+        ncol=9, nrow=7, xinc=50, yinc=50, xori=460000, yori=5930000, values=100.0
+    ).to_file(tmp_path / "seabed.gri")
+    return tmp_path
+
+
+def _synthetic_config(seabed_map):
+    return {
+        "input": {
+            "diffdates": [["2020-07-01", "2018-01-01"]],
+            "seabed_map": str(seabed_map),
+        },
+        "calculations": {
+            "poisson_ratio": 0.45,
+            "phases": ["gas", "oil", "water", "total"],
+        },
+    }
+
+
+def test_numpy_engine_matches_resdata(synthetic_case):
+    """Test that the numpy engine gives the same gravity and subsidence maps
+    as resdata"""
+    for engine in ["numpy", "resdata"]:
+        (synthetic_case / engine).mkdir()
+        grav_subs_maps.main_gravmaps(
+            str(synthetic_case / "SYNTH.UNRST"),
+            _synthetic_config(synthetic_case / "seabed.gri"),
+            None,
+            synthetic_case / engine,
+            engine=engine,
+        )
+    for phase in ["gas", "oil", "water", "total", None]:
+        if phase is None:
+            filename = "all--subsidence--20200701_20180101.gri"
+        else:
+            filename = f"all--delta_gravity_{phase}--20200701_20180101.gri"
+        numpy_map = xtgeo.surface_from_file(synthetic_case / "numpy" / filename)
+        resdata_map = xtgeo.surface_from_file(synthetic_case / "resdata" / filename)
+        assert np.abs(numpy_map.values).max() > 0
+        np.testing.assert_allclose(
+            numpy_map.values, resdata_map.values, rtol=1e-5, atol=1e-6
+        )
+
+
+@pytest.mark.parametrize("engine", ["numpy", "resdata"])
+def test_jobs(synthetic_case, engine):
+    """Test that maps modelled in worker processes are the same as serial"""
+    cfg = _synthetic_config(synthetic_case / "seabed.gri")
+    cfg["input"]["diffdates"] = [
+        ["2020-07-01", "2018-01-01"],
+        ["2020-07-01", "2020-07-01"],
+    ]
+    for jobs in [1, 3]:
+        (synthetic_case / str(jobs)).mkdir()
+        grav_subs_maps.main_gravmaps(
+            str(synthetic_case / "SYNTH.UNRST"),
+            cfg,
+            None,
+            synthetic_case / str(jobs),
+            engine=engine,
+            jobs=jobs,
+        )
+    filenames = sorted(path.name for path in (synthetic_case / "1").glob("*.gri"))
+    assert len(filenames) == 10
+    for filename in filenames:
+        np.testing.assert_array_equal(
+            xtgeo.surface_from_file(synthetic_case / "3" / filename).values,
+            xtgeo.surface_from_file(synthetic_case / "1" / filename).values,
+        )
+
+
+def test_read_surveys(synthetic_case):
+    """Test reading only the surveys needed from a restart file"""
+    unrst_file = synthetic_case / "SYNTH.UNRST"
+    read = surveys.read_surveys(unrst_file, ["20200701"])
+    assert list(read) == ["20200701"]
+    restart = ResdataFile(str(unrst_file))
+    for keyword, array in read["20200701"].items():
+        assert array.dtype == np.float32
+        np.testing.assert_array_equal(
+            array, restart.restart_view(report_step=1)[keyword][0].numpy_copy()
+        )
+    assert "PRESSURE" not in read["20200701"]
+
+    with pytest.raises(ValueError, match="Dates 20190101 not found"):
+        surveys.read_surveys(unrst_file, ["20200701", "20190101"])
+
+
+def test_survey_cache(synthetic_case, mocker):
+    """Test that surveys are reused from a sidecar file when possible"""
+    unrst_file = synthetic_case / "SYNTH.UNRST"
+    sidecar = synthetic_case / "surveys.npz"
+    spy = mocker.spy(surveys, "read_surveys")
+
+    read = surveys.load_surveys(unrst_file, ["20180101"], sidecar)
+    assert sidecar.is_file()
+    assert spy.call_count == 1
+    cached = surveys.load_surveys(unrst_file, ["20180101"], sidecar)
+    assert spy.call_count == 1
+    for keyword, array in read["20180101"].items():
+        np.testing.assert_array_equal(cached["20180101"][keyword], array)
+
+    # A new date is read from the restart file and added to the cache:
+    surveys.load_surveys(unrst_file, ["20180101", "20200701"], sidecar)
+    assert spy.call_args[0][1] == {"20200701"}
+    surveys.load_surveys(unrst_file, ["20200701"], sidecar)
+    assert spy.call_count == 2
+
+    # The cache is not used when the restart file has changed:
+    os.utime(unrst_file, ns=(0, 0))
+    surveys.load_surveys(unrst_file, ["20200701"], sidecar)
+    assert spy.call_count == 3
+
+
+def test_main_survey_cache(synthetic_case):
+    """Test that maps are the same when modelled from cached surveys"""
+    cfg = _synthetic_config(synthetic_case / "seabed.gri")
+    for rerun in ["first", "second"]:
+        (synthetic_case / rerun).mkdir()
+        grav_subs_maps.main_gravmaps(
+            str(synthetic_case / "SYNTH.UNRST"),
+            cfg,
+            None,
+            synthetic_case / rerun,
+            survey_cache=synthetic_case / "SYNTH.npz",
+        )
+    filename = "all--delta_gravity_total--20200701_20180101.gri"
+    np.testing.assert_array_equal(
+        xtgeo.surface_from_file(synthetic_case / "first" / filename).values,
+        xtgeo.surface_from_file(synthetic_case / "second" / filename).values,
+    )
+
+
+def test_main_missing_rporv(synthetic_case, mocker, caplog):
+    """A restart file without RPORV gives an error message, not a traceback"""
+    os.chdir(synthetic_case)
+    resfo.write(
+        "SYNTH.UNRST",
+        [
+            (keyword, array)
+            for keyword, array in resfo.read("SYNTH.UNRST")
+            if keyword != "RPORV   "
+        ],
+    )
+    Path("config.yml").write_text(
+        yaml.dump(_synthetic_config("seabed.gri")), encoding="utf8"
+    )
+    mocker.patch(
+        "sys.argv", ["grav_subs_maps", "SYNTH.UNRST", "--configfile", "config.yml"]
+    )
+    with pytest.raises(SystemExit) as excinfo:
+        grav_subs_maps.main()
+    assert excinfo.value.code == 1
+    assert "RPORV not found in survey at 20180101" in caplog.text
+
+    # Gravity alone does not need RPORV:
+    grid = Grid("SYNTH.EGRID")
+    init = ResdataFile("SYNTH.INIT")
+    (_, masses), (_, pore_volumes) = modelling.load_gravity_surveys(
+        "numpy",
+        "SYNTH.UNRST",
+        grid,
+        init,
+        [["20200701", "20180101"]],
+        with_subsidence=False,
+    )
+    assert set(masses) == {"20200701", "20180101"}
+    assert pore_volumes == {}
+
+
+def test_cached_kernel_matrix(tmp_path, layered_model, monkeypatch):
+    """Test caching kernel matrices, and sums from cached matrices"""
+    cells, _, mass_changes, nodes = layered_model
+    points = nodes[::50]
+    matrix = kernels.cached_kernel_matrix(
+        tmp_path, "gravity", kernels.gravity_kernel, cells, points, blocksize=10000
+    )
+    assert isinstance(matrix, np.memmap)
+    assert matrix.dtype == np.float32
+    np.testing.assert_allclose(
+        matrix, kernels.gravity_kernel(cells, points), rtol=1e-6, atol=0
+    )
+    np.testing.assert_allclose(
+        kernels.eval_gravity(cells, mass_changes, points, matrix=matrix),
+        kernels.eval_gravity(cells, mass_changes, points),
+        rtol=1e-5,
+    )
+
+    # Other points or another key give another matrix:
+    kernels.cached_kernel_matrix(
+        tmp_path, "gravity", kernels.gravity_kernel, cells, points[1:]
+    )
+    kernels.cached_kernel_matrix(
+        tmp_path, "gravity", kernels.gravity_kernel, cells, points, key="other"
+    )
+    assert len(list(tmp_path.glob("gravity-*.npy"))) == 3
+
+    monkeypatch.setattr(kernels, "GEOMETRY_CACHE_LIMIT", len(cells))
+    assert (
+        kernels.cached_kernel_matrix(
+            tmp_path, "gravity", kernels.gravity_kernel, cells, points
+        )
+        is None
+    )
+
+
+def test_missing_survey_keywords(caplog):
+    """Missing phases are warned about, and missing RPORV is an error"""
+    survey = {
+        "RFIPOIL": np.array([2.0], dtype=np.float32),
+        "OIL_DEN": np.array([800.0], dtype=np.float32),
+        "RFIPWAT": np.array([3.0], dtype=np.float32),
+    }
+    masses = kernels.phase_masses(survey, "20200701")
+    assert masses == {"oil": pytest.approx(np.array([1600.0]))}
+    assert "No gas mass in survey at 20200701, RFIPGAS and GAS_DEN" in caplog.text
+    assert "No water mass in survey at 20200701, WAT_DEN not found" in caplog.text
+
+    with pytest.raises(ValueError, match="RPORV not found in survey at 20200701"):
+        kernels.pore_volumes(survey, "20200701")
+
+
+@pytest.mark.parametrize("blocksize", [1, 5, 24, 1000])
+def test_blocked_sum(blocksize):
+    """Test that evaluating in blocks gives the same sums as the full matrix"""
+    rng = np.random.default_rng(1)
+    cells = rng.uniform([0, 0, 1000], [500, 500, 1100], (23, 3))
+    points = rng.uniform([0, 0, 0], [500, 500, 100], (11, 3))
+    weights = rng.normal(size=(23, 2))
+    expected = kernels.gravity_kernel(cells, points) @ weights
+    np.testing.assert_allclose(
+        kernels.blocked_sum(kernels.gravity_kernel, cells, weights, points, blocksize),
+        expected,
+    )
+    np.testing.assert_allclose(
+        kernels.blocked_sum(
+            kernels.gravity_kernel, cells, weights[:, 0], points, blocksize
+        ),
+        expected[:, 0],
+    )
+
+
+@pytest.mark.parametrize("poisson_ratio", [0, 0.25, 0.45])
+def test_eval_subsidence(tmp_path, poisson_ratio):
+    """Test subsidence against resdata, also below the seabed"""
+    write_gravity_case(
+        str(tmp_path / "SYNTH"), [datetime.date(2018, 1, 1), datetime.date(2020, 7, 1)]
+    )
+    grid = Grid(str(tmp_path / "SYNTH.EGRID"))
+    init = ResdataFile(str(tmp_path / "SYNTH.INIT"))
+    restart = ResdataFile(str(tmp_path / "SYNTH.UNRST"))
+    subsidence = ResdataSubsidence(grid, init)
+    subsidence.add_survey_PRESSURE("base", restart.restart_view(report_step=0))
+    subsidence.add_survey_PRESSURE("monitor", restart.restart_view(report_step=1))
+    read = surveys.read_surveys(tmp_path / "SYNTH.UNRST", ["20180101", "20200701"])
+    pore_volume_change = kernels.pore_volumes(read["20200701"]) - kernels.pore_volumes(
+        read["20180101"]
+    )
+
+    points = np.array(
+        [
+            [460100, 5930100, 80, 80],
+            [460300, 5930200, 120, 100],
+            [459000, 5929000, 100, 100],
+        ]
+    )
+    np.testing.assert_allclose(
+        kernels.eval_subsidence(
+            kernels.cell_centres(grid), pore_volume_change, points, poisson_ratio
+        ),
+        [
+            subsidence.eval_geertsma_rporv(
+                "base", "monitor", tuple(point[:3]), 1, poisson_ratio, point[3]
+            )
+            for point in points
+        ],
+        rtol=1e-6,
+    )
+
+
+@pytest.fixture(name="layered_model")
+def fixture_layered_model():
+    """Cell centres, coarse blocks, mass changes and seabed nodes for a
+    regular model with a localized mass change on top of noise"""
+    ijk = np.indices((40, 30, 10)).reshape(3, -1).T
+    cells = np.column_stack(
+        [100.0 * ijk[:, 0], 100.0 * ijk[:, 1], 1500 + 10.0 * ijk[:, 2]]
+    )
+    rng = np.random.default_rng(0)
+    mass_changes = rng.normal(0, 1e5, (len(cells), 2)) + 1e6 * np.exp(
+        -((cells[:, 0] - 2000) ** 2 + (cells[:, 1] - 1500) ** 2) / 5e5
+    ).reshape(-1, 1)
+    _, block_ids = np.unique(ijk // [4, 4, 5], axis=0, return_inverse=True)
+    node_x, node_y = np.meshgrid(np.arange(-500, 4500, 125), np.arange(-500, 3500, 125))
+    nodes = np.column_stack(
+        [node_x.ravel(), node_y.ravel(), np.full(node_x.size, 100.0)]
+    )
+    return cells, block_ids.ravel(), mass_changes, nodes
+
+
+@pytest.mark.parametrize(
+    "distance_ratio, max_relative_error",
+    [(2, 2e-2), (5, 2e-2), (10, 5e-3), (20, 1e-5), (1e6, 0)],
+)
+def test_far_field_accuracy(layered_model, distance_ratio, max_relative_error):
+    """Benchmark the far field approximation against the exact sum"""
+    cells, block_ids, mass_changes, nodes = layered_model
+    exact = kernels.eval_gravity(cells, mass_changes, nodes)
+    approximate = kernels.eval_gravity(
+        cells,
+        mass_changes,
+        nodes,
+        block_ids=block_ids,
+        distance_ratio=distance_ratio,
+    )
+    assert approximate.shape == exact.shape
+    np.testing.assert_allclose(
+        approximate, exact, rtol=1e-10, atol=max_relative_error * np.abs(exact).max()
+    )
+
+    subsidence_nodes = np.column_stack([nodes, nodes[:, 2]])[::10]
+    subsidence_exact = kernels.eval_subsidence(
+        cells, mass_changes, subsidence_nodes, 0.3
+    )
+    subsidence_approximate = kernels.eval_subsidence(
+        cells,
+        mass_changes,
+        subsidence_nodes,
+        0.3,
+        block_ids=block_ids,
+        distance_ratio=distance_ratio,
+    )
+    np.testing.assert_allclose(
+        subsidence_approximate,
+        subsidence_exact,
+        rtol=1e-10,
+        atol=max_relative_error * np.abs(subsidence_exact).max(),
+    )
+
+
+def test_far_field_config(synthetic_case):
+    """Test far field approximation configured for grav_subs_maps"""
+    cfg = _synthetic_config(synthetic_case / "seabed.gri")
+    cfg["calculations"]["far_field"] = {"block_size": [0, 1, 1]}
+    with pytest.raises(ValidationError, match="greater than or equal to 1"):
+        GravMapsConfig(**cfg)
+
+    cfg["calculations"]["far_field"] = {"block_size": [2, 2, 1]}
+    assert GravMapsConfig(**cfg).calculations.far_field.distance_ratio == 5
+    for far_field in [None, {"block_size": [2, 2, 1], "distance_ratio": 2}]:
+        cfg["calculations"]["far_field"] = far_field
+        outputdir = synthetic_case / str(far_field is None)
+        outputdir.mkdir()
+        grav_subs_maps.main_gravmaps(
+            str(synthetic_case / "SYNTH.UNRST"), cfg, None, outputdir
+        )
+    for filename in [
+        "all--delta_gravity_total--20200701_20180101.gri",
+        "all--subsidence--20200701_20180101.gri",
+    ]:
+        exact = xtgeo.surface_from_file(synthetic_case / "True" / filename)
+        approximate = xtgeo.surface_from_file(synthetic_case / "False" / filename)
+        np.testing.assert_allclose(
+            approximate.values, exact.values, atol=0.2 * np.abs(exact.values).max()
+        )
+        assert not np.allclose(approximate.values, exact.values, rtol=1e-10)
+
+
 @pytest.mark.integration
 def test_integration():
     """Test that endpoint is installed"""
@@ -1,15 +1,21 @@
+import datetime
 import os
 import shutil
 import subprocess
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
 import pytest
 import yaml
 from pydantic import ValidationError
 
+from subscript.grav_subs_maps import kernels
 from subscript.grav_subs_points import grav_subs_points
 from subscript.grav_subs_points.grav_subs_points import GravPointsConfig
 
+from .utils import write_gravity_case
+
 TESTDATA = Path(__file__).absolute().parent / "testdata_gravity"
 
 
@@ -198,6 +204,154 @@ def test_unrst_error(dictupdates, expected_error):
         assert expected_error in str(system_error.value.code)
 
 
+@pytest.fixture(name="synthetic_case")
+def fixture_synthetic_case(tmp_path):
+    """Prepare a small synthetic case with stations, returning a configuration"""
+    write_gravity_case(
+        str(tmp_path / "SYNTH"),
+        [datetime.date(2018, 1, 1), datetime.date(2020, 7, 1)],
+        aquifer_cells=[3],
+    )
+    pd.DataFrame(
+        {
+            "bm_id": [1, 2, 3],
+            "utmx": [460050.0, 460210.5, 461000.0],
+            "utmy": [5930050.0, 5930180.2, 5931000.0],
+            "depth": [100.0, 120.0, 90.0],
+        }
+    ).to_csv(tmp_path / "stations.csv", sep=";", index=False)
+    return {
+        "input": {"diffdates": [["2020-07-01", "2018-01-01"]]},
+        "stations": {
+            "grav": {"2020_2018": str(tmp_path / "stations.csv")},
+            "subs": {"2020_2018": str(tmp_path / "stations.csv")},
+        },
+        "calculations": {
+            "poisson_ratio": 0.45,
+            "phases": ["gas", "oil", "water", "total"],
+        },
+    }
+
+
+def test_numpy_engine_matches_resdata(tmp_path, synthetic_case):
+    """Test that the numpy engine gives the same gravity and subsidence at
+    stations as resdata"""
+    cfg = synthetic_case
+    for engine in ["numpy", "resdata"]:
+        (tmp_path / engine).mkdir()
+        grav_subs_points.main_gravpoints(
+            str(tmp_path / "SYNTH.UNRST"), cfg, None, tmp_path / engine, engine=engine
+        )
+    filenames = [
+        f"all--delta_gravity_{phase}--20200701_20180101.txt"
+        for phase in ["gas", "oil", "water", "total"]
+    ] + ["all--subsidence--20200701_20180101.txt"]
+    for filename in filenames:
+        numpy_points = np.loadtxt(tmp_path / "numpy" / filename)
+        resdata_points = np.loadtxt(tmp_path / "resdata" / filename)
+        assert np.abs(numpy_points[:, 2]).max() > 0
+        np.testing.assert_allclose(numpy_points, resdata_points, atol=2e-3)
+
+
+def test_export_points_xyz(tmp_path):
+    """Test the format of exported xyz points"""
+    stations = pd.DataFrame(
+        {
+            "utmx": [462632.692871, 464438.0639],
+            "utmy": [5930050.419434, 5932652.27771],
+            "dgsim_oil_20200701_20180101": [-12.34567, 0.0004],
+            "subsidence_20200701_20180101": [3.0, np.nan],
+        }
+    )
+    grav_subs_points.export_grav_points_xyz(
+        stations, "oil", ["20200701", "20180101"], tmp_path
+    )
+    grav_subs_points.export_subs_points_xyz(
+        stations, ["20200701", "20180101"], tmp_path
+    )
+    assert (tmp_path / "all--delta_gravity_oil--20200701_20180101.txt").read_text() == (
+        "462632.693 5930050.419 -12.346 \n464438.064 5932652.278 0.000 \n"
+    )
+    assert (tmp_path / "all--subsidence--20200701_20180101.txt").read_text() == (
+        "462632.693 5930050.419 3.000\n464438.064 5932652.278 nan\n"
+    )
+
+
+def test_columnar(tmp_path, synthetic_case):
+    """Test exporting all phases and difference dates to one file"""
+    cfg = synthetic_case
+    cfg["input"]["diffdates"].append(["2020-07-01", "2020-07-01"])
+    cfg["stations"]["grav"]["2020_2020"] = cfg["stations"]["grav"]["2020_2018"]
+    cfg["stations"]["subs"]["2020_2020"] = cfg["stations"]["subs"]["2020_2018"]
+    for columnar in [False, True]:
+        (tmp_path / str(columnar)).mkdir()
+        grav_subs_points.main_gravpoints(
+            str(tmp_path / "SYNTH.UNRST"),
+            cfg,
+            None,
+            tmp_path / str(columnar),
+            columnar=columnar,
+        )
+    assert not list((tmp_path / "True").glob("all--*.txt"))
+    assert (tmp_path / "True" / "gravity_20200701_20180101_1.txt").is_file()
+
+    columns = pd.read_csv(tmp_path / "True" / "all--delta_gravity_subsidence.csv")
+    assert list(columns.columns) == [
+        "DIFFDATE",
+        "bm_id",
+        "utmx",
+        "utmy",
+        "depth",
+        "delta_gravity_gas",
+        "delta_gravity_oil",
+        "delta_gravity_water",
+        "delta_gravity_total",
+        "subsidence",
+    ]
+    assert len(columns) == 6
+    diff_columns = columns[columns["DIFFDATE"] == "20200701_20180101"]
+    for phase in cfg["calculations"]["phases"]:
+        xyz = np.loadtxt(
+            tmp_path / "False" / f"all--delta_gravity_{phase}--20200701_20180101.txt"
+        )
+        np.testing.assert_array_equal(diff_columns[f"delta_gravity_{phase}"], xyz[:, 2])
+    xyz = np.loadtxt(tmp_path / "False" / "all--subsidence--20200701_20180101.txt")
+    np.testing.assert_array_equal(diff_columns["subsidence"], xyz[:, 2])
+
+
+def test_geometry_cache(tmp_path, synthetic_case, mocker):
+    """Test that realizations with the same grid reuse the cached geometry"""
+    cfg = synthetic_case
+    (tmp_path / "exact").mkdir()
+    grav_subs_points.main_gravpoints(
+        str(tmp_path / "SYNTH.UNRST"), cfg, None, tmp_path / "exact"
+    )
+    spy = mocker.spy(kernels, "gravity_kernel")
+    for realization in range(2):
+        (tmp_path / str(realization)).mkdir()
+        grav_subs_points.main_gravpoints(
+            str(tmp_path / "SYNTH.UNRST"),
+            cfg,
+            None,
+            tmp_path / str(realization),
+            geometry_cache=tmp_path / "geometry",
+        )
+        # The kernel is only evaluated for the first realization:
+        assert spy.call_count == 1
+    assert len(list((tmp_path / "geometry").glob("*.npy"))) == 2
+    assert not list((tmp_path / "geometry").glob("*.tmp"))
+
+    for filename in [
+        "all--delta_gravity_total--20200701_20180101.txt",
+        "all--subsidence--20200701_20180101.txt",
+    ]:
+        exact = np.loadtxt(tmp_path / "exact" / filename)
+        for realization in range(2):
+            np.testing.assert_allclose(
+                np.loadtxt(tmp_path / str(realization) / filename), exact, atol=2e-3
+            )
+
+
 @pytest.mark.integration
 def test_integration():
     """Test that endpoint is installed"""
@@ -2,6 +2,7 @@ import os
 import subprocess
 from pathlib import Path
 
+import numpy as np
 import pytest
 import resfo
 
@@ -88,3 +89,145 @@ def test_check_report_numbers(tmp_path, mocker):
         + f"actual restart report_numbers: {report_numbers}"
     )
     assert report_numbers == expected_report_numbers
+
+
+def _write_unrst(filename, seqnums):
+    """Write a minimal UNRST file with one report step for each SEQNUM, and
+    solver and report step numbers derived from it in INTEHEAD"""
+    keywords = []
+    for seqnum in seqnums:
+        intehead = np.zeros(411, dtype=np.int32)
+        intehead[67] = 10 * seqnum
+        intehead[68] = seqnum
+        keywords += [
+            ("SEQNUM  ", np.array([seqnum], dtype=np.int32)),
+            ("INTEHEAD", intehead),
+            ("LOGIHEAD", np.zeros(121, dtype=bool)),
+            ("STARTSOL", resfo.MESS),
+            ("PRESSURE", np.arange(100, dtype=np.float32) + seqnum),
+            ("ENDSOL  ", resfo.MESS),
+        ]
+    resfo.write(filename, keywords)
+
+
+def test_merge_unrst_files_synthetic(tmp_path):
+    """The streamed merge must be identical to merging in memory"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED.UNRST", [6, 8])
+    merge_unrst_files.merge_unrst_files(["HIST.UNRST", "PRED.UNRST"], "MERGED.UNRST")
+
+    hist = resfo.read("HIST.UNRST")
+    pred = resfo.read("PRED.UNRST")
+    for keyword, array in pred:
+        if keyword == "SEQNUM  ":
+            array[0] += 5
+        if keyword == "INTEHEAD":
+            array[67] += 50
+            array[68] += 5
+    resfo.write("EXPECTED.UNRST", hist + pred)
+    assert Path("MERGED.UNRST").read_bytes() == Path("EXPECTED.UNRST").read_bytes()
+
+    assert get_restart_report_numbers(resfo.read("MERGED.UNRST")) == [0, 3, 5, 11, 13]
+
+
+def test_merge_unrst_files_report_number_warning(tmp_path, caplog):
+    """Warn when the pred file does not continue the hist file"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED.UNRST", [4])
+    merge_unrst_files.merge_unrst_files(["HIST.UNRST", "PRED.UNRST"], "MERGED.UNRST")
+    assert "PRED.UNRST file has a restart report number (4)" in caplog.text
+    assert get_restart_report_numbers(resfo.read("MERGED.UNRST")) == [0, 3, 5, 9]
+
+
+def test_merge_unrst_files_output_is_input(tmp_path, mocker):
+    """The output file can be one of the input files"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED.UNRST", [6, 8])
+    merge_unrst_files.merge_unrst_files(["HIST.UNRST", "PRED.UNRST"], "EXPECTED.UNRST")
+
+    mocker.patch(
+        "sys.argv",
+        ["merge_unrst_files", "HIST.UNRST", "PRED.UNRST", "-o", "PRED.UNRST"],
+    )
+    merge_unrst_files.main()
+    assert Path("PRED.UNRST").read_bytes() == Path("EXPECTED.UNRST").read_bytes()
+    assert not list(tmp_path.glob("*.tmp"))
+    assert Path("PRED.UNRST").stat().st_mode == Path("HIST.UNRST").stat().st_mode
+
+
+def test_merge_three_unrst_files_no_warning(tmp_path, caplog):
+    """Report numbers are checked against the file merged just before,
+    not against the accumulated offsets"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED1.UNRST", [6, 8])
+    _write_unrst("PRED2.UNRST", [9, 10, 12])
+    merge_unrst_files.merge_unrst_files(
+        ["HIST.UNRST", "PRED1.UNRST", "PRED2.UNRST"], "MERGED.UNRST"
+    )
+    assert "restart report number" not in caplog.text
+
+
+def test_merge_unrst_files_warning_once_per_file(tmp_path, caplog):
+    """Only one warning is given for a file with several small report numbers"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED1.UNRST", [6, 8])
+    _write_unrst("PRED2.UNRST", [7, 8, 9])
+    merge_unrst_files.merge_unrst_files(
+        ["HIST.UNRST", "PRED1.UNRST", "PRED2.UNRST"], "MERGED.UNRST"
+    )
+    assert caplog.text.count("restart report number") == 1
+    assert (
+        "PRED2.UNRST file has a restart report number (7) which is smaller than "
+        "largest report number in PRED1.UNRST (8)"
+    ) in caplog.text
+
+
+def test_merge_many_unrst_files(tmp_path, mocker):
+    """Merging many files at once must be equivalent to merging pairwise"""
+    os.chdir(tmp_path)
+    _write_unrst("HIST.UNRST", [0, 3, 5])
+    _write_unrst("PRED1.UNRST", [6, 8])
+    _write_unrst("PRED2.UNRST", [9, 10, 12])
+    _write_unrst("PRED3.UNRST", [13])
+
+    mocker.patch(
+        "sys.argv",
+        [
+            "merge_unrst_files",
+            "HIST.UNRST",
+            "PRED1.UNRST",
+            "PRED2.UNRST",
+            "PRED3.UNRST",
+            "-o",
+            "MERGED.UNRST",
+        ],
+    )
+    merge_unrst_files.main()
+
+    merge_unrst_files.merge_unrst_files(["HIST.UNRST", "PRED1.UNRST"], "M1.UNRST")
+    merge_unrst_files.merge_unrst_files(["M1.UNRST", "PRED2.UNRST"], "M2.UNRST")
+    merge_unrst_files.merge_unrst_files(["M2.UNRST", "PRED3.UNRST"], "M3.UNRST")
+    assert Path("MERGED.UNRST").read_bytes() == Path("M3.UNRST").read_bytes()
+
+    assert get_restart_report_numbers(resfo.read("MERGED.UNRST")) == [
+        0,
+        3,
+        5,
+        11,
+        13,
+        22,
+        23,
+        25,
+        38,
+    ]
+    report_steps = [
+        array[68]
+        for keyword, array in resfo.read("MERGED.UNRST")
+        if keyword == "INTEHEAD"
+    ]
+    assert report_steps == [0, 3, 5, 11, 13, 22, 23, 25, 38]
@@ -12,7 +12,7 @@ import pytest
 import yaml
 from fmu.tools.fipmapper.fipmapper import FipMapper
 
-from subscript.prtvol2csv import prtvol2csv
+from subscript.prtvol2csv import prtindex, prtvol2csv
 
 from .utils import run_simulator
 
@@ -88,6 +88,259 @@ def test_currently_in_place_from_prt(tmp_path):
     )
 
 
+def _prt_date_line(report_step: int, date: str) -> str:
+    """Make a PRT report step line like Eclipse writes them, date is
+    on the form 1 JAN 2000"""
+    return f"  REPORT {report_step:3d}     {date}   *  RUN\n"
+
+
+def _prt_region_report(fipname: str, region: int, stoiip: float) -> str:
+    """Make a minimal PRT region report block for one region"""
+    return f"""
+                                                =================================
+                                                : {fipname}  REPORT REGION    {region}    :
+                           :--------------- OIL    SM3  ---------------:-- WAT    SM3  -:--------------- GAS    SM3  ---------------:
+                           :     LIQUID         VAPOUR         TOTAL   :       TOTAL    :       FREE      DISSOLVED         TOTAL   :
+ :-------------------------:-------------------------------------------:----------------:-------------------------------------------:
+ :CURRENTLY IN PLACE       :     {stoiip:8.0f}.                    {stoiip:8.0f}.:      59957809. :            0.   1960884420.    1960884420.:
+ :-------------------------:-------------------------------------------:----------------:-------------------------------------------:
+ :ORIGINALLY IN PLACE      :     10656981.                    10656981.:      59957809. :            0.   1960884420.    1960884420.:
+ ====================================================================================================================================
+"""  # noqa
+
+
+RESVOL_TABLE = """
+                                                      ===================================
+                                                      :  RESERVOIR VOLUMES      RM3     :
+  :---------:---------------:---------------:---------------:---------------:---------------:
+  : REGION  :  TOTAL PORE   :  PORE VOLUME  :  PORE VOLUME  : PORE VOLUME   :  PORE VOLUME  :
+  :---------:---------------:---------------:---------------:---------------:---------------:
+  :   FIELD :             3.:             4.:             5.:             6.:             7.:
+  :       1 :             8.:             9.:            10.:            11.:            12.:
+  ===========================================================================================
+"""  # noqa
+
+
+def test_scan_prt(tmp_path):
+    """Test the single-pass scanner for multiple dates and region sets"""
+    os.chdir(tmp_path)
+    Path("FOO.PRT").write_text(
+        _prt_date_line(0, "1 JAN 2000")
+        + _prt_region_report("FIPNUM", 1, 1000)
+        + _prt_region_report("FIPNUM", 2, 2000)
+        + _prt_region_report("FIPZON", 1, 3000)
+        + RESVOL_TABLE
+        + _prt_date_line(1, "1 FEB 2000")
+        + _prt_region_report("FIPNUM", 1, 1100)
+        + _prt_region_report("FIPNUM", 2, 2100)
+        + _prt_region_report("FIPZON", 1, 3100)
+        + _prt_date_line(2, "1 MAR 2000")
+        + _prt_region_report("FIPNUM", 1, 1200)
+        + _prt_region_report("FIPNUM", 2, 2200)
+        + _prt_region_report("FIPZON", 1, 3200),
+        encoding="utf8",
+    )
+
+    inplace_dfs, resvol_df = prtvol2csv.scan_prt("FOO.PRT", ["FIPNUM", "FIPZON"])
+    assert list(inplace_dfs["FIPNUM"]["STOIIP_OIL"]) == [1000, 2000]
+    assert list(inplace_dfs["FIPNUM"].index) == [1, 2]
+    assert inplace_dfs["FIPNUM"].index.name == "FIPNUM"
+    assert list(inplace_dfs["FIPZON"]["STOIIP_OIL"]) == [3000]
+    assert list(resvol_df["PORV_TOTAL"]) == [8]
+
+    inplace_dfs, resvol_df = prtvol2csv.scan_prt("FOO.PRT", "FIPNUM", date="last")
+    assert list(inplace_dfs["FIPNUM"]["STOIIP_OIL"]) == [1200, 2200]
+    assert list(resvol_df["PORV_TOTAL"]) == [8]
+
+    inplace_dfs, _ = prtvol2csv.scan_prt("FOO.PRT", "FIPZON", date="2000-02-01")
+    assert list(inplace_dfs["FIPZON"]["STOIIP_OIL"]) == [3100]
+
+    assert prtvol2csv.scan_prt("FOO.PRT", "FIPNUM", date="2001-01-01")[0][
+        "FIPNUM"
+    ].empty
+
+    # The convenience function gives the same:
+    pd.testing.assert_frame_equal(
+        prtvol2csv.currently_in_place_from_prt("FOO.PRT", "FIPNUM", date="last"),
+        prtvol2csv.scan_prt("FOO.PRT", "FIPNUM", date="last")[0]["FIPNUM"],
+    )
+
+    with pytest.raises(ValueError, match="must start with FIP"):
+        prtvol2csv.scan_prt("FOO.PRT", "NUMFIP")
+
+
+def test_scan_prt_stops_early(tmp_path):
+    """The scanner should not read region reports beyond the requested date,
+    but still find a RESERVOIR VOLUMES table printed later"""
+    os.chdir(tmp_path)
+    Path("FOO.PRT").write_text(
+        _prt_date_line(0, "1 JAN 2000")
+        + _prt_region_report("FIPNUM", 1, 1000)
+        + _prt_date_line(1, "1 FEB 2000")
+        + _prt_region_report("FIPNUM", 1, 1100)
+        + RESVOL_TABLE,
+        encoding="utf8",
+    )
+    inplace_dfs, resvol_df = prtvol2csv.scan_prt("FOO.PRT", "FIPNUM")
+    assert list(inplace_dfs["FIPNUM"]["STOIIP_OIL"]) == [1000]
+    pd.testing.assert_frame_equal(
+        resvol_df, prtvol2csv.reservoir_volumes_from_prt("FOO.PRT")
+    )
+
+    _, resvol_df = prtvol2csv.scan_prt("FOO.PRT", "FIPNUM", date="last")
+    assert not resvol_df.empty
+
+
+def test_prtindex(tmp_path):
+    """Test that the byte offset index gives the same results as streaming"""
+    os.chdir(tmp_path)
+    Path("FOO.PRT").write_text(
+        _prt_date_line(0, "1 JAN 2000")
+        + _prt_region_report("FIPNUM", 1, 1000)
+        + _prt_region_report("FIPZON", 1, 3000)
+        + RESVOL_TABLE
+        + _prt_date_line(1, "1 FEB 2000")
+        + _prt_region_report("FIPNUM", 1, 1100)
+        + _prt_region_report("FIPZON", 1, 3100),
+        encoding="utf8",
+    )
+    prt_index = prtindex.build_prt_index("FOO.PRT")
+    assert [date for date, _ in prt_index["dates"]] == ["2000-01-01", "2000-02-01"]
+    assert len(prt_index["region_reports"]) == 4
+    assert len(prt_index["reservoir_volumes"]) == 1
+    assert prtindex.region_report_dates(prt_index, "FIPZON") == [
+        "2000-01-01",
+        "2000-02-01",
+    ]
+    offset = prt_index["dates"][1][1]
+    assert Path("FOO.PRT").read_bytes()[offset:].startswith(b"  REPORT   1")
+
+    for date in ["first", "last", "2000-02-01", "2001-01-01"]:
+        streamed = prtvol2csv.scan_prt("FOO.PRT", ["FIPNUM", "FIPZON"], date=date)
+        indexed = prtvol2csv.scan_prt(
+            "FOO.PRT", ["FIPNUM", "FIPZON"], date=date, use_index=True
+        )
+        for fipname in ["FIPNUM", "FIPZON"]:
+            pd.testing.assert_frame_equal(streamed[0][fipname], indexed[0][fipname])
+        pd.testing.assert_frame_equal(streamed[1], indexed[1])
+
+    assert prtindex.index_filename("FOO.PRT").is_file()
+    assert prtindex.get_prt_index("FOO.PRT") == prt_index
+
+    # A changed PRT file invalidates the sidecar file:
+    with open("FOO.PRT", "a", encoding="utf8") as f_handle:
+        f_handle.write(
+            _prt_date_line(2, "1 MAR 2000") + _prt_region_report("FIPNUM", 1, 1200)
+        )
+    assert prtindex.get_prt_index("FOO.PRT") != prt_index
+    assert list(
+        prtvol2csv.scan_prt("FOO.PRT", "FIPNUM", date="last", use_index=True)[0][
+            "FIPNUM"
+        ]["STOIIP_OIL"]
+    ) == [1200]
+
+
+def test_prtindex_reek(tmp_path, mocker):
+    """Test the command line option for using a PRT index"""
+    os.chdir(tmp_path)
+    shutil.copy(TESTDATADIR / "2_R001_REEK-0.PRT", "REEK.PRT")
+    mocker.patch("sys.argv", ["prtvol2csv", "REEK.PRT", "--dir", ".", "--prtindex"])
+    prtvol2csv.main()
+    assert Path("REEK.PRT" + prtindex.INDEX_SUFFIX).is_file()
+    indexed = pd.read_csv("simulator_volume_fipnum.csv")
+
+    mocker.patch("sys.argv", ["prtvol2csv", "REEK.PRT", "--dir", "."])
+    prtvol2csv.main()
+    pd.testing.assert_frame_equal(indexed, pd.read_csv("simulator_volume_fipnum.csv"))
+
+
+def test_multiple_fipnames(tmp_path, mocker):
+    """Test extraction of several region sets from one command line call"""
+    os.chdir(tmp_path)
+    Path("FOO.PRT").write_text(
+        _prt_date_line(0, "1 JAN 2000")
+        + _prt_region_report("FIPNUM", 1, 1000)
+        + _prt_region_report("FIPNUM", 2, 2000)
+        + _prt_region_report("FIPZON", 1, 3000)
+        + _prt_region_report("FIPXYZ", 1, 4000)
+        + RESVOL_TABLE,
+        encoding="utf8",
+    )
+    mocker.patch(
+        "sys.argv",
+        ["prtvol2csv", "FOO.PRT", "--dir", ".", "--fipnames", "FIPNUM", "FIPZON"],
+    )
+    prtvol2csv.main()
+    fipnum_df = pd.read_csv("simulator_volume_fipnum.csv")
+    assert list(fipnum_df["FIPNUM"]) == [1, 2]
+    assert "PORV_TOTAL" in fipnum_df
+    fipzon_df = pd.read_csv("simulator_volume_fipzon.csv")
+    assert list(fipzon_df["FIPZON"]) == [1]
+    assert list(fipzon_df["STOIIP_OIL"]) == [3000]
+    assert "PORV_TOTAL" not in fipzon_df
+    assert not Path("simulator_volume_fipxyz.csv").exists()
+
+    mocker.patch(
+        "sys.argv",
+        [
+            "prtvol2csv",
+            "FOO.PRT",
+            "--dir",
+            ".",
+            "--fipnames",
+            "FIPNUM",
+            "FIPZON",
+            "FIPXYZ",
+            "--longformat",
+            "--outputfilename",
+            "volumes.csv",
+        ],
+    )
+    prtvol2csv.main()
+    long_df = pd.read_csv("volumes.csv")
+    assert list(long_df["FIPNAME"]) == ["FIPNUM", "FIPNUM", "FIPZON", "FIPXYZ"]
+    assert list(long_df["REGION_INDEX"]) == [1, 2, 1, 1]
+    assert list(long_df["STOIIP_OIL"]) == [1000, 2000, 3000, 4000]
+    assert long_df["PORV_TOTAL"].isna().sum() == 2
+
+
+def test_fipnames_lowercase(tmp_path, mocker):
+    """Region set names on the command line are case insensitive"""
+    os.chdir(tmp_path)
+    Path("FOO.PRT").write_text(
+        _prt_date_line(0, "1 JAN 2000")
+        + _prt_region_report("FIPNUM", 1, 1000)
+        + _prt_region_report("FIPZON", 1, 3000)
+        + RESVOL_TABLE,
+        encoding="utf8",
+    )
+    mocker.patch(
+        "sys.argv",
+        ["prtvol2csv", "FOO.PRT", "--dir", ".", "--fipnames", "fipnum", "FipZon"],
+    )
+    prtvol2csv.main()
+    fipnum_df = pd.read_csv("simulator_volume_fipnum.csv")
+    assert list(fipnum_df["FIPNUM"]) == [1]
+    assert "PORV_TOTAL" in fipnum_df
+    fipzon_df = pd.read_csv("simulator_volume_fipzon.csv")
+    assert list(fipzon_df["FIPZON"]) == [1]
+
+
+@pytest.mark.parametrize(
+    "outputfilename, fipname, expected",
+    [
+        ("simulator_volume_fipnum.csv", "FIPNUM", "simulator_volume_fipnum.csv"),
+        ("simulator_volume_fipnum.csv", "FIPZON", "simulator_volume_fipzon.csv"),
+        ("fipnum/fipnum.csv", "FIPZON", "fipnum/fipzon.csv"),
+        ("volumes.csv", "FIPZON", "volumes_fipzon.csv"),
+        ("volumes", "FIPZON", "volumes_fipzon"),
+    ],
+)
+def test_fipname_outputfilename(outputfilename, fipname, expected):
+    """Test how output filenames are derived for other region sets"""
+    assert prtvol2csv.fipname_outputfilename(outputfilename, fipname) == expected
+
+
 def test_prtvol2csv(tmp_path, mocker):
     """Test invocation from command line"""
     prtfile = TESTDATADIR / "2_R001_REEK-0.PRT"
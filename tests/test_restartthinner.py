@@ -1,9 +1,12 @@
+import datetime
 import os
 import shutil
 import subprocess
 from pathlib import Path
 
+import numpy as np
 import pytest
+import resfo
 
 from subscript.restartthinner import restartthinner
 
@@ -12,6 +15,32 @@ ECLDIR = Path(__file__).absolute().parent / "data/reek/eclipse/model"
 UNRST_FNAME = "2_R001_REEK-0.UNRST"
 
 
+def _write_unrst(filename, dates, seqnum_step=1):
+    """Write a minimal unified restart file with one report step per date"""
+    keywords = []
+    for idx, date in enumerate(dates):
+        intehead = np.zeros(411, dtype=np.int32)
+        intehead[64:67] = [date.day, date.month, date.year]
+        intehead[94] = 100  # Eclipse 100
+        doubhead = np.zeros(229, dtype=np.float64)
+        doubhead[0] = (date - dates[0]).days
+        keywords += [
+            ("SEQNUM  ", np.array([idx * seqnum_step], dtype=np.int32)),
+            ("INTEHEAD", intehead),
+            ("LOGIHEAD", np.zeros(121, dtype=bool)),
+            ("DOUBHEAD", doubhead),
+            ("STARTSOL", resfo.MESS),
+            ("PRESSURE", np.full(10, float(idx), dtype=np.float32)),
+            ("ENDSOL  ", resfo.MESS),
+        ]
+    resfo.write(filename, keywords)
+
+
+SYNTHETIC_DATES = [
+    datetime.date(2000, 1, 1) + datetime.timedelta(days=30 * idx) for idx in range(5)
+]
+
+
 def test_dryrun(tmp_path, mocker):
     """Test dry-run"""
     shutil.copyfile(ECLDIR / UNRST_FNAME, tmp_path / UNRST_FNAME)
@@ -92,6 +121,243 @@ def test_get_restart_indices_filenotfound(tmp_path):
         restartthinner.get_restart_indices("FOO.UNRST")
 
 
+def test_unrst_report_blocks(tmp_path):
+    """Report step locations are found from the SEQNUM keywords"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES, seqnum_step=3)
+    blocks = restartthinner.unrst_report_blocks("SYNTH.UNRST")
+    assert [block[0] for block in blocks] == [0, 3, 6, 9, 12]
+    assert blocks[0][1] == 0
+    assert blocks[-1][2] == Path("SYNTH.UNRST").stat().st_size
+    for previous, current in zip(blocks, blocks[1:]):
+        assert previous[2] == current[1]
+
+
+def test_resfo_repacker(tmp_path):
+    """Only the selected report steps are kept, unmodified"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    original = resfo.read("SYNTH.UNRST")
+    restartthinner.resfo_repacker("SYNTH.UNRST", [0, 2, 4])
+
+    thinned = resfo.read("SYNTH.UNRST")
+    assert len(thinned) == 3 * 7
+    assert [int(array[0]) for kw, array in thinned if kw == "SEQNUM  "] == [0, 2, 4]
+    for (kw, array), (orig_kw, orig_array) in zip(
+        thinned[7:14], original[2 * 7 : 3 * 7]
+    ):
+        assert kw == orig_kw
+        if array is not resfo.MESS:
+            np.testing.assert_array_equal(array, orig_array)
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_unrst_report_dates(tmp_path):
+    """Report steps and dates are read in one pass over the file"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES, seqnum_step=2)
+    report_steps, dates = restartthinner.unrst_report_dates("SYNTH.UNRST")
+    assert report_steps == [0, 2, 4, 6, 8]
+    assert dates.astype(datetime.date).tolist() == SYNTHETIC_DATES
+
+    Path("EMPTY.UNRST").write_bytes(b"")
+    with pytest.raises(ValueError, match="not a unified restart file"):
+        restartthinner.unrst_report_dates("EMPTY.UNRST")
+
+
+def test_formatted_unrst(tmp_path):
+    """Formatted restart files are rejected with a clear error"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    resfo.write("SYNTH.FUNRST", resfo.read("SYNTH.UNRST"), resfo.Format.FORMATTED)
+    with pytest.raises(ValueError, match="formatted restart file"):
+        restartthinner.restartthinner("SYNTH.FUNRST", numberofslices=2, dryrun=False)
+    with pytest.raises(ValueError, match="not an unformatted unified restart file"):
+        restartthinner.unrst_report_dates("SYNTH.FUNRST")
+
+
+@pytest.mark.parametrize(
+    "slicedates, expected",
+    [
+        (["2000-01-01"], [10]),
+        (["1999-01-01"], [10]),
+        (["2030-01-01"], [40]),
+        (["2000-01-16"], [10]),  # Tie, earliest is chosen
+        (["2000-01-17"], [20]),
+        # Distances are counted in whole days, rounded down:
+        (["2000-01-16T12:00"], [10]),
+        (["2000-01-01", "2000-02-20", "2000-12-31"], [10, 30, 40]),
+    ],
+)
+def test_date_slicer(slicedates, expected):
+    """Closest restart dates are picked for each slice date"""
+    restartdates = [
+        datetime.datetime(2000, 1, 1),
+        datetime.datetime(2000, 1, 31),
+        datetime.datetime(2000, 3, 1),
+        datetime.datetime(2000, 3, 31),
+    ]
+    slicedates = [np.datetime64(slicedate, "ns") for slicedate in slicedates]
+    slicemap = restartthinner.date_slicer(slicedates, restartdates, [10, 20, 30, 40])
+    assert list(slicemap.values()) == expected
+
+
+@pytest.mark.parametrize("engine", ["resfo", "resdata"])
+def test_synthetic_first_and_last(engine, tmp_path, mocker):
+    """Thin a synthetic UNRST file through the command line with each engine"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    mocker.patch(
+        "sys.argv", ["restartthinner", "-n", "2", "SYNTH.UNRST", "--engine", engine]
+    )
+    restartthinner.main()
+    assert restartthinner.get_restart_indices("SYNTH.UNRST") == [0, 4]
+
+
+@pytest.mark.parametrize(
+    "kwargs, expected",
+    [
+        ({"numberofslices": 1}, [4]),
+        ({"numberofslices": 3}, [0, 2, 4]),
+        ({"slicedates": [datetime.date(2000, 3, 2)]}, [2]),
+        (
+            {"slicedates": [datetime.date(1990, 1, 1), datetime.date(2000, 1, 5)]},
+            [0],
+        ),
+        ({"frequency": "yearly"}, [0]),
+        ({"frequency": "monthly"}, [0, 1, 2, 3]),
+        ({"every": 2}, [0, 2, 4]),
+        ({"every": 3}, [0, 3]),
+        ({"every": 10}, [0]),
+        # every takes precedence:
+        ({"every": 2, "numberofslices": 2}, [0, 2, 4]),
+    ],
+)
+def test_select_report_steps(kwargs, expected):
+    """Test the thinning policies"""
+    assert (
+        restartthinner.select_report_steps([0, 1, 2, 3, 4], SYNTHETIC_DATES, **kwargs)
+        == expected
+    )
+
+
+def test_select_report_steps_bad_frequency():
+    with pytest.raises(ValueError, match="Unsupported frequency"):
+        restartthinner.select_report_steps(
+            [0, 1, 2, 3, 4], SYNTHETIC_DATES, frequency="weekly"
+        )
+
+
+@pytest.mark.parametrize(
+    "policy_args, expected",
+    [
+        (["--dates", "2000-01-30", "2000-04-25"], [1, 4]),
+        (["--frequency", "monthly"], [0, 1, 2, 3]),
+        (["--every", "4"], [0, 4]),
+    ],
+)
+def test_policies_command_line(policy_args, expected, tmp_path, mocker):
+    """Thinning policies from the command line"""
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    mocker.patch("sys.argv", ["restartthinner", "SYNTH.UNRST", *policy_args])
+    restartthinner.main()
+    assert restartthinner.get_restart_indices("SYNTH.UNRST") == expected
+
+
+def test_policies_mutually_exclusive(tmp_path, mocker):
+    os.chdir(tmp_path)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    mocker.patch(
+        "sys.argv", ["restartthinner", "-n", "2", "--every", "2", "SYNTH.UNRST"]
+    )
+    with pytest.raises(SystemExit):
+        restartthinner.main()
+    mocker.patch("sys.argv", ["restartthinner", "SYNTH.UNRST"])
+    with pytest.raises(SystemExit):
+        restartthinner.main()
+    assert len(restartthinner.get_restart_indices("SYNTH.UNRST")) == 5
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ensemble(jobs, tmp_path, mocker):
+    """Thin UNRST files for multiple realizations from a glob pattern"""
+    os.chdir(tmp_path)
+    for real in range(3):
+        modeldir = Path(f"realization-{real}/iter-0/eclipse/model")
+        modeldir.mkdir(parents=True)
+        _write_unrst(modeldir / "SYNTH.UNRST", SYNTHETIC_DATES)
+    pattern = "realization-*/iter-0/eclipse/model/SYNTH.UNRST"
+    mocker.patch(
+        "sys.argv", ["restartthinner", "-n", "2", "--jobs", str(jobs), pattern]
+    )
+    restartthinner.main()
+    for real in range(3):
+        assert restartthinner.get_restart_indices(
+            f"realization-{real}/iter-0/eclipse/model/SYNTH.UNRST"
+        ) == [0, 4]
+
+
+def test_ensemble_no_matches(tmp_path, mocker, capsys):
+    """A glob pattern matching no files is an error"""
+    os.chdir(tmp_path)
+    mocker.patch("sys.argv", ["restartthinner", "-n", "2", "realization-*/SYNTH.UNRST"])
+    with pytest.raises(SystemExit) as excinfo:
+        restartthinner.main()
+    assert excinfo.value.code == 1
+    assert "No UNRST files matching" in capsys.readouterr().out
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ensemble_failure(jobs, tmp_path):
+    """One bad realization does not stop the others from being thinned, and
+    files outside a realization directory are skipped"""
+    os.chdir(tmp_path)
+    for real in [0, 2]:
+        Path(f"realization-{real}").mkdir()
+        _write_unrst(f"realization-{real}/SYNTH.UNRST", SYNTHETIC_DATES)
+    _write_unrst("SYNTH.UNRST", SYNTHETIC_DATES)
+    filenames = [
+        "realization-0/SYNTH.UNRST",
+        "realization-1/SYNTH.UNRST",
+        "realization-2/SYNTH.UNRST",
+        "SYNTH.UNRST",
+    ]
+    thinned = restartthinner.restartthinner_ensemble(
+        filenames,
+        jobs=jobs,
+        numberofslices=0,
+        dryrun=False,
+        every=2,
+    )
+    assert thinned == dict(zip(filenames, [[0, 2, 4], None, [0, 2, 4], None]))
+    assert restartthinner.get_restart_indices("realization-2/SYNTH.UNRST") == [
+        0,
+        2,
+        4,
+    ]
+    assert len(restartthinner.get_restart_indices("SYNTH.UNRST")) == 5
+
+
+def test_ensemble_exit(tmp_path, mocker):
+    """A realization exiting does not stop the ensemble"""
+    os.chdir(tmp_path)
+    for real in range(2):
+        Path(f"realization-{real}").mkdir()
+        _write_unrst(f"realization-{real}/SYNTH.UNRST", SYNTHETIC_DATES)
+    mocker.patch(
+        "subscript.restartthinner.restartthinner.resfo_repacker",
+        side_effect=[SystemExit("ERROR: Could not repack"), None],
+    )
+    thinned = restartthinner.restartthinner_ensemble(
+        ["realization-0/SYNTH.UNRST", "realization-1/SYNTH.UNRST"],
+        numberofslices=2,
+        dryrun=False,
+    )
+    assert thinned["realization-0/SYNTH.UNRST"] is None
+    assert thinned["realization-1/SYNTH.UNRST"] == [0, 4]
+
+
 @pytest.mark.integration
 def test_integration():
     """Test that the endpoint is installed, and the binary tools are available"""
@@ -186,6 +186,44 @@ from subscript.rmsecl_volumetrics.rmsecl_volumetrics import (
                 },
             ],
         ),
+        # One set, facies in volumetrics are summed and then dropped:
+        (
+            [{"SET": 0, "REGION": "A", "ZONE": "U", "FIPNUM": 1}],
+            [{"FIPNUM": 1, "STOIIP_OIL": 1100}],
+            [
+                {"REGION": "A", "ZONE": "U", "FACIES": "Sand", "STOIIP_OIL": 600},
+                {"REGION": "A", "ZONE": "U", "FACIES": "Shale", "STOIIP_OIL": 400},
+            ],
+            [
+                {
+                    "SET": 0,
+                    "ECL_STOIIP_OIL": 1100,
+                    "RMS_STOIIP_OIL": 1000,
+                    "DIFF_STOIIP_OIL": 100,
+                }
+            ],
+        ),
+        # Two sets, where only one has data on both sides:
+        (
+            [
+                {"SET": 0, "REGION": "A", "ZONE": "U", "FIPNUM": 1},
+                {"SET": 1, "REGION": "B", "ZONE": "U", "FIPNUM": 2},
+                {"SET": 2, "REGION": "C", "ZONE": "U", "FIPNUM": 3},
+            ],
+            [{"FIPNUM": 1, "STOIIP_OIL": 1100}, {"FIPNUM": 2, "STOIIP_OIL": 1100}],
+            [
+                {"REGION": "A", "ZONE": "U", "STOIIP_OIL": 1000},
+                {"REGION": "C", "ZONE": "U", "STOIIP_OIL": 1000},
+            ],
+            [
+                {
+                    "SET": 0,
+                    "ECL_STOIIP_OIL": 1100,
+                    "RMS_STOIIP_OIL": 1000,
+                    "DIFF_STOIIP_OIL": 100,
+                }
+            ],
+        ),
         # One set, one region, one zone, but the FIPNUM data is mismatched:
         (
             [{"SET": 0, "REGION": "A", "ZONE": "U", "FIPNUM": 1}],
@@ -510,3 +548,116 @@ fipnum2zone:
 
     sets_fromdisk = yaml.safe_load(Path("sets.yml").read_text(encoding="utf8"))
     assert sets_fromdisk == {0: {"FIPNUM": [1], "REGION": ["1"], "ZONE": ["UpperReek"]}}
+
+
+def _write_ensemble(reals):
+    """Write PRT files and RMS volumetrics for some realizations, and a
+    FIPNUM mapping, in the current directory"""
+    # pylint: disable=line-too-long
+    for real in reals:
+        realdir = Path(f"realization-{real}/iter-0")
+        realdir.mkdir(parents=True)
+        (realdir / "FOO.PRT").write_text(
+            f"""
+  REPORT   0     1 JAN 2000
+                                                =================================
+                                                : FIPNUM  REPORT REGION    1    :
+                           :--------------- OIL    SM3  ---------------:-- WAT    SM3  -:--------------- GAS    SM3  ---------------:
+                           :     LIQUID         VAPOUR         TOTAL   :       TOTAL    :       FREE      DISSOLVED         TOTAL   :
+ :-------------------------:-------------------------------------------:----------------:-------------------------------------------:
+ :CURRENTLY IN PLACE       :          {100 + real}.                         {100 + real}.:           200. :           400.           0.           400.:
+ :-------------------------:-------------------------------------------:----------------:-------------------------------------------:
+""",  # noqa
+            encoding="utf8",
+        )
+        (realdir / "volumetrics_sim_oil_1.txt").write_text(
+            f"""
+   Zone      Region index          Bulk                Pore                Hcpv               Stoiip
+UpperReek  1                             500.0              400.                300.00              {100 + 2 * real}
+""",  # noqa
+            encoding="utf8",
+        )
+    Path("fipmap_config.yml").write_text(
+        """
+fipnum2region:
+  1: 1
+fipnum2zone:
+  1: UpperReek""",
+        encoding="utf8",
+    )
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ensemble(jobs, tmp_path, mocker):
+    """Test comparing volumetrics for multiple realizations in one run"""
+    os.chdir(tmp_path)
+    _write_ensemble([0, 1, 10])
+    mocker.patch(
+        "sys.argv",
+        [
+            "rmsecl_volumetrics",
+            "realization-*/iter-0/FOO.PRT",
+            "realization-*/iter-0/volumetrics_sim",
+            "fipmap_config.yml",
+            "--output",
+            "volcomp.csv",
+            "--jobs",
+            str(jobs),
+        ],
+    )
+    main()
+    df_fromdisk = pd.read_csv("volcomp.csv")
+    assert list(df_fromdisk.columns[:2]) == ["REAL", "SET"]
+    assert list(df_fromdisk["REAL"]) == [0, 1, 10]
+    assert list(df_fromdisk["ECL_STOIIP_OIL"]) == [100, 101, 110]
+    assert list(df_fromdisk["DIFF_STOIIP_OIL"]) == [0, -1, -10]
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_ensemble_broken_realization(jobs, tmp_path, mocker, caplog):
+    """A realization that fails is logged and left out"""
+    os.chdir(tmp_path)
+    _write_ensemble([0, 1, 2])
+    Path("realization-1/iter-0/volumetrics_sim_oil_1.txt").unlink()
+    mocker.patch(
+        "sys.argv",
+        [
+            "rmsecl_volumetrics",
+            "realization-*/iter-0/FOO.PRT",
+            "realization-*/iter-0/volumetrics_sim",
+            "fipmap_config.yml",
+            "--output",
+            "volcomp.csv",
+            "--jobs",
+            str(jobs),
+        ],
+    )
+    main()
+    assert list(pd.read_csv("volcomp.csv")["REAL"]) == [0, 2]
+    if jobs == 1:
+        # Log records from worker processes are not captured
+        assert "Skipping realization 1" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "prtfile", ["realization-*/iter-0/FOO.PRT", "realization-*/iter-1/FOO.PRT"]
+)
+def test_ensemble_nothing_to_compare(prtfile, tmp_path, mocker, caplog):
+    """No realizations left to compare is an error"""
+    os.chdir(tmp_path)
+    _write_ensemble([0, 1])
+    for real in [0, 1]:
+        Path(f"realization-{real}/iter-0/volumetrics_sim_oil_1.txt").unlink()
+    mocker.patch(
+        "sys.argv",
+        [
+            "rmsecl_volumetrics",
+            prtfile,
+            "realization-*/iter-0/volumetrics_sim",
+            "fipmap_config.yml",
+        ],
+    )
+    with pytest.raises(SystemExit) as excinfo:
+        main()
+    assert excinfo.value.code == 1
+    assert "No volumetrics to compare" in caplog.text
@@ -1,14 +1,17 @@
 import datetime
 import os
+import random
 import shutil
 import subprocess
 from pathlib import Path
 
 import pytest  # noqa: F401
 import yaml
+from opm.io.parser import Parser
 from pydantic import ValidationError
 
 from subscript.sunsch import sunsch
+from subscript.sunsch.time_vector import TimeVector, split_deck
 
 DATADIR = Path(__file__).absolute().parent / "testdata_sunsch"
 
@@ -528,6 +531,120 @@ def test_sch_file_nonempty(tmp_path):
     assert sunsch.sch_file_nonempty("wconprod.sch")
 
 
+def test_parse_sch_file(tmp_path):
+    """Test that one parse gives both emptiness and the first keyword"""
+    os.chdir(tmp_path)
+
+    Path("commentonly.sch").write_text("-- an Eclipse comment", encoding="utf8")
+    parsed = sunsch.parse_sch_file("commentonly.sch")
+    assert not parsed.nonempty
+    assert not parsed.starts_with_dates
+
+    Path("dates.sch").write_text("DATES\n 1 NOV 2080 / \n/", encoding="utf8")
+    parsed = sunsch.parse_sch_file("dates.sch")
+    assert parsed.nonempty
+    assert parsed.starts_with_dates
+    assert parsed.blocks == [(None, []), (datetime.datetime(2080, 11, 1), [])]
+
+    Path("wconprod.sch").write_text("WCONPROD\n A ORAT 0 / \n/", encoding="utf8")
+    parsed = sunsch.parse_sch_file("wconprod.sch")
+    assert parsed.nonempty
+    assert not parsed.starts_with_dates
+
+
+def test_timevector_load_blocks():
+    """The keyword blocks of a parsed deck load like the string"""
+    deck_string = "DATES\n 1 NOV 2080 / \n/\nWCONPROD\n A ORAT 0 / \n/"
+    expected = TimeVector(datetime.date(2080, 1, 1))
+    expected.load_string(deck_string)
+
+    deck = Parser().parse_string(deck_string)
+    from_blocks = TimeVector(datetime.date(2080, 1, 1))
+    from_blocks.load_blocks(split_deck(deck))
+    assert str(from_blocks) == str(expected)
+
+
+def test_files_parsed_once(testdata, mocker):
+    """Each file in the configuration is parsed only once, also when it is
+    inserted multiple times"""
+    parse_spy = mocker.spy(sunsch, "parse_sch_file")
+    sunsch.process_sch_config(
+        yaml.safe_load(Path("config.yml").read_text(encoding="utf8"))
+    )
+    parsed_files = [str(call.args[0]) for call in parse_spy.call_args_list]
+    assert len(parsed_files) == len(set(parsed_files))
+    assert parsed_files.count("foo1.sch") == 1
+
+
+def test_cachedir(testdata, mocker):
+    """Test that parsed files are cached by content, and that the schedule from
+    cached files is the same as from parsing"""
+    sch_conf = yaml.safe_load(Path("config.yml").read_text(encoding="utf8"))
+    expected = str(sunsch.process_sch_config(sch_conf))
+
+    Path("cache").mkdir()
+    sch_conf["cachedir"] = "cache"
+    assert str(sunsch.process_sch_config(sch_conf)) == expected
+    # One entry for each of emptyinit.sch, mergeme.sch, foo1.sch (inserted
+    # twice) and the substituted template:
+    cached = sorted(Path("cache").glob("*.json"))
+    assert len(cached) == 4
+    assert not list(Path("cache").glob("*.tmp"))
+
+    parser_spy = mocker.spy(sunsch, "Parser")
+    assert str(sunsch.process_sch_config(sch_conf)) == expected
+    assert parser_spy.call_count == 0
+
+    # Other substitution values give another entry:
+    sch_conf["insert"][-1]["substitute"]["ORAT"] = 4000
+    assert "4000" in str(sunsch.process_sch_config(sch_conf))
+    assert len(list(Path("cache").glob("*.json"))) == 5
+
+
+def test_cachedir_include(tmp_path):
+    """Files with INCLUDE are not cached, as they depend on other files"""
+    os.chdir(tmp_path)
+    Path("cache").mkdir()
+    Path("wells.sch").write_text("WCONPROD\n A ORAT 0 / \n/", encoding="utf8")
+    Path("main.sch").write_text("INCLUDE\n 'wells.sch' /\n", encoding="utf8")
+    assert sunsch.parse_sch_file("main.sch", "cache").nonempty
+    assert sunsch.parse_sch_file("wells.sch", "cache").nonempty
+    assert len(list(Path("cache").glob("*.json"))) == 1
+
+
+def test_cachedir_cold_and_warm(tmp_path):
+    """A file parsed from a cold and a warm cache gives the same schedule,
+    and the cache directory is created when missing"""
+    os.chdir(tmp_path)
+    Path("wells.sch").write_text(
+        "WCONPROD\n A ORAT 0 / \n/\nDATES\n 1 NOV 2080 / \n/\n"
+        "-- a comment\nWELSPECS\n A G 1 1 1* OIL /\n/",
+        encoding="utf8",
+    )
+    schedules = []
+    for _ in range(2):
+        parsed = sunsch.parse_sch_file("wells.sch", "cache/nested")
+        schedule = TimeVector(datetime.date(2080, 1, 1))
+        schedule.load_blocks(parsed.blocks, datetime.datetime(2080, 1, 1))
+        schedules.append(schedule)
+    assert len(list(Path("cache/nested").glob("*.json"))) == 1
+    cold, warm = schedules
+    assert str(cold) == str(warm)
+    for keyword in ["WCONPROD", "WELSPECS", "DATES"]:
+        assert [keyword in step for step in cold] == [keyword in step for step in warm]
+    assert "WCONPROD" in warm[0]
+    assert "WELSPECS" in warm[1]
+
+
+def test_cachedir_write_error(tmp_path, caplog):
+    """Failing to write to the cache is only a warning"""
+    os.chdir(tmp_path)
+    Path("cache").write_text("not a directory", encoding="utf8")
+    Path("wells.sch").write_text("WCONPROD\n A ORAT 0 / \n/", encoding="utf8")
+    assert sunsch.parse_sch_file("wells.sch", "cache/nested").nonempty
+    assert "Could not cache parse of wells.sch" in caplog.text
+
+
 def test_emptyfiles(tmp_path):
     """Test that we don't crash when we try to include files
     which are empty (or only contains comments)"""
@@ -652,6 +769,26 @@ def test_dategrid():
         )
 
 
+def test_timevector_many_dates():
+    """Benchmark a TimeVector with 10k dates inserted and deleted in random
+    order, which must stay chronological. Each insert and delete bisects into
+    the sorted time steps, this takes well below a second."""
+    startdate = datetime.datetime(2000, 1, 1)
+    dates = [startdate + datetime.timedelta(days=day) for day in range(1, 10001)]
+    random.Random(0).shuffle(dates)
+    schedule = TimeVector(startdate)
+    for date in dates:
+        schedule.add_keywords(date, [])
+    assert len(schedule) == 10001
+    assert schedule.dates == sorted(dates + [startdate])
+    assert [schedule[index].dt for index in range(len(schedule))] == schedule.dates
+
+    for date in dates[:5000]:
+        schedule.delete(date)
+    assert schedule.dates == sorted(dates[5000:] + [startdate])
+    assert [schedule[index].dt for index in range(len(schedule))] == schedule.dates
+
+
 def test_wrap_long_lines():
     """Test that lines that are excessively long gets wrapped.
 
@@ -48,3 +48,97 @@ def run_simulator(simulator, data_file_path):
         print(result.stdout.decode())
         print(result.stderr.decode())
         raise AssertionError(f"reservoir simulator failed in {getcwd()}")
+
+
+def write_gravity_case(basename, dates, dims=(4, 3, 2), aquifer_cells=(), seed=0):
+    """Write a small synthetic flow simulation case for gravity and
+    subsidence modelling, with EGRID, INIT and UNRST files
+
+    The grid is a regular box with 100 x 100 x 10 m cells, with its top at
+    1000 m depth and its origin at (460000, 5930000). Cell 5 is inactive.
+    The restart file has one report step for each date, with random fluid
+    in place, densities, pressures and pore volumes.
+
+    Args:
+        basename (str): Path without extension for the files to write.
+        dates (list): Dates (datetime.date) for the report steps.
+        dims (tuple): Grid dimensions.
+        aquifer_cells (tuple): Active indices for numerical aquifer cells.
+        seed (int): Seed for the random restart data.
+    """
+    # pylint: disable=import-outside-toplevel
+    import numpy as np
+    import resfo
+
+    nx, ny, nz = dims
+    cell_dx, cell_dy, cell_dz, top = 100.0, 100.0, 10.0, 1000.0
+    xs = 460000.0 + cell_dx * np.arange(nx + 1)
+    ys = 5930000.0 + cell_dy * np.arange(ny + 1)
+    coord = np.zeros((ny + 1, nx + 1, 6), dtype=np.float32)
+    coord[:, :, [0, 3]] = xs[np.newaxis, :, np.newaxis]
+    coord[:, :, [1, 4]] = ys[:, np.newaxis, np.newaxis]
+    coord[:, :, 2] = top
+    coord[:, :, 5] = top + nz * cell_dz
+    zcorn = np.zeros((nz, 2, ny, 2, nx, 2), dtype=np.float32)
+    for k in range(nz):
+        zcorn[k, 0] = top + k * cell_dz
+        zcorn[k, 1] = top + (k + 1) * cell_dz
+    actnum = np.ones(nx * ny * nz, dtype=np.int32)
+    actnum[5] = 0
+    nactive = int(actnum.sum())
+
+    gridhead = np.zeros(100, dtype=np.int32)
+    gridhead[0:4] = [1, nx, ny, nz]
+    filehead = np.zeros(100, dtype=np.int32)
+    filehead[0:2] = [3, 2007]
+    resfo.write(
+        basename + ".EGRID",
+        [
+            ("FILEHEAD", filehead),
+            ("GRIDUNIT", ["METRES  ", "        "]),
+            ("GRIDHEAD", gridhead),
+            ("COORD   ", coord.ravel()),
+            ("ZCORN   ", zcorn.ravel()),
+            ("ACTNUM  ", actnum),
+            ("ENDGRID ", np.array([0], dtype=np.int32)),
+        ],
+    )
+
+    intehead = np.zeros(411, dtype=np.int32)
+    intehead[8:12] = [nx, ny, nz, nactive]
+    intehead[14] = 7  # Oil, water and gas
+    intehead[94] = 100  # Eclipse 100
+    aquifern = np.zeros(nactive, dtype=np.int32)
+    aquifern[list(aquifer_cells)] = -1
+    resfo.write(
+        basename + ".INIT",
+        [
+            ("INTEHEAD", intehead),
+            ("LOGIHEAD", np.zeros(121, dtype=bool)),
+            ("DOUBHEAD", np.zeros(229)),
+            ("PORV    ", np.where(actnum, 1e5, 0).astype(np.float32)),
+            ("AQUIFERN", aquifern),
+        ],
+    )
+
+    rng = np.random.default_rng(seed)
+    keywords = []
+    for report_step, date in enumerate(dates):
+        intehead[64:67] = [date.day, date.month, date.year]
+        keywords += [
+            ("SEQNUM  ", np.array([report_step], dtype=np.int32)),
+            ("INTEHEAD", intehead.copy()),
+            ("LOGIHEAD", np.zeros(121, dtype=bool)),
+            ("DOUBHEAD", np.zeros(229)),
+            ("STARTSOL", resfo.MESS),
+            ("PRESSURE", rng.uniform(200, 300, nactive).astype(np.float32)),
+            ("RPORV   ", rng.uniform(0.9e5, 1.1e5, nactive).astype(np.float32)),
+            ("RFIPOIL ", rng.uniform(0, 5e4, nactive).astype(np.float32)),
+            ("RFIPGAS ", rng.uniform(0, 2e4, nactive).astype(np.float32)),
+            ("RFIPWAT ", rng.uniform(0, 5e4, nactive).astype(np.float32)),
+            ("OIL_DEN ", rng.uniform(700, 800, nactive).astype(np.float32)),
+            ("GAS_DEN ", rng.uniform(100, 200, nactive).astype(np.float32)),
+            ("WAT_DEN ", rng.uniform(1000, 1050, nactive).astype(np.float32)),
+            ("ENDSOL  ", resfo.MESS),
+        ]
+    resfo.write(basename + ".UNRST", keywords)